@@ -0,0 +1,182 @@
+"""
+A persistent index of the documents stored in a directory.
+
+The catalog lets a server list its documents on startup without loading
+them. It is kept as a log of changes to its entries, appended to whenever a
+document is saved, and rewritten once most of the log is out of date.
+"""
+import os
+import cPickle as pickle
+from collections import namedtuple
+from time import time
+from urllib import pathname2url
+
+from colliberation.docformat import DocumentFormatError, read_header
+from colliberation.journal import make_record, read_records
+from colliberation.serializer import file_url, replace_file
+
+CATALOG_NAME = 'catalog.idx'
+
+# Record types
+PUT = 1
+DELETE = 2
+
+#: Records the catalog holds beyond twice its entries before it is rewritten.
+COMPACT_SLACK = 1000
+
+#: An entry of the catalog.
+CatalogEntry = namedtuple('CatalogEntry', [
+    'id', 'name', 'version', 'size', 'mtime', 'url'
+])
+
+
+class CatalogIndex(object):
+
+    """ Index of the id, name, version, size, modification time and url of
+    each stored document.
+
+    :param str path: The catalog file. It is created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # document id : CatalogEntry
+        self.ids = {}  # url : document id
+        self.sequence = 0
+        self.records = 0
+        self.log_file = None
+        self.dirty = False
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return self.entries.itervalues()
+
+    def __contains__(self, document_id):
+        return document_id in self.entries
+
+    def get(self, document_id):
+        return self.entries.get(document_id)
+
+    def load(self):
+        valid_bytes = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as log_file:
+                for valid_bytes, sequence, record_type, payload in \
+                        read_records(log_file):
+                    self.sequence = sequence
+                    self.records += 1
+                    self.apply(record_type, pickle.loads(payload))
+            with open(self.path, 'r+b') as log_file:
+                log_file.truncate(valid_bytes)
+        self.log_file = open(self.path, 'ab')
+
+    def apply(self, record_type, value):
+        if record_type == PUT:
+            entry = CatalogEntry(*value)
+            previous = self.entries.get(entry.id)
+            if previous is not None:
+                self.ids.pop(previous.url, None)
+            self.entries[entry.id] = entry
+            self.ids[entry.url] = entry.id
+        elif record_type == DELETE:
+            entry = self.entries.pop(value, None)
+            if entry is not None:
+                self.ids.pop(entry.url, None)
+
+    # Changes
+    def put(self, document, size=None):
+        """ Add or update the entry of a document.
+        """
+        if size is None:
+            size = len(document.content)
+        entry = CatalogEntry(document.id, document.name, document.version,
+                             size, time(), document.url)
+        self.append(PUT, tuple(entry))
+
+    def delete(self, document_id):
+        if document_id in self.entries:
+            self.append(DELETE, document_id)
+
+    def delete_url(self, url):
+        document_id = self.ids.get(url)
+        if document_id is not None:
+            self.delete(document_id)
+
+    def append(self, record_type, value):
+        self.sequence += 1
+        self.records += 1
+        self.log_file.write(make_record(
+            self.sequence, record_type,
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        ))
+        self.apply(record_type, value)
+        self.dirty = True
+        if self.records > 2 * len(self.entries) + COMPACT_SLACK:
+            self.compact()
+
+    def sync(self):
+        """ Sync changes made since the last sync to disk.
+        """
+        if self.dirty:
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+            self.dirty = False
+
+    def compact(self):
+        """ Rewrite the catalog with one record per entry.
+        """
+        self.log_file.close()
+        self.sequence = 0
+        with open(self.path + '.tmp', 'wb') as log_file:
+            for entry in self.entries.itervalues():
+                self.sequence += 1
+                log_file.write(make_record(
+                    self.sequence, PUT,
+                    pickle.dumps(tuple(entry), pickle.HIGHEST_PROTOCOL)
+                ))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        replace_file(self.path + '.tmp', self.path)
+        self.records = len(self.entries)
+        self.log_file = open(self.path, 'ab')
+        self.dirty = False
+
+    def reconcile(self, directory, extension):
+        """ Bring the catalog in line with the documents in a directory.
+
+        Entries of files which no longer exist are removed, and files missing
+        from the catalog, such as those written just before a crash, are
+        added from their headers. Only the directory listing is read for
+        documents already in the catalog.
+        """
+        base_url = file_url(directory).rstrip('/') + '/'
+        urls = {}
+        for name in os.listdir(directory):
+            if name.endswith(extension):
+                urls[base_url + pathname2url(name)] = os.path.join(directory,
+                                                                   name)
+
+        for entry in self.entries.values():
+            if urls.pop(entry.url, None) is None:
+                self.delete(entry.id)
+
+        for url, path in urls.iteritems():
+            try:
+                with open(path, 'rb') as file_handle:
+                    header = read_header(file_handle)
+            except (IOError, DocumentFormatError):
+                continue
+            self.append(PUT, tuple(CatalogEntry(
+                header.id, header.name, header.version, header.size,
+                os.path.getmtime(path), url
+            )))
+        self.sync()
+
+    def close(self):
+        if self.log_file is not None:
+            self.sync()
+            self.log_file.close()
+            self.log_file = None
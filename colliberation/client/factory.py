@@ -2,20 +2,27 @@ from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 from colliberation.client.protocol import CollabClientProtocol
+from colliberation.plugin import PluginLoader
 
 
 class CollabClientFactory(ReconnectingClientFactory):
 
     """
     A factory which produces collaboration clients.
+
+    When a connection is remade, the new protocol takes over the session
+    token and documents of the previous one, so that the server may resume
+    the session rather than have every document opened from scratch.
     """
 
     nextid = 0
     client_class = CollabClientProtocol
 
-    def __init__(self):
+    def __init__(self, plugins=None):
+        self.plugins = plugins or PluginLoader().discover()
         self.protocols = {}
         self.deferreds = {}
+        self.sessions = {}  # destination : last protocol
 
     def connect_to_server(self, address, port):
         """ Connect to a server. """
@@ -25,11 +32,25 @@ class CollabClientFactory(ReconnectingClientFactory):
         return deferred
 
     def buildProtocol(self, destination):
-        protocol = self.client_class()
-        protocol.factory = self
         key = destination.host + str(destination.port)
+        previous = self.sessions.get(key)
+        if previous is None:
+            protocol = self.client_class(plugins=self.plugins)
+        else:
+            protocol = self.client_class(
+                plugins=self.plugins,
+                session=previous.session,
+                open_docs=previous.open_docs,
+                shadow_docs=previous.shadow_docs,
+                available_docs=previous.available_docs
+            )
+        protocol.factory = self
         self.protocols[key] = protocol
+        self.sessions[key] = protocol
+        self.resetDelay()
 
-        deferred = self.deferreds[key]
-        deferred.callback(protocol)
+        # Only the first connection fires the deferred.
+        deferred = self.deferreds.pop(key, None)
+        if deferred is not None:
+            deferred.callback(protocol)
         return protocol
@@ -0,0 +1,178 @@
+"""
+A compact binary format for storing documents on disk.
+
+A document file starts with a fixed size header, holding the document's id
+and version, and the lengths of the name, metadata and content that follow
+it, in that order. Content may be compressed with zlib, and is checksummed.
+
+    +-----------------+------+----------+---------+
+    | header          | name | metadata | content |
+    | (HEADER_SIZE)   |      | (pickle) |         |
+    +-----------------+------+----------+---------+
+
+Because the name and metadata come before the content, everything but the
+content can be read without reading the rest of the file.
+"""
+import cPickle as pickle
+from collections import namedtuple
+from zlib import compress, crc32, decompress
+
+from construct import Container, Magic, Struct, UBInt8, UBInt32, UBInt64
+
+from colliberation.document import Document
+
+FORMAT_VERSION = 1
+MAGIC = 'CLBD'
+
+#: Suggested smallest content to compress, in bytes. Compression makes
+#: files about ten times smaller, but saves several times slower.
+COMPRESS_THRESHOLD = 4096
+COMPRESSION_LEVEL = 1
+
+# Flags
+COMPRESSED = 0x01
+#: The content, or the name, was unicode, and is stored encoded as utf-8.
+UNICODE_CONTENT = 0x02
+UNICODE_NAME = 0x04
+
+header = Struct('header',
+                Magic(MAGIC),
+                UBInt8('format'),
+                UBInt8('flags'),
+                UBInt32('id'),
+                UBInt32('version'),
+                UBInt64('sequence'),
+                UBInt32('name_length'),
+                UBInt32('metadata_length'),
+                UBInt64('content_length'),
+                UBInt64('size'),
+                UBInt32('checksum')
+                )
+
+HEADER_SIZE = header.sizeof()
+
+#: Everything stored about a document, other than its content.
+DocumentHeader = namedtuple('DocumentHeader', [
+    'id', 'name', 'version', 'metadata', 'sequence', 'size', 'compressed'
+])
+
+
+class DocumentFormatError(Exception):
+
+    """ Raised when a file isn't a valid document file.
+    """
+
+
+def is_document_file(file_handle):
+    """ Check whether a file is in the binary document format.
+
+    The file's position is left unchanged.
+    """
+    position = file_handle.tell()
+    magic = file_handle.read(len(MAGIC))
+    file_handle.seek(position)
+    return magic == MAGIC
+
+
+def write_document(file_handle, document, sequence=0,
+                   compress_threshold=None):
+    """ Write a document to a file opened in binary mode.
+
+    :param int sequence: Last journal record contained in the document, for
+        journal snapshots.
+    :param compress_threshold: Smallest content that is compressed, or None
+        to never compress.
+    """
+    flags = 0
+    name = document.name
+    if isinstance(name, unicode):
+        flags |= UNICODE_NAME
+        name = name.encode('utf-8')
+    metadata = pickle.dumps(document.metadata, pickle.HIGHEST_PROTOCOL)
+    content = document.content
+    if isinstance(content, unicode):
+        flags |= UNICODE_CONTENT
+        content = content.encode('utf-8')
+
+    stored = content
+    if compress_threshold is not None and len(content) >= compress_threshold:
+        flags |= COMPRESSED
+        stored = compress(content, COMPRESSION_LEVEL)
+
+    file_handle.write(header.build(Container(
+        format=FORMAT_VERSION,
+        flags=flags,
+        id=document.id,
+        version=document.version,
+        sequence=sequence,
+        name_length=len(name),
+        metadata_length=len(metadata),
+        content_length=len(stored),
+        size=len(content),
+        checksum=crc32(stored) & 0xffffffff
+    )))
+    file_handle.write(name)
+    file_handle.write(metadata)
+    file_handle.write(stored)
+
+
+def read_fields(file_handle):
+    """ Read the header, name and metadata of a document file.
+
+    Returns the parsed header and a DocumentHeader.
+    """
+    data = file_handle.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE or not data.startswith(MAGIC):
+        raise DocumentFormatError('Not a document file')
+    fields = header.parse(data)
+    if fields.format > FORMAT_VERSION:
+        raise DocumentFormatError(
+            'Unknown document format {0}'.format(fields.format))
+
+    name = file_handle.read(fields.name_length)
+    metadata = file_handle.read(fields.metadata_length)
+    if len(metadata) < fields.metadata_length:
+        raise DocumentFormatError('Truncated document file')
+    if fields.flags & UNICODE_NAME:
+        name = name.decode('utf-8')
+
+    return fields, DocumentHeader(
+        id=fields.id,
+        name=name,
+        version=fields.version,
+        metadata=pickle.loads(metadata),
+        sequence=fields.sequence,
+        size=fields.size,
+        compressed=bool(fields.flags & COMPRESSED)
+    )
+
+
+def read_header(file_handle):
+    """ Read everything but the content of a document file.
+
+    Returns a DocumentHeader.
+    """
+    return read_fields(file_handle)[1]
+
+
+def read_document(file_handle, doc_class=Document):
+    """ Read a whole document file.
+
+    Returns the document, and its DocumentHeader.
+    """
+    fields, document_header = read_fields(file_handle)
+    stored = file_handle.read(fields.content_length)
+    if (len(stored) < fields.content_length or
+            crc32(stored) & 0xffffffff != fields.checksum):
+        raise DocumentFormatError('Corrupt document content')
+    if document_header.compressed:
+        stored = decompress(stored)
+    if fields.flags & UNICODE_CONTENT:
+        stored = stored.decode('utf-8')
+
+    document = doc_class(name=document_header.name,
+                         content=stored,
+                         version=document_header.version,
+                         metadata=document_header.metadata)
+    document.id = document_header.id
+    return document, document_header
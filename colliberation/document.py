@@ -1,5 +1,6 @@
 from zope.interface import implements
 
+from colliberation.history import NoSuchVersion, VersionHistory
 from colliberation.interfaces import IDocument
 
 from diff_match_patch import diff_match_patch as DMP
@@ -8,7 +9,7 @@ from copy import deepcopy
 from twisted.internet.defer import Deferred
 
 
-DOC_TEXT_CHANGE_LOG = 'Changing document text at {0}:{1} to "{2}"'
+DOC_TEXT_CHANGE_LOG = 'Changing document text at {0}:{1} to {2!r}'
 DOC_TEXT_DELETED_LOG = 'Deleting document text at {0}:{1}'
 
 
@@ -22,6 +23,8 @@ class Document(object):
     implements(IDocument)
 
     state_deferral = None
+    # Created on the first commit, see VersionHistory.
+    history = None
 
     def __init__(self, **kwargs):
         self.id = kwargs.get('id', 0)
@@ -82,6 +85,18 @@ class Document(object):
                         self.content[end:]
                         )
 
+    def apply_edits(self, edits):
+        """ Apply a sequence of edits to the document's content.
+
+        :param edits: An iterable of (start, text, end) tuples, each replacing
+            the content between start and end with text.
+        """
+        for start, text, end in edits:
+            if text:
+                self.change_text(start, text, end)
+            else:
+                self.delete_text(start, end)
+
     def diff(self, text, dmp):
         """
         Generates list of diffs from the documents content against
@@ -108,6 +123,39 @@ class Document(object):
             print("Patch results: " + str(results))
         return results
 
+    def commit(self):
+        """ Record the document's current state as a new version.
+        """
+        if self.history is None:
+            self.history = VersionHistory()
+        if self.history:
+            self.version = max(self.version, self.history.versions()[-1] + 1)
+        self.history.commit(self.version, self.content, self.name,
+                            deepcopy(self.metadata))
+
+    def revert(self, version):
+        """ Restore the state of a committed version.
+
+        The restored state is committed as a new version, so versions never
+        go backwards. Raises NoSuchVersion if the version isn't available.
+        """
+        data = self.retrieve_version_data(version)
+        self.name = data['name']
+        self.content = data['content']
+        self.metadata = deepcopy(data['metadata'])
+        self.version += 1
+        self.commit()
+
+    def available_versions(self):
+        if self.history is None:
+            return []
+        return self.history.versions()
+
+    def retrieve_version_data(self, version):
+        if self.history is None:
+            raise NoSuchVersion(version)
+        return self.history.retrieve(version)
+
     def update(self, document):
         """ Updates this document to match the other document
         """
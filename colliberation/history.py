@@ -0,0 +1,172 @@
+"""
+Version history of a document, stored as reverse deltas.
+
+Only the newest version of a document is stored whole. Each older version is
+stored as a delta which turns the version after it back into it, except for
+every keyframe_interval'th version, which is stored whole as a keyframe.
+Retrieving a version therefore applies at most keyframe_interval - 1 deltas,
+however long the history is.
+
+A delta is a tuple of operations on the newer content: a positive integer
+keeps that many characters, a negative integer deletes that many, and a
+string inserts itself.
+"""
+from bisect import bisect_left
+
+from colliberation.patching import dmp
+
+#: Versions kept by default, as the "revision limit" setting.
+REVISION_LIMIT = 20
+KEYFRAME_INTERVAL = 10
+
+
+class NoSuchVersion(Exception):
+
+    """ Raised when a version of a document isn't in its history.
+    """
+
+
+class Revision(object):
+
+    """ A version of a document in a VersionHistory.
+
+    Exactly one of content and delta is set.
+    """
+    __slots__ = ('name', 'metadata', 'content', 'delta')
+
+    def __init__(self, name, metadata, content=None, delta=None):
+        self.name = name
+        self.metadata = metadata
+        self.content = content
+        self.delta = delta
+
+    @property
+    def keyframe(self):
+        return self.delta is None
+
+    def size(self):
+        """ Approximate bytes of content stored for this revision.
+        """
+        if self.delta is None:
+            return len(self.content)
+        return sum(len(op) if isinstance(op, basestring) else 4
+                   for op in self.delta)
+
+
+def make_delta(new_content, old_content):
+    """ Make a delta which turns new_content into old_content.
+    """
+    delta = []
+    for op, text in dmp.diff_main(new_content, old_content):
+        if op == dmp.DIFF_EQUAL:
+            delta.append(len(text))
+        elif op == dmp.DIFF_DELETE:
+            delta.append(-len(text))
+        else:
+            delta.append(text)
+    return tuple(delta)
+
+
+def apply_delta(content, delta):
+    parts = []
+    position = 0
+    for op in delta:
+        if isinstance(op, basestring):
+            parts.append(op)
+        elif op > 0:
+            parts.append(content[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(parts)
+
+
+class VersionHistory(object):
+
+    """ The last few committed versions of a document.
+
+    :param int limit: Versions to keep. Older versions are forgotten as new
+        ones are committed.
+    :param int keyframe_interval: Store every keyframe_interval'th version
+        whole, bounding the deltas applied to retrieve a version.
+    """
+
+    def __init__(self, limit=REVISION_LIMIT,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        self.limit = limit
+        self.keyframe_interval = keyframe_interval
+        self.order = []  # versions, oldest first
+        self.revisions = {}  # version : Revision
+        self.commits = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, version):
+        return version in self.revisions
+
+    def versions(self):
+        return list(self.order)
+
+    def commit(self, version, content, name='', metadata=None):
+        """ Record a new version, which must be newer than the others.
+        """
+        if self.order:
+            latest_version = self.order[-1]
+            if version <= latest_version:
+                raise ValueError('Version {0} is not newer than {1}'.format(
+                    version, latest_version))
+            latest = self.revisions[latest_version]
+            # The previous head is kept whole if it is a keyframe.
+            if self.commits % self.keyframe_interval:
+                latest.delta = make_delta(content, latest.content)
+                latest.content = None
+
+        self.commits += 1
+        self.order.append(version)
+        self.revisions[version] = Revision(name, metadata, content=content)
+        if len(self.order) > self.limit:
+            for old_version in self.order[:-self.limit]:
+                del self.revisions[old_version]
+            del self.order[:-self.limit]
+
+    def retrieve(self, version):
+        """ Return the data of a version, as a dictionary.
+
+        Raises NoSuchVersion if the version isn't in the history.
+        """
+        if version not in self.revisions:
+            raise NoSuchVersion(version)
+
+        # Walk towards newer versions until a keyframe is found, then apply
+        # the deltas passed on the way back.
+        deltas = []
+        index = bisect_left(self.order, version)
+        revision = self.revisions[version]
+        while not revision.keyframe:
+            deltas.append(revision.delta)
+            index += 1
+            revision = self.revisions[self.order[index]]
+        content = revision.content
+        for delta in reversed(deltas):
+            content = apply_delta(content, delta)
+
+        revision = self.revisions[version]
+        return {
+            'name': revision.name,
+            'content': content,
+            'version': version,
+            'metadata': revision.metadata,
+        }
+
+    def stored_bytes(self):
+        return sum(revision.size() for revision in self.revisions.itervalues())
+
+    def stats(self):
+        keyframes = sum(1 for revision in self.revisions.itervalues()
+                        if revision.keyframe)
+        return {
+            'versions': len(self.revisions),
+            'keyframes': keyframes,
+            'stored bytes': self.stored_bytes(),
+        }
@@ -130,6 +130,10 @@ class IDocumentSerializer(Interface):
         """
 
 # Event Hooks
+# Hook methods return (proceed, cancel, data), as the hooks in a protocol's
+# hook lists do, and may return a Deferred firing with it.
+# Each section maps its interfaces to the protocol hook list they join, and
+# the method called on plugins providing them.
 event_hooks = {}  # Updated below, after each section of plugins
 
 # Document event hooks
@@ -189,7 +193,14 @@ class IDocDeletedHook(Interface):
         :param Document document: The document the request refers to.
         """
 
-document_hooks = {}
+document_hooks = {
+    IDocOpenedHook: ('doc_open_hooks', 'document_opened'),
+    IDocClosedHook: ('doc_close_hooks', 'document_closed'),
+    IDocSavedHook: ('doc_save_hooks', 'document_saved'),
+    IDocAddedHook: ('doc_add_hooks', 'document_added'),
+    IDocDeletedHook: ('doc_delete_hooks', 'document_deleted'),
+}
+event_hooks.update(document_hooks)
 
 # Document data event hooks
 
@@ -223,16 +234,13 @@ class INameChangedHook(Interface):
 
 class IMetadataChangedHook(Interface):
 
-    def metadata_changed(protocol, document, type, key, value):
+    def metadata_changed(protocol, document):
         """ Interface for plugins interested in requests to change
         a document's metadata.
 
         :param CollaborationProtocol protocol: The protocol requesting
             the text change.
         :param Document document: The document the request refers to.
-        :param str type: The type of the key.
-        :param str key: The metadata key.
-        :param str value: The value for the key.
         """
 
 
@@ -248,6 +256,14 @@ class IVersionChangedHook(Interface):
         :param int new_version: The new version of the document.
         """
 
+content_hooks = {
+    ITextChangedHook: ('text_mod_hooks', 'text_changed'),
+    INameChangedHook: ('name_mod_hooks', 'name_changed'),
+    IMetadataChangedHook: ('metadata_mod_hooks', 'metadata_changed'),
+    IVersionChangedHook: ('version_mod_hooks', 'version_changed'),
+}
+event_hooks.update(content_hooks)
+
 # Misc event hooks
 
 
@@ -264,12 +280,15 @@ class IMessageHook(Interface):
 
 class IErrorHook(Interface):
 
-    def error_recieved(protocol, error_type, message):
+    def error_recieved(protocol, message):
         """ Interface for plugins interested in protocol error messages.
 
         :param CollaborationProtocol protocol: The protocol requesting
             sending the error message.
-        :param int error_type: The error type.
         :param str message: The error message.
         """
-misc_hooks = {}
+misc_hooks = {
+    IMessageHook: ('message_hooks', 'message_recieved'),
+    IErrorHook: ('error_hooks', 'error_recieved'),
+}
+event_hooks.update(misc_hooks)
@@ -0,0 +1,459 @@
+"""
+A document serializer built on a write-ahead log of edits, with snapshots.
+
+Each document is stored as two files, a snapshot of the whole document, in
+the format of colliberation.docformat, and a log of the edits made since.
+Every edit applied to a document is appended to its log, so saving only has
+to sync the log to disk, and edits are kept even if the server never gets
+to save. Once a log outgrows its snapshot, a new snapshot is taken and the
+log is emptied.
+
+Loading a document reads its snapshot and replays its log.
+"""
+import os
+import cPickle as pickle
+import struct
+from glob import glob
+from zlib import crc32
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.python import log
+from zope.interface import implements
+
+from colliberation.docformat import read_document, write_document
+from colliberation.document import Document
+from colliberation.interfaces import IDocumentSerializer
+from colliberation.serializer import file_path, file_url, replace_file
+from colliberation.workers import ThreadExecutor
+
+SNAPSHOT_EXTENSION = '.doc'
+LOG_EXTENSION = '.log'
+
+#: Smallest a log may grow before a snapshot is taken, in bytes.
+MIN_LOG_BYTES = 64 * 1024
+
+#: Most records a log may hold before a snapshot is taken. Replaying an edit
+#: moves the rest of the document, so this bounds the time spent recovering
+#: large documents.
+MAX_LOG_RECORDS = 1000
+
+#: Seconds that saves are grouped for before the journal is synced.
+GROUP_COMMIT_WINDOW = 0.01
+
+# Record types
+EDIT = 1
+STATE = 2
+
+# checksum, sequence number, record type, payload length
+RECORD_HEADER = struct.Struct('>IQBI')
+EDIT_HEADER = struct.Struct('>II')  # start, end
+
+
+def document_state(document):
+    return {
+        'name': document.name,
+        'version': document.version,
+        'metadata': document.metadata,
+    }
+
+
+def detached_copy(document):
+    """ Copy the parts of a document that are journaled.
+
+    Anything else the document refers to, such as the Deferred of an open
+    document, is left behind.
+    """
+    return Document(id=document.id, name=document.name,
+                    content=document.content, version=document.version,
+                    url=document.url, metadata=dict(document.metadata))
+
+
+def encode_text(text):
+    """ Return text as utf-8 bytes, for a record.
+
+    Edits made from the wire are unicode, while other text may already be
+    bytes.
+    """
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def make_record(sequence, record_type, payload):
+    header = RECORD_HEADER.pack(0, sequence, record_type, len(payload))
+    checksum = crc32(header[4:] + payload) & 0xffffffff
+    return struct.pack('>I', checksum) + header[4:] + payload
+
+
+def read_records(log_file):
+    """ Yield the (offset, sequence, type, payload) of each record in a log.
+
+    Reading stops at the first incomplete or corrupt record, which is what a
+    crash in the middle of an append leaves behind.
+    """
+    offset = 0
+    while True:
+        header = log_file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        checksum, sequence, record_type, length = RECORD_HEADER.unpack(header)
+        payload = log_file.read(length)
+        if (len(payload) < length or
+                crc32(header[4:] + payload) & 0xffffffff != checksum):
+            return
+        offset += RECORD_HEADER.size + length
+        yield offset, sequence, record_type, payload
+
+
+class JournalSerializer(object):
+
+    """ Saves documents as snapshots plus a write-ahead log of their edits.
+
+    :param directory: Where documents without a url are stored, and where
+        recover() looks for documents.
+    :param int min_log_bytes: Smallest size a log may grow to before a new
+        snapshot is taken. Past that, a snapshot is taken once the log is as
+        large as the document, keeping the cost of snapshots proportional to
+        the edits made.
+    :param int max_log_records: Records a log may hold before a snapshot is
+        taken, whatever its size.
+    :param catalog: A CatalogIndex kept up to date with every snapshot and
+        save, and synced along with the logs.
+    """
+    implements(IDocumentSerializer)
+
+    doc_class = Document
+
+    def __init__(self, directory, min_log_bytes=MIN_LOG_BYTES,
+                 max_log_records=MAX_LOG_RECORDS, catalog=None):
+        self.directory = directory
+        self.catalog = catalog
+        self.min_log_bytes = min_log_bytes
+        self.max_log_records = max_log_records
+        self.logs = {}  # snapshot path : open log file
+        self.sequences = {}  # snapshot path : last sequence number
+        self.log_sizes = {}  # snapshot path : bytes in log
+        self.log_records = {}  # snapshot path : records in log
+        self.unsynced = set()  # snapshot paths with logs to sync
+
+        # Metrics
+        self.records = 0
+        self.snapshots = 0
+        self.syncs = 0
+
+    def url_for(self, document_id):
+        """ Return the url a document is stored at, if it has none of its own.
+        """
+        path = os.path.join(self.directory, '{0}{1}'.format(
+            document_id, SNAPSHOT_EXTENSION))
+        return file_url(path)
+
+    # IDocumentSerializer
+    def load_document(self, url):
+        path = file_path(url)
+        with open(path, 'rb') as snapshot_file:
+            document, header = read_document(snapshot_file, self.doc_class)
+        document.url = url
+        content = list(document.content)
+        sequence = header.sequence
+
+        valid_bytes = 0
+        records = 0
+        if os.path.exists(path + LOG_EXTENSION):
+            with open(path + LOG_EXTENSION, 'rb') as log_file:
+                for valid_bytes, record_sequence, record_type, payload in \
+                        read_records(log_file):
+                    records += 1
+                    if record_sequence <= sequence:
+                        # Already part of the snapshot.
+                        continue
+                    sequence = record_sequence
+                    self.replay(document, content, record_type, payload)
+
+            # Drop any partly written record, so appends follow valid ones.
+            with open(path + LOG_EXTENSION, 'r+b') as log_file:
+                log_file.truncate(valid_bytes)
+
+        document.content = ''.join(content)
+        self.sequences[path] = sequence
+        self.log_sizes[path] = valid_bytes
+        self.log_records[path] = records
+        return document
+
+    def save_document(self, document):
+        """ Make a document's edits durable.
+
+        Documents new to the journal are snapshotted. Otherwise only
+        the document's name, version and metadata are appended to its log,
+        and the log is synced to disk.
+        """
+        self.write_document(document)
+        self.sync()
+
+    def delete_document(self, url):
+        path = file_path(url)
+        self.close_log(path)
+        self.unsynced.discard(path)
+        self.sequences.pop(path, None)
+        self.log_sizes.pop(path, None)
+        self.log_records.pop(path, None)
+        for name in (path, path + LOG_EXTENSION):
+            if os.path.exists(name):
+                os.remove(name)
+        if self.catalog is not None:
+            self.catalog.delete_url(url)
+
+    # Journal
+    def write_document(self, document):
+        """ Like save_document, without syncing the log to disk.
+        """
+        path = file_path(document.url)
+        if path not in self.sequences:
+            self.snapshot(document)
+            return
+
+        self.append(document, [make_record(
+            self.next_sequence(path), STATE,
+            pickle.dumps(document_state(document), pickle.HIGHEST_PROTOCOL)
+        )])
+        self.unsynced.add(path)
+        if self.catalog is not None:
+            self.catalog.put(document)
+
+    def sync(self):
+        """ Sync every log written to since the last sync to disk.
+        """
+        for path in self.unsynced:
+            log_file = self.logs.get(path)
+            if log_file is not None:
+                log_file.flush()
+                os.fsync(log_file.fileno())
+                self.syncs += 1
+        self.unsynced.clear()
+        if self.catalog is not None:
+            self.catalog.sync()
+
+    def log_edits(self, document, edits):
+        """ Append edits applied to a document to its log.
+
+        :param edits: (start, text, end) tuples, as given to
+            Document.apply_edits.
+        """
+        path = file_path(document.url)
+        if path not in self.sequences:
+            # The document wasn't loaded through this journal, so its log
+            # can't be trusted. The snapshot holds the edits anyway.
+            self.snapshot(document)
+            return
+
+        records = []
+        for start, text, end in edits:
+            records.append(make_record(
+                self.next_sequence(path), EDIT,
+                EDIT_HEADER.pack(start, end) + encode_text(text)
+            ))
+        self.append(document, records)
+        self.logs[path].flush()
+
+        if (self.log_records[path] > self.max_log_records or
+                self.log_sizes[path] > max(self.min_log_bytes,
+                                           len(document.content))):
+            self.snapshot(document)
+
+    def snapshot(self, document):
+        """ Write a whole document to its snapshot, and empty its log.
+
+        The snapshot is written beside the old one, then renamed over it.
+        A crash before the log is emptied is harmless, as the snapshot holds
+        the sequence number of the last edit it contains.
+        """
+        path = file_path(document.url)
+        if path not in self.sequences and os.path.exists(path + LOG_EXTENSION):
+            # A stale log restarts at sequence 0 with the new snapshot, so it
+            # is emptied first.
+            open(path + LOG_EXTENSION, 'wb').close()
+        sequence = self.sequences.get(path, 0)
+        with open(path + '.tmp', 'wb') as snapshot_file:
+            write_document(snapshot_file, document, sequence)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        replace_file(path + '.tmp', path)
+
+        self.close_log(path)
+        self.unsynced.discard(path)
+        open(path + LOG_EXTENSION, 'wb').close()
+        self.sequences[path] = sequence
+        self.log_sizes[path] = 0
+        self.log_records[path] = 0
+        self.snapshots += 1
+        if self.catalog is not None:
+            self.catalog.put(document)
+
+    def recover(self):
+        """ Load every document stored in the directory.
+
+        Returns a dictionary of documents by id.
+        """
+        documents = {}
+        pattern = os.path.join(self.directory, '*' + SNAPSHOT_EXTENSION)
+        for path in glob(pattern):
+            document = self.load_document(file_url(path))
+            documents[document.id] = document
+        return documents
+
+    def close(self):
+        for path in self.logs.keys():
+            self.close_log(path)
+        if self.catalog is not None:
+            self.catalog.close()
+
+    def replay(self, document, content, record_type, payload):
+        """ Apply a log record to a document being loaded.
+
+        Edits are applied to content, a list of the document's characters,
+        which is cheaper to edit in place than building a new string for
+        every edit. Edit offsets count characters, not bytes, so multibyte
+        text is decoded before it is put in place.
+        """
+        if record_type == EDIT:
+            start, end = EDIT_HEADER.unpack_from(payload)
+            content[start:end] = payload[EDIT_HEADER.size:].decode('utf-8')
+        elif record_type == STATE:
+            state = pickle.loads(payload)
+            document.name = state['name']
+            document.version = state['version']
+            document.metadata = state['metadata']
+
+    def append(self, document, records):
+        path = file_path(document.url)
+        log_file = self.logs.get(path)
+        if log_file is None:
+            log_file = self.logs[path] = open(path + LOG_EXTENSION, 'ab')
+        data = ''.join(records)
+        log_file.write(data)
+        self.log_sizes[path] = self.log_sizes.get(path, 0) + len(data)
+        self.log_records[path] = self.log_records.get(path, 0) + len(records)
+        self.records += len(records)
+
+    def next_sequence(self, path):
+        sequence = self.sequences.get(path, 0) + 1
+        self.sequences[path] = sequence
+        return sequence
+
+    def close_log(self, path):
+        log_file = self.logs.pop(path, None)
+        if log_file is not None:
+            log_file.close()
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'snapshots': self.snapshots,
+            'syncs': self.syncs,
+            'open logs': len(self.logs),
+            'log bytes': sum(self.log_sizes.itervalues()),
+        }
+
+
+class GroupCommitSerializer(object):
+
+    """ Runs a JournalSerializer off the reactor thread, syncing in groups.
+
+    Every method returns a Deferred. Journal work is run by the executor,
+    one job at a time, and documents are copied on the reactor thread before
+    being handed over, so later edits can't leak into what is written.
+
+    Saves don't sync the journal individually. Instead, the saves made
+    within a window are written, then every log they touched is synced once,
+    and all of their Deferreds fire together.
+
+    :param journal: The JournalSerializer to run.
+    :param float window: Seconds saves are grouped for.
+    :param executor: Runs journal work, defaults to a single thread.
+    """
+    implements(IDocumentSerializer)
+
+    def __init__(self, journal, window=GROUP_COMMIT_WINDOW, executor=None,
+                 clock=reactor):
+        self.journal = journal
+        self.window = window
+        self.executor = executor or ThreadExecutor(1)
+        self.clock = clock
+        self.waiting = []  # Deferreds of saves waiting for the next commit
+        self.commit_call = None
+
+        # Metrics
+        self.saves = 0
+        self.commits = 0
+
+    def url_for(self, document_id):
+        return self.journal.url_for(document_id)
+
+    def recover(self):
+        """ Load every journaled document, synchronously.
+
+        Only meant to be called while the server is starting.
+        """
+        return self.journal.recover()
+
+    # IDocumentSerializer
+    def load_document(self, url):
+        return self.executor.run(self.journal.load_document, url)
+
+    def save_document(self, document):
+        """ Save a document in the next group commit.
+
+        Returns a Deferred firing once the document's edits are on disk.
+        """
+        self.saves += 1
+        written = self.executor.run(self.journal.write_document,
+                                    detached_copy(document))
+        saved = Deferred()
+        self.waiting.append((written, saved))
+        if self.commit_call is None:
+            self.commit_call = self.clock.callLater(self.window, self.commit)
+        return saved
+
+    def delete_document(self, url):
+        return self.executor.run(self.journal.delete_document, url)
+
+    # Journal
+    def log_edits(self, document, edits):
+        deferred = self.executor.run(self.journal.log_edits,
+                                     detached_copy(document), list(edits))
+        deferred.addErrback(log.err, 'Failed to log edits')
+        return deferred
+
+    def commit(self):
+        """ Sync the journal, then report the waiting saves as done.
+
+        The sync runs after every write queued before it, so once it
+        finishes each waiting save has either been written and synced, or
+        failed.
+        """
+        self.commit_call = None
+        self.commits += 1
+        waiting, self.waiting = self.waiting, []
+        synced = self.executor.run(self.journal.sync)
+        synced.addBoth(self.committed, waiting)
+        return synced
+
+    def committed(self, result, waiting):
+        for written, saved in waiting:
+            written.addCallback(lambda _: result)
+            written.chainDeferred(saved)
+
+    def close(self):
+        """ Finish any queued work, and close the journal.
+        """
+        if self.commit_call is not None:
+            self.commit_call.cancel()
+            self.commit()
+        self.executor.stop()
+        self.journal.close()
+
+    def stats(self):
+        stats = self.journal.stats()
+        stats.update({'saves': self.saves, 'commits': self.commits})
+        return stats
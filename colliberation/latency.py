@@ -0,0 +1,56 @@
+"""
+Round trip time estimates, from timestamped pings.
+"""
+
+#: Pings carry milliseconds, wrapped to 32 bits.
+TIMESTAMP_MASK = 0xffffffff
+
+
+def timestamp(clock):
+    """ Return the clock's time as a ping timestamp, which is never 0.
+    """
+    return int(clock.seconds() * 1000) & TIMESTAMP_MASK or 1
+
+
+def elapsed(clock, sent):
+    """ Return the seconds since a ping timestamp.
+    """
+    return ((timestamp(clock) - sent) & TIMESTAMP_MASK) / 1000.0
+
+
+class RoundTripStats(object):
+
+    """ Smoothed round trip time and jitter of a connection.
+
+    Samples are averaged as TCP does (RFC 6298): the smoothed round trip
+    time moves an eighth of the way towards each sample, and the jitter,
+    the mean deviation of the samples, a quarter of the way.
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.jitter = None
+        self.last = None
+        self.samples = 0
+
+    def sample(self, rtt):
+        """ Account for a round trip of rtt seconds.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.jitter = rtt / 2
+        else:
+            self.jitter += (abs(self.srtt - rtt) - self.jitter) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        self.last = rtt
+        self.samples += 1
+
+    def stats(self):
+        def millis(seconds):
+            return None if seconds is None else round(seconds * 1000, 1)
+        return {
+            'rtt ms': millis(self.srtt),
+            'jitter ms': millis(self.jitter),
+            'last rtt ms': millis(self.last),
+            'samples': self.samples,
+        }
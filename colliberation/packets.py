@@ -1,6 +1,6 @@
 from construct import Struct, Container
 from construct import Embed, Switch, OptionalGreedyRange
-from construct import UBInt32, UBInt8, PascalString
+from construct import UBInt32, UBInt16, UBInt8, PascalString, PrefixedArray
 """
 Packets for the collaboration protocol.
 Overall layout/design, as well as most functions, are based on
@@ -23,11 +23,21 @@ handshake = Struct('handshake',
                    )
 """
 
+#: The session is empty for a new connection, or the token of a session to
+#: resume. The server answers with the token of the connection's session.
 handshake = Struct('handshake',
-                   PascalString('username')
+                   PascalString('username'),
+                   PascalString('session')
                    )
 
-ping = Struct('ping')
+#: A ping with a sent timestamp asks for an echo. The echo is a ping
+#: carrying that timestamp, whose sender measures the round trip from it.
+#: Pings with neither only keep the connection alive. Timestamps are in
+#: milliseconds, see colliberation.latency.
+ping = Struct('ping',
+              UBInt32('sent'),
+              UBInt32('echo')
+              )
 
 # A regular message
 message = Struct('message',
@@ -80,7 +90,8 @@ name_modified = Struct('name_modified',
 #: Signals that text has been modified
 text_modified = Struct('text_modified',
                        Embed(document_action),
-                       PascalString('modifications'),
+                       PascalString('modifications',
+                                    length_field=UBInt32('length')),
                        PascalString('hash')
                        )
 
@@ -97,6 +108,40 @@ version_modified = Struct('version_modified',
                           UBInt32('new_version')
                           )
 
+#: A connection's cursors and selections in a document. The server fills in
+#: the sending connection's id and username, and only the latest presence of
+#: each connection in each document is passed on. No regions means the
+#: connection has left the document. Multiple cursors can make for hundreds
+#: of regions, so up to MAX_REGIONS are sent.
+presence = Struct('presence',
+                  UBInt32('document_id'),
+                  UBInt32('connection'),
+                  PascalString('username'),
+                  PrefixedArray(Struct('regions',
+                                       UBInt32('start'),
+                                       UBInt32('end')),
+                                UBInt16('region_count'))
+                  )
+MAX_REGIONS = 0xffff
+
+# Cluster Action Packets
+
+#: Identifies a cluster node by the address its peers connect to.
+node_address = Struct('node_address',
+                      PascalString('host'),
+                      UBInt32('port')
+                      )
+
+#: Signals that a node has joined (or is a member of) the cluster.
+node_joined = Struct('node_joined',
+                     Embed(node_address)
+                     )
+
+#: Signals that a node is leaving the cluster.
+node_left = Struct('node_left',
+                   Embed(node_address)
+                   )
+
 
 #: Packet Header definitions
 packets = {
@@ -117,7 +162,12 @@ packets = {
     #: Document Content Action Packets
     20: text_modified,
     21: metadata_modified,
-    22: version_modified
+    22: version_modified,
+    23: presence,
+
+    #: Cluster Action Packets
+    30: node_joined,
+    31: node_left,
 }
 
 #: Packets by name
@@ -185,6 +235,17 @@ def parse_packets_incrementally(bytestream):
         yield header, payload
 
 
+def build_packet(header, payload):
+    """
+    Constructs a packet bytestream from a packet header and a parsed payload.
+
+    This is the inverse of parse_packets, and is used to pass packets on
+    without knowing their names.
+    """
+
+    return chr(header) + packets[header].build(payload)
+
+
 def make_packet(packet, *args, **kwargs):
     """
     Constructs a packet bytestream from a packet header and payload.
@@ -0,0 +1,265 @@
+"""
+Patch parsing and manipulation utilities.
+"""
+from collections import OrderedDict
+
+from diff_match_patch import diff_match_patch as DMP
+
+PATCH_CACHE_SIZE = 128
+
+dmp = DMP()
+
+#: Applies patches wherever their context can be found.
+flexible_dmp = DMP()
+
+#: Only applies patches whose context matches exactly.
+fragile_dmp = DMP()
+fragile_dmp.Match_Threshold = 0.0
+fragile_dmp.Match_Distance = 0.0
+fragile_dmp.Patch_DeleteThreshold = 0.0
+
+
+class PatchCache(object):
+
+    """ A least recently used cache of parsed patch texts.
+
+    Parsing a patch text is relatively expensive (every hunk is split,
+    unquoted and turned into a patch object), and the same modifications are
+    often received by several connections when they are broadcast. Parsed
+    patches are stored as tuples, so that the same parsed patches may be
+    shared by every caller. diff_match_patch's patch_apply copies the patches
+    it is given, so sharing them is safe.
+    """
+
+    def __init__(self, size=PATCH_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def parse(self, text):
+        """ Parse a patch text, returning a tuple of patch objects.
+
+        :param str text: Textual representation of a list of patches.
+        """
+        entries = self.entries
+        try:
+            patches = entries.pop(text)
+        except KeyError:
+            self.misses += 1
+            patches = tuple(dmp.patch_fromText(text))
+            if len(entries) >= self.size:
+                entries.popitem(last=False)
+        else:
+            self.hits += 1
+        entries[text] = patches
+        return patches
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+patch_cache = PatchCache()
+parse_patches = patch_cache.parse
+
+
+class TextBuffer(object):
+
+    """ A bare piece of text which patches may be applied to.
+
+    diff_match_patch applies patches through a document's change_text and
+    delete_text methods. A TextBuffer provides those methods for plain text,
+    without the logging and bookkeeping a full Document does.
+    """
+
+    def __init__(self, content=''):
+        self.content = content
+
+    def change_text(self, start, text, end):
+        content = self.content
+        self.content = content[:start] + text + content[end:]
+
+    def delete_text(self, start, end):
+        content = self.content
+        self.content = content[:start] + content[end:]
+
+
+def apply_patches(patches, text, dmp=dmp):
+    """ Apply a list of patches to the given text.
+
+    Returns a tuple containing the patched text, and a list of booleans
+    indicating which patches were applied.
+    """
+    text_buffer = TextBuffer(text)
+    new_text, results = dmp.patch_apply(patches, text_buffer)
+    return text_buffer.content, results
+
+
+def trim_edit(text, start, replacement, end):
+    """ Narrow an edit down to the characters it changes.
+
+    Patches replace their context along with the text they change, so the
+    replaced range and its replacement usually share a prefix and suffix.
+
+    :returns: A (start, text, end) edit with the same result on text, or
+        None if the edit changes nothing.
+    """
+    replaced = text[start:end]
+    if replaced == replacement:
+        return None
+    prefix = dmp.diff_commonPrefix(replaced, replacement)
+    if prefix:
+        replaced = replaced[prefix:]
+        replacement = replacement[prefix:]
+        start += prefix
+    suffix = dmp.diff_commonSuffix(replaced, replacement)
+    if suffix:
+        replaced = replaced[:-suffix]
+        replacement = replacement[:-suffix]
+    return start, replacement, start + len(replaced)
+
+
+def replace_edit(text, new_text):
+    """ Return the smallest single edit turning text into new_text, or
+    None if they are equal.
+    """
+    return trim_edit(text, 0, new_text, len(text))
+
+
+class EditBuffer(TextBuffer):
+
+    """ A TextBuffer which records the edits made to it.
+
+    Edits are recorded as (start, text, end) tuples, trimmed to the
+    characters they change, and may be replayed on a document through
+    Document.apply_edits.
+    """
+
+    def __init__(self, content=''):
+        TextBuffer.__init__(self, content)
+        self.edits = []
+
+    def change_text(self, start, text, end):
+        edit = trim_edit(self.content, start, text, end)
+        TextBuffer.change_text(self, start, text, end)
+        if edit is not None:
+            self.edits.append(edit)
+
+    def delete_text(self, start, end):
+        TextBuffer.delete_text(self, start, end)
+        if start < end:
+            self.edits.append((start, '', end))
+
+
+class DiffBuffer(TextBuffer):
+
+    """ A TextBuffer which tracks its changes as diffs against its base text.
+
+    Every edit made to the buffer is folded into a list of diffs between the
+    original text and the current content, without rediffing the two texts.
+    """
+
+    def __init__(self, content=''):
+        TextBuffer.__init__(self, content)
+        if content:
+            self.diffs = [(dmp.DIFF_EQUAL, content)]
+        else:
+            self.diffs = []
+
+    def change_text(self, start, text, end):
+        TextBuffer.change_text(self, start, text, end)
+        self.diffs = edit_diffs(self.diffs, start, end, text)
+
+    def delete_text(self, start, end):
+        TextBuffer.delete_text(self, start, end)
+        self.diffs = edit_diffs(self.diffs, start, end, '')
+
+
+def edit_diffs(diffs, start, end, text):
+    """ Replace a range of the text a list of diffs produces.
+
+    :param diffs: Diffs between a base text and the current text.
+    :param int start: Start of the replaced range, in the current text.
+    :param int end: End of the replaced range, in the current text.
+    :param str text: Text to replace the range with.
+    :returns: Diffs between the base text and the edited text.
+    """
+    result = []
+    position = 0
+    inserted = not text
+    for op, data in diffs:
+        if op == dmp.DIFF_DELETE:
+            result.append((op, data))
+            continue
+
+        length = len(data)
+        head = min(max(start - position, 0), length)
+        tail = min(max(end - position, 0), length)
+        if head:
+            result.append((op, data[:head]))
+        if not inserted and start <= position + length:
+            result.append((dmp.DIFF_INSERT, text))
+            inserted = True
+        if tail > head and op == dmp.DIFF_EQUAL:
+            result.append((dmp.DIFF_DELETE, data[head:tail]))
+        if tail < length:
+            result.append((op, data[tail:]))
+        position += length
+
+    if not inserted:
+        result.append((dmp.DIFF_INSERT, text))
+    return result
+
+
+def compose_patches(text, patch_lists, dmp=dmp):
+    """ Compose a sequence of patch lists into a single list of patches.
+
+    Each list of patches in patch_lists is expected to apply to the text
+    produced by the lists before it, starting with the given base text. The
+    returned patches transform the base text into the text produced by
+    applying every list in turn, so that a backlog of modifications may be
+    applied to a document in a single pass.
+
+    :param str text: The base text the first list of patches applies to.
+    :param patch_lists: An iterable of lists of patches.
+    """
+    diff_buffer = DiffBuffer(text)
+    for patches in patch_lists:
+        dmp.patch_apply(patches, diff_buffer)
+
+    diffs = diff_buffer.diffs
+    dmp.diff_cleanupMerge(diffs)
+    if dmp.diff_text2(diffs) == text:
+        return []
+    return dmp.patch_make(text, diffs)
+
+
+def sync_text(document_text, shadow_text, patches):
+    """ Perform one differential synchronization step on plain text.
+
+    The patches are applied flexibly to the document text and fragilely to
+    the shadow text, and the patches needed to bring the patched shadow up to
+    date with the patched document are computed.
+
+    This function only works on text, so that it may be run outside of the
+    reactor thread, or in another process.
+
+    :returns: A tuple containing the edits made to the document text, the
+        patched shadow text, and the textual outgoing patches.
+    """
+    document_buffer = EditBuffer(document_text)
+    flexible_dmp.patch_apply(patches, document_buffer)
+
+    shadow_buffer = TextBuffer(shadow_text)
+    fragile_dmp.patch_apply(patches, shadow_buffer)
+
+    new_shadow_text = shadow_buffer.content
+    diffs = fragile_dmp.diff_main(new_shadow_text, document_buffer.content)
+    modifications = fragile_dmp.patch_toText(
+        fragile_dmp.patch_make(new_shadow_text, diffs)
+    )
+    return document_buffer.edits, new_shadow_text, modifications
@@ -0,0 +1,175 @@
+"""
+Discovery of hook plugins, in the style of twisted.plugin.
+
+Plugins are objects providing the hook interfaces of
+colliberation.interfaces, found in the modules of a plugin package such as
+colliberation.plugins. Finding them means importing every plugin module,
+so what each module provides is kept in a cache file in the package's
+directories, and modules are only imported again once they change. Until
+then, a plugin's module is only imported the first time one of its hooks
+fires.
+"""
+import cPickle as pickle
+import os
+import sys
+from importlib import import_module
+
+from colliberation.interfaces import event_hooks
+
+#: Index of the plugins in each directory of a plugin package.
+CACHE_NAME = 'dropin.cache'
+
+#: Hook interfaces by name, as stored in the index.
+interfaces = dict((interface.__name__, interface) for interface in event_hooks)
+
+
+def index_module(module):
+    """ Return (attribute, interface names) for the plugins in a module.
+    """
+    plugins = []
+    for attribute, value in sorted(vars(module).iteritems()):
+        provided = [name for name, interface in interfaces.iteritems()
+                    if interface.providedBy(value)]
+        if provided:
+            plugins.append((attribute, sorted(provided)))
+    return plugins
+
+
+class PluginLoader(object):
+
+    """ Finds the hook plugins of a package, and loads them when needed.
+
+    :param str package: The dotted name of the plugin package.
+    """
+
+    def __init__(self, package='colliberation.plugins'):
+        self.package = package
+        self.index = {}  # module name : [(attribute, interface names)]
+        self.loaded = {}  # (module name, attribute) : plugin
+
+        # Metrics
+        self.indexed = 0
+        self.imported = 0
+
+    def discover(self):
+        """ Index the plugin modules, importing only those which changed
+        since the cache was written.
+        """
+        package = import_module(self.package)
+        self.index = {}
+        for directory in package.__path__:
+            if not os.path.isdir(directory):
+                # pluginPackagePaths names the package in every entry of
+                # sys.path, whether it exists there or not.
+                continue
+            self.index.update(self.discover_directory(directory))
+        return self
+
+    def discover_directory(self, directory):
+        cache_path = os.path.join(directory, CACHE_NAME)
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            cache = {}
+
+        found = {}  # module name : (mtime, plugins)
+        for filename in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(filename)
+            if extension != '.py' or name == '__init__':
+                continue
+            mtime = os.path.getmtime(os.path.join(directory, filename))
+            cached = cache.get(name)
+            if cached is not None and cached[0] == mtime:
+                found[name] = cached
+                continue
+            module_name = '{0}.{1}'.format(self.package, name)
+            try:
+                module = import_module(module_name)
+            except Exception as error:
+                print('Plugin module {0} failed to import: {1}'.format(
+                    module_name, error))
+                continue
+            self.indexed += 1
+            found[name] = (mtime, index_module(module))
+
+        if found != cache:
+            # Like twisted.plugin, carry on without a cache where the
+            # directory can't be written to.
+            try:
+                with open(cache_path, 'wb') as cache_file:
+                    pickle.dump(found, cache_file, pickle.HIGHEST_PROTOCOL)
+            except (IOError, OSError):
+                pass
+
+        return dict(('{0}.{1}'.format(self.package, name), plugins)
+                    for name, (mtime, plugins) in found.iteritems())
+
+    def plugins(self, hook_list):
+        """ Return (module name, attribute, method) for the plugins joining
+        a protocol hook list, such as 'doc_open_hooks'.
+        """
+        found = []
+        for module_name, plugins in sorted(self.index.iteritems()):
+            for attribute, provided in plugins:
+                for name in provided:
+                    hooks, method = event_hooks[interfaces[name]]
+                    if hooks == hook_list:
+                        found.append((module_name, attribute, method))
+        return found
+
+    def hook_lists(self):
+        """ Return the names of the hook lists plugins join.
+        """
+        return set(event_hooks[interfaces[name]][0]
+                   for plugins in self.index.itervalues()
+                   for attribute, provided in plugins
+                   for name in provided)
+
+    def hooks(self, hook_list, protocol):
+        """ Return hooks calling the plugins of a hook list for a protocol.
+        """
+        return [PluginHook(self, module_name, attribute, method, protocol)
+                for module_name, attribute, method in self.plugins(hook_list)]
+
+    def load(self, module_name, attribute):
+        """ Return a plugin, importing its module the first time.
+        """
+        key = (module_name, attribute)
+        plugin = self.loaded.get(key)
+        if plugin is None:
+            if module_name not in sys.modules:
+                self.imported += 1
+            plugin = getattr(import_module(module_name), attribute)
+            self.loaded[key] = plugin
+        return plugin
+
+    def stats(self):
+        return {
+            'modules': len(self.index),
+            'plugins': sum(len(plugins)
+                           for plugins in self.index.itervalues()),
+            'indexed': self.indexed,
+            'imported': self.imported,
+            'loaded': len(self.loaded),
+        }
+
+
+class PluginHook(object):
+
+    """ A hook calling a plugin's method, which loads the plugin when it
+    is first called.
+    """
+
+    def __init__(self, loader, module_name, attribute, method, protocol):
+        self.loader = loader
+        self.module_name = module_name
+        self.attribute = attribute
+        self.method = method
+        self.protocol = protocol
+        self.__name__ = attribute
+        self.__module__ = module_name
+
+    def __call__(self, data):
+        plugin = self.loader.load(self.module_name, self.attribute)
+        return getattr(plugin, self.method)(self.protocol, data)
@@ -0,0 +1,10 @@
+"""
+Hook plugins, found by colliberation.plugin.PluginLoader.
+
+Modules in this package, or in any colliberation/plugins directory on the
+path, may provide the hook interfaces of colliberation.interfaces.
+"""
+from twisted.plugin import pluginPackagePaths
+
+__path__.extend(pluginPackagePaths(__name__))
+__all__ = []
@@ -1,37 +1,68 @@
 from twisted.internet.protocol import Protocol
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 from twisted.protocols.policies import TimeoutMixin
 from twisted.internet.task import LoopingCall
+from twisted.python.log import err
 
-from colliberation.packets import parse_packets, make_packet
+from construct import Container
+
+from colliberation.packets import MAX_REGIONS, parse_packets, make_packet
 from colliberation.document import Document
-from colliberation.serializer import DiskSerializer
-from colliberation.utils import pipeline_funcs
+from colliberation.latency import RoundTripStats, elapsed, timestamp
+from colliberation.serializer import BinarySerializer
+from colliberation.patching import (parse_patches, compose_patches,
+                                    sync_text, fragile_dmp)
+from colliberation.utils import compile_hooks, compile_pipeline
+from colliberation.workers import InlineExecutor, JobQueues
 
-from diff_match_patch import diff_match_patch as DMP
 from copy import deepcopy
+from itertools import islice
 
 from warnings import warn
 
-flexible_dmp = DMP()
-fragile_dmp = DMP()
-fragile_dmp.Match_Threshold = 0.0
-fragile_dmp.Match_Distance = 0.0
-fragile_dmp.Patch_DeleteThreshold = 0.0
-
 WAITING_FOR_AUTH = 1
 AUTHORIZED = 2
 
+TEXT_MODIFIED = 20
+
+#: Bounds of the delay before sending modifications, once it follows the
+#: round trip time.
+MIN_SEND_DELAY = .05
+MAX_SEND_DELAY = 1.0
+
+#: Times a synchronization step is run again by the executor, after the
+#: document changed while it ran, before it is run on the reactor thread.
+SYNC_RETRIES = 3
+
+#: Error types sent in error packets.
+SYNC_FAILED = 1
+
 # Logging strings
 DOC_NOT_AVAILABLE = 'Document with ID {0} is not available.'
 DOC_NOT_OPEN = 'Document with ID {0} is not open.'
 
 DEBUG = True
 
+#: The hook lists of a protocol, as passed in its keyword arguments.
+HOOK_NAMES = (
+    'message_hooks', 'error_hooks',
+    'doc_add_hooks', 'doc_delete_hooks', 'doc_save_hooks', 'doc_open_hooks',
+    'doc_close_hooks',
+    'text_mod_hooks', 'name_mod_hooks', 'metadata_mod_hooks',
+    'version_mod_hooks',
+)
+
 
-def log(text):
+def log(text, *args):
+    """ Print a debugging message.
+
+    The message is only formatted with args when debugging is enabled, so
+    callers should pass what they log as args rather than formatting it
+    themselves.
+    """
     if DEBUG:
-        print(text)
+        print(text.format(*args) if args else text)
 
 
 class BaseCollaborationProtocol(Protocol, TimeoutMixin):
@@ -45,6 +76,7 @@ class BaseCollaborationProtocol(Protocol, TimeoutMixin):
     timeout_rate = 60
     send_delay = .25
     connected = False
+    clock = reactor
 
     def __init__(self, **kwargs):
         """ Set up the protocol.
@@ -61,6 +93,9 @@ class BaseCollaborationProtocol(Protocol, TimeoutMixin):
 
         self.buffer = ""
 
+        # Packets held back while a document's hooks run, see suspend.
+        self.suspended = {}  # document id : [(header, payload)]
+
         self.packet_handlers = {
             # Utility actions
             0: self.ping_recieved,
@@ -80,6 +115,7 @@ class BaseCollaborationProtocol(Protocol, TimeoutMixin):
             20: self.text_modified,
             21: self.metadata_modified,
             22: self.version_modified,
+            23: self.presence_changed,
         }
 
     def dataReceived(self, data):
@@ -89,13 +125,40 @@ class BaseCollaborationProtocol(Protocol, TimeoutMixin):
 
         if packets:
             self.resetTimeout()
+            packets = self.coalesce_packets(packets)
 
         for header, payload in packets:
-            if header in self.packet_handlers:
-                self.packet_handlers[header](payload)
-            else:
-                log("Couldn't handle parseable packet %d!" % header)
-                log(payload)
+            self.handle_packet(header, payload)
+
+    def handle_packet(self, header, payload):
+        if 'document_id' in payload and \
+                payload.document_id in self.suspended:
+            self.suspended[payload.document_id].append((header, payload))
+        elif header in self.packet_handlers:
+            self.packet_handlers[header](payload)
+        else:
+            log("Couldn't handle parseable packet {0}!", header)
+            log(payload)
+
+    def suspend(self, document_id, deferred):
+        """ Hold back the packets about a document until deferred fires.
+
+        Packets about other documents are still handled meanwhile. The
+        held back packets are then handled in order, unless one of them
+        suspends the document again.
+        """
+        self.suspended.setdefault(document_id, [])
+        deferred.addBoth(self.resume_document, document_id)
+
+    def resume_document(self, result, document_id):
+        held = self.suspended.pop(document_id, [])
+        while held:
+            header, payload = held.pop(0)
+            self.handle_packet(header, payload)
+            if document_id in self.suspended:
+                self.suspended[document_id][:0] = held
+                break
+        return result
 
     def connectionMade(self):
         self.connected = True
@@ -106,6 +169,14 @@ class BaseCollaborationProtocol(Protocol, TimeoutMixin):
     def timeoutConnection(self):
         self.connected = False
 
+    def coalesce_packets(self, packets):
+        """ Merge packets that may be handled together.
+
+        Called with each batch of packets parsed from the data buffer, before
+        any of them are handled. Returns the list of packets to handle.
+        """
+        return packets
+
     # Misc. event handlers
     def handshake_recieved(self, data):
         raise NotImplementedError
@@ -148,6 +219,9 @@ class BaseCollaborationProtocol(Protocol, TimeoutMixin):
     def version_modified(self, data):
         raise NotImplementedError
 
+    def presence_changed(self, data):
+        raise NotImplementedError
+
 # Generic protocol implementation
 
 
@@ -162,7 +236,7 @@ class CollaborationProtocol(BaseCollaborationProtocol):
     # Template classes
     doc_class = Document
     shadow_class = Document
-    serializer_class = DiskSerializer
+    serializer_class = BinarySerializer
 
     # Default settings
     username = ''
@@ -178,11 +252,26 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         # Internal objects
         self.serializer = self.serializer_class()
 
+        # Diffing and patching is run by the executor, one job at a time
+        # per document.
+        self.executor = kwargs.get('executor') or InlineExecutor()
+        self.job_queues = kwargs.get('job_queues') or JobQueues()
+
         # Client information
         self.state = WAITING_FOR_AUTH
 
+        # Token of the connection's session, see session_started.
+        self.session = kwargs.get('session', '')
+        # Documents held over from a previous connection, whose shadows
+        # haven't been checked against the server's yet.
+        self.unverified = set()
+
+        # Other connections' presence, see presence_changed.
+        self.presence = {}  # document id : {connection id : presence}
+
         # Start pinging server to maintain connection
         self.ping_loop = None
+        self.latency = RoundTripStats()
 
         # Setup hooks
 
@@ -203,7 +292,117 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         self.metadata_mod_hooks = kwargs.get('metadata_mod_hooks', [])
         self.version_mod_hooks = kwargs.get('version_mod_hooks', [])
 
+        # The hook lists compiled into pipelines, see run_hooks. A server
+        # compiles its hooks once and shares them between connections, and
+        # only hook lists which plugins join are compiled for each one.
+        self.hook_timings = kwargs.get('hook_timings')
+        self.plugins = kwargs.get('plugins')
+        self.pipelines = kwargs.get('pipelines')
+        if self.pipelines is None:
+            self.compile_hooks()
+        elif self.plugins is not None and self.plugins.hook_lists():
+            self.compile_hooks(self.plugins.hook_lists())
+
+    def compile_hooks(self, names=HOOK_NAMES):
+        """ Compile hook lists, after they have been changed.
+
+        The plugins of the protocol's PluginLoader join the hook lists of
+        the interfaces they provide.
+        """
+        hooks = {}
+        for name in names:
+            hooks[name] = list(getattr(self, name))
+            if self.plugins is not None:
+                hooks[name].extend(self.plugins.hooks(name, self))
+        pipelines = dict(self.pipelines or {})
+        pipelines.update(compile_hooks(hooks, self.hook_timings))
+        self.pipelines = pipelines
+
+    def run_hooks(self, name, data, func_hooks=None):
+        """ Run data through the pipeline of a hook list, returning the
+        result, or None if a hook cancelled.
+
+        :param str name: The hook list, such as 'doc_open_hooks'.
+        :param list func_hooks: Hooks to run instead of the protocol's.
+        """
+        if func_hooks is None:
+            pipeline = self.pipelines[name]
+        else:
+            pipeline = compile_pipeline(func_hooks, timings=self.hook_timings)
+        if pipeline is None:
+            return data
+        return pipeline(data)
+
+    def after_hooks(self, document_id, result, callback, *args):
+        """ Call callback(result, *args) with what run_hooks returned.
+
+        If asynchronous hooks are still running, the callback is called
+        once they finish, and packets about the document are held back
+        until then, see suspend. Returns the callback's result, or a
+        Deferred firing with it.
+        """
+        if not isinstance(result, Deferred):
+            return callback(result, *args)
+        result.addCallback(callback, *args)
+        if document_id is not None:
+            self.suspend(document_id, result)
+        return result
+
+    def send(self, packet):
+        """ Send a packet to the other end of the connection.
+        """
+        self.transport.write(packet)
+
+    def send_error(self, error_type, message):
+        """ Send an error packet, its message cut to what the packet holds.
+        """
+        self.send(make_packet('error', error_type=error_type,
+                              message=message[:255]))
+
     # Protocol Event Handlers
+    def coalesce_packets(self, packets):
+        """ Merge runs of text_modified packets aimed at the same document.
+
+        Each text_modified packet in a run applies to the shadow produced by
+        the one before it, so a run can be composed into a single set of
+        patches against the current shadow, and applied to the document in
+        one pass. Documents with queued work are left alone, since their
+        shadows are about to change.
+        """
+        coalesced = []
+        run = []
+        for header, payload in packets:
+            if run and (header != TEXT_MODIFIED or
+                        payload.document_id != run[0].document_id):
+                coalesced.append(
+                    (TEXT_MODIFIED, self.merge_text_modified(run)))
+                run = []
+            if (header == TEXT_MODIFIED and
+                    payload.document_id in self.shadow_docs and
+                    not self.job_queues.busy(payload.document_id)):
+                run.append(payload)
+            else:
+                coalesced.append((header, payload))
+        if run:
+            coalesced.append((TEXT_MODIFIED, self.merge_text_modified(run)))
+        return coalesced
+
+    def merge_text_modified(self, run):
+        """ Merge a run of text_modified payloads into a single payload.
+        """
+        if len(run) == 1:
+            return run[0]
+
+        shadow = self.shadow_docs[run[0].document_id]
+        patches = compose_patches(
+            shadow.content,
+            [parse_patches(payload.modifications) for payload in run],
+            fragile_dmp
+        )
+        merged = run[-1].copy()
+        merged.modifications = fragile_dmp.patch_toText(patches)
+        return merged
+
     def connectionMade(self):
         """ Called when a connection is made.
 
@@ -211,19 +410,52 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         itself to the connecter. It then starts the pingback loop, which
         maintains the connection.
         """
-        ping_packet = make_packet('ping', id=0)
-        self.ping_loop = LoopingCall(
-            self.transport.write,
-            ping_packet
-        )
+        self.start_heartbeat()
+        self.send_handshake()
+
+    def start_heartbeat(self):
+        self.ping_loop = LoopingCall(self.send_ping)
         self.ping_loop.start(self.timeout_rate)
 
-        packet = make_packet('handshake', username=self.username)
-        self.transport.write(packet)
+    def send_ping(self):
+        """ Send a timestamped ping, whose echo measures the round trip.
+        """
+        self.send(make_packet('ping', sent=timestamp(self.clock), echo=0))
+
+    def send_handshake(self):
+        packet = make_packet('handshake', username=self.username,
+                             session=self.session)
+        self.send(packet)
+
+    def connectionLost(self, reason):
+        """ Called when the connection is lost.
+
+        The pingback loop is stopped, as there is no one left to ping.
+        """
+        BaseCollaborationProtocol.connectionLost(self, reason)
+        if self.ping_loop is not None and self.ping_loop.running:
+            self.ping_loop.stop()
 
     # Misc. event handlers
     def ping_recieved(self, data):
-        pass
+        """ Echo a timestamped ping, or measure the round trip of an echo.
+        """
+        if data.echo:
+            self.latency.sample(elapsed(self.clock, data.echo))
+        elif data.sent:
+            self.send(make_packet('ping', sent=0, echo=data.sent))
+
+    def sync_delay(self):
+        """ Return the seconds to wait before sending modifications.
+
+        Once round trips have been measured, this is half the smoothed
+        round trip time, within MIN_SEND_DELAY and MAX_SEND_DELAY: the other
+        end can't answer sooner than a round trip, so a slow connection
+        gathers more edits into each packet at little cost.
+        """
+        if not self.send_delay or self.latency.srtt is None:
+            return self.send_delay
+        return min(MAX_SEND_DELAY, max(MIN_SEND_DELAY, self.latency.srtt / 2))
 
     def handshake_recieved(self, data):
         """
@@ -234,16 +466,33 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         if self.state == WAITING_FOR_AUTH:
             self.state = AUTHORIZED
             self.other_name = data.username
+            self.session_started(data.session)
+
+    def session_started(self, session):
+        """ Start or resume the session the server has given us.
+
+        If the server resumed the session we asked for, the documents we
+        had open are kept, and each one's shadow is checked against the
+        server's as the server restores it. Otherwise, everything from the
+        previous connection is dropped, as the server starts over.
+        """
+        if session and session == self.session:
+            self.unverified.update(self.open_docs)
+            return
+        self.session = session
+        self.open_docs.clear()
+        self.shadow_docs.clear()
+        self.available_docs.clear()
+        self.unverified.clear()
 
     def message_recieved(self, data, func_hooks=None):
         """
         Print message
         """
-        if func_hooks is None:
-            hooks = self.message_hooks
+        message = self.run_hooks('message_hooks', data.message, func_hooks)
+        return self.after_hooks(None, message, self.message_recieved_hooked)
 
-        message = data.message
-        message = pipeline_funcs(hooks, message)
+    def message_recieved_hooked(self, message):
         if message is not None:
             log(message)
             return True
@@ -253,32 +502,33 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         """
         Print message.
         """
-        if func_hooks is None:
-            hooks = self.error_hooks
+        message = self.run_hooks('error_hooks', data.message, func_hooks)
+        return self.after_hooks(None, message, self.error_recieved_hooked)
 
-        message = data.message
-        message = pipeline_funcs(hooks, message)
+    def error_recieved_hooked(self, message):
         if message is not None:
             log(message)
             return True
         return False
 
     # Document event handlers
+    # Each handler runs its hooks, and finishes in its _hooked method with
+    # the document the hooks passed on, or None if they cancelled.
     def document_opened(self, data, func_hooks=None):
         """ Open a document.
 
         We retrieve the document object from available_docs to
         open_documents, and create a  new shadow copy if one doesn't exist.
         """
-        if func_hooks is None:
-            hooks = self.doc_open_hooks
-
         document = self.available_docs[data.document_id]
         shadow = self.shadow_class()
         shadow.update(document)
         shadow.content = ""
-        document = pipeline_funcs(hooks, document)
+        document = self.run_hooks('doc_open_hooks', document, func_hooks)
+        return self.after_hooks(data.document_id, document,
+                                self.document_opened_hooked, data, shadow)
 
+    def document_opened_hooked(self, document, data, shadow):
         if document is not None:
             self.open_docs[data.document_id] = document
             self.shadow_docs[data.document_id] = shadow
@@ -292,27 +542,26 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         p = make_packet('document_closed',
                         document_id=document.id,
                         version=document.version)
-        self.transport.write(p)
+        self.send(p)
 
     def document_closed(self, data, func_hooks=None):
         """ Close a document.
 
         We remove the doc from open_docs and shadow_docs.
         """
-        if func_hooks is None:
-            hooks = self.doc_close_hooks
         if data.document_id not in self.open_docs:
-            log(
-                DOC_NOT_OPEN.format(data.document_id)
-            )
-            return
+            log(DOC_NOT_OPEN, data.document_id)
+            return self.document_closed_hooked(None, data)
 
         document = self.open_docs.pop(data.document_id)
         self.shadow_docs.pop(data.document_id)
-        document = pipeline_funcs(hooks, document)
-        document.close()
+        document = self.run_hooks('doc_close_hooks', document, func_hooks)
+        return self.after_hooks(data.document_id, document,
+                                self.document_closed_hooked, data)
 
+    def document_closed_hooked(self, document, data):
         if document is not None:
+            document.close()
             self.available_docs[data.document_id] = document
             return True
         return False
@@ -322,16 +571,16 @@ class CollaborationProtocol(BaseCollaborationProtocol):
 
         We try calling the serializer on the selected document.
         """
-        if func_hooks is None:
-            hooks = self.doc_save_hooks
         if data.document_id not in self.open_docs:
-            log(
-                DOC_NOT_OPEN.format(data.document_id)
-            )
-            return
+            log(DOC_NOT_OPEN, data.document_id)
+            return self.document_saved_hooked(None, data)
 
         document = self.open_docs[data.document_id]
-        document = pipeline_funcs(hooks, document)
+        document = self.run_hooks('doc_save_hooks', document, func_hooks)
+        return self.after_hooks(data.document_id, document,
+                                self.document_saved_hooked, data)
+
+    def document_saved_hooked(self, document, data):
         if document is not None:
             self.serializer.save_document(document)
             return True
@@ -343,19 +592,21 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         Create and add a new document to the available document list,
         raising a warning if the document already exists.
         """
-        if func_hooks is None:
-            hooks = self.doc_add_hooks
-
         if data.document_id in self.available_docs:
             warn('Document {0} already exists'.format(data.document_id))
-        else:
-            document = self.doc_class(id=data.document_id,
-                                      version=data.version,
-                                      name=data.document_name)
-            document = pipeline_funcs(hooks, document)
-            if document is not None:
-                self.available_docs[data.document_id] = document
-                return True
+            return self.document_added_hooked(None, data)
+
+        document = self.doc_class(id=data.document_id,
+                                  version=data.version,
+                                  name=data.document_name)
+        document = self.run_hooks('doc_add_hooks', document, func_hooks)
+        return self.after_hooks(data.document_id, document,
+                                self.document_added_hooked, data)
+
+    def document_added_hooked(self, document, data):
+        if document is not None:
+            self.available_docs[data.document_id] = document
+            return True
         return False
 
     def document_deleted(self, data, func_hooks=None):
@@ -368,9 +619,7 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         if data.document_id in self.available_docs:
             del(self.available_docs[data.document_id])
         else:
-            log(
-                DOC_NOT_AVAILABLE.format(data.document_id)
-            )
+            log(DOC_NOT_AVAILABLE, data.document_id)
 
     # Document content event handlers.
     # These handlers send data back to sender based on whether they
@@ -383,9 +632,7 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         name variable, raising a warning if the document cannot be found.
         """
         if data.document_id not in self.available_docs:
-            log(
-                DOC_NOT_AVAILABLE.format(data.document_id)
-            )
+            log(DOC_NOT_AVAILABLE, data.document_id)
             return
 
         document = self.available_docs[data.document_id]
@@ -400,35 +647,128 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         across the wire. The shadow is then updated with the open
         documents content.
         This event handler is unique in that it sends data back to the caller.
+
+        The patching and diffing is queued behind any other work on the same
+        document, and run by the protocol's executor. Returns a Deferred
+        which fires once the modifications have been handled.
         """
         if data.document_id not in self.open_docs:
-            log(
-                DOC_NOT_OPEN.format(data.document_id)
-            )
+            log(DOC_NOT_OPEN, data.document_id)
             return
 
-        log('{0}: Recieved text modifications:'.format(self))
-        log(data.modifications)
+        if data.document_id in self.unverified:
+            self.unverified.discard(data.document_id)
+            shadow = self.shadow_docs[data.document_id]
+            if str(hash(shadow.content)) != data.hash:
+                self.reopen_document(data.document_id)
+                return
+
+        log('{0}: Recieved text modifications:\n{1}', self,
+            data.modifications)
+
+        # The parsed patches are shared by the document and its shadow.
+        patches = parse_patches(data.modifications)
+
+        deferred = self.job_queues.run(
+            data.document_id, self.sync_document, data, patches
+        )
+        deferred.addErrback(self.sync_failed, data)
+        return deferred
 
-        d_patches = flexible_dmp.patch_fromText(data.modifications)
-        s_patches = fragile_dmp.patch_fromText(data.modifications)
+    def sync_failed(self, failure, data):
+        """ Report a synchronization step which failed, to the log and to
+        the other end of the connection.
+        """
+        err(failure, 'Synchronizing document {0} failed'.format(
+            data.document_id))
+        self.send_error(SYNC_FAILED, 'Synchronizing document {0} failed: '
+                        '{1}'.format(data.document_id,
+                                     failure.getErrorMessage()))
+
+    def reopen_document(self, document_id):
+        """ Start a document over, after its shadow was found to differ
+        from the server's.
+
+        The document is emptied, and opened again, so that the server sends
+        its content in full.
+        """
+        document = self.open_docs[document_id]
+        document.content = ''
+        self.shadow_docs[document_id].content = ''
+        self.send(make_packet('document_opened',
+                              document_id=document_id,
+                              version=document.version))
+
+    def sync_document(self, data, patches, retries=SYNC_RETRIES):
+        """ Start a synchronization step for an open document.
+
+        Called once every earlier job on the document has finished, so that
+        the document and shadow content handed to the executor is current.
+        An executor running the step in another thread lets the document be
+        edited meanwhile, in which case the step is run again on the new
+        content, see sync_finished.
+        """
+        if data.document_id not in self.open_docs:
+            log(DOC_NOT_OPEN, data.document_id)
+            return
 
         document = self.open_docs[data.document_id]
         shadow = self.shadow_docs[data.document_id]
 
-        log('{0}: Document text before modification:'.format(self))
-        log(document.content)
-        log('{0}: Shadow text before modification:'.format(self))
-        log(shadow.content)
+        if DEBUG:
+            # Reading an editor's content copies it out of the buffer.
+            log('{0}: Document text before modification:\n{1}', self,
+                document.content)
+            log('{0}: Shadow text before modification:\n{1}', self,
+                shadow.content)
+
+        document_content = document.content
+        shadow_content = shadow.content
+        if retries:
+            deferred = self.executor.run(
+                sync_text, document_content, shadow_content, patches
+            )
+        else:
+            deferred = InlineExecutor().run(
+                sync_text, document_content, shadow_content, patches
+            )
+        deferred.addCallback(self.sync_finished, data, patches, document,
+                             shadow, (document_content, shadow_content),
+                             retries)
+        return deferred
+
+    def sync_finished(self, result, data, patches, document, shadow,
+                      contents, retries):
+        """ Finish a synchronization step, unless the document or shadow
+        changed while it ran, and its edits no longer line up.
+        """
+        document_content, shadow_content = contents
+        current_document, current_shadow = document.content, shadow.content
+        if ((current_document is not document_content and
+                current_document != document_content) or
+                (current_shadow is not shadow_content and
+                 current_shadow != shadow_content)):
+            return self.sync_document(data, patches, retries - 1)
+        return self.document_synced(result, data, document, shadow)
+
+    def document_synced(self, result, data, document, shadow):
+        """ Finish a synchronization step on the reactor thread.
+
+        The edits computed by the executor are applied to the document, the
+        shadow is brought up to date, and the outgoing modifications are
+        sent.
+        """
+        edits, shadow_content, mods = result
 
         # Add plugin call here
-        document.patch(d_patches, dmp=flexible_dmp)
-        shadow.patch(s_patches, dmp=fragile_dmp)
+        document.apply_edits(edits)
+        shadow.content = shadow_content
 
-        log('{0}: Document text after modification:'.format(self))
-        log(document.content)
-        log('{0}: Shadow text after modification:'.format(self))
-        log(shadow.content)
+        if DEBUG:
+            log('{0}: Document text after modification:\n{1}', self,
+                document.content)
+            log('{0}: Shadow text after modification:\n{1}', self,
+                shadow.content)
 
         shadow_hash = str(hash(shadow.content))
         if shadow_hash != data.hash:
@@ -438,17 +778,13 @@ class CollaborationProtocol(BaseCollaborationProtocol):
                 )
             )
 
-        mods = fragile_dmp.patch_toText(
-            shadow.make_patches(document.content, fragile_dmp)
-        )
         shadow.update(document)
 
-        log('{0}: Sending modifications:'.format(self))
-        log(mods)
+        log('{0}: Sending modifications:\n{1}', self, mods)
 
         reactor.callLater(
-            self.send_delay,
-            self.transport.write,
+            self.sync_delay(),
+            self.send,
             make_packet(
                 'text_modified',
                 document_id=data.document_id,
@@ -463,28 +799,52 @@ class CollaborationProtocol(BaseCollaborationProtocol):
         Modify the metadata in the specified document.
         """
         if data.document_id not in self.open_docs:
-            log(
-                DOC_NOT_OPEN.format(data.document_id)
-            )
-            return
+            log(DOC_NOT_OPEN, data.document_id)
+            return self.metadata_modified_hooked(None, data)
 
-        if func_hooks is None:
-            hooks = self.metadata_mod_hooks
+        document = self.run_hooks('metadata_mod_hooks',
+                                  self.open_docs[data.document_id],
+                                  func_hooks)
+        return self.after_hooks(data.document_id, document,
+                                self.metadata_modified_hooked, data)
 
-        if data.document_id not in self.open_docs:
-            self._warn_doc_not_open(data.document_id)
-        else:
-            document = self.open_docs[data.document_id]
-            metadata = pipeline_funcs(
-                hooks, document, cancellable=True, stoppable=True)
+    def metadata_modified_hooked(self, document, data):
+        if document is not None:
             document.metadata[data.key] = data.value
+            return True
+        return False
 
     def version_modified(self, data):
         if data.document_id not in self.open_docs:
-            log(
-                DOC_NOT_OPEN.format(data.document_id)
-            )
+            log(DOC_NOT_OPEN, data.document_id)
             return
 
         document = self.open_docs[data.document_id]
         document.version = data.version
+
+    def presence_changed(self, data):
+        """ Note where another connection's cursors and selections are.
+
+        Presence is kept in self.presence, by document id and connection id.
+        """
+        document_presence = self.presence.setdefault(data.document_id, {})
+        if data.regions:
+            document_presence[data.connection] = data
+        else:
+            document_presence.pop(data.connection, None)
+
+    def send_presence(self, document_id, regions):
+        """ Tell the other viewers of a document where our cursors are.
+
+        :param regions: (start, end) tuples of our selections. Cursors are
+            selections which start where they end. Only the first
+            MAX_REGIONS are sent.
+        """
+        self.send(make_packet(
+            'presence',
+            document_id=document_id,
+            connection=0,
+            username=self.username,
+            regions=[Container(start=start, end=end)
+                     for start, end in islice(regions, MAX_REGIONS)]
+        ))
@@ -1,7 +1,35 @@
+import os
 import pickle
 from zope.interface import implements
+from colliberation.docformat import (is_document_file, read_document,
+                                     read_header, write_document)
+from colliberation.document import Document
 from colliberation.interfaces import IDocumentSerializer
-from urlparse import urlparse
+from urllib import pathname2url
+from urlparse import urljoin, urlparse
+
+
+def file_path(url):
+    """ Return the path of a file url.
+    """
+    parts = urlparse(url)
+    if parts.scheme != 'file':
+        raise Exception('URL {0} is not a file'.format(parts.scheme))
+    return parts.path
+
+
+def file_url(path):
+    """ Return the file url of a path.
+    """
+    return urljoin('file:', pathname2url(os.path.abspath(path)))
+
+
+def replace_file(source, destination):
+    """ Rename a file over another.
+    """
+    if os.name == 'nt' and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
 
 
 class DiskSerializer(object):
@@ -30,4 +58,74 @@ class DiskSerializer(object):
             pickle.dump(document, file_handle)
 
     def delete_document(self, url):
-        pass
+        parts = urlparse(url)
+        if parts.scheme != 'file':
+            raise Exception('URL {0} is not a file'.format(parts.scheme))
+        if os.path.exists(parts.path):
+            os.remove(parts.path)
+
+
+class BinarySerializer(object):
+
+    """
+    A file based document serializer using the binary format of
+    colliberation.docformat, which is smaller and faster than pickles, and
+    allows a document's name and version to be read without its content.
+
+    Documents saved by DiskSerializer are still loaded, and are rewritten in
+    the binary format the next time they are saved, or by migrate_document.
+
+    :param compress_threshold: Smallest content to compress, in bytes, or
+        None to never compress.
+    """
+    implements(IDocumentSerializer)
+
+    doc_class = Document
+
+    def __init__(self, compress_threshold=None):
+        self.compress_threshold = compress_threshold
+
+    def load_document(self, url):
+        path = file_path(url)
+        with open(path, 'rb') as file_handle:
+            if not is_document_file(file_handle):
+                return pickle.load(file_handle)
+            document = read_document(file_handle, self.doc_class)[0]
+        document.url = url
+        return document
+
+    def load_header(self, url):
+        """ Load everything but a document's content.
+
+        Returns a DocumentHeader, or None for documents saved as pickles.
+        """
+        with open(file_path(url), 'rb') as file_handle:
+            if is_document_file(file_handle):
+                return read_header(file_handle)
+        return None
+
+    def save_document(self, document):
+        path = file_path(document.url)
+        # Written beside the old file, then renamed over it, so that a failed
+        # save doesn't lose the previous one.
+        with open(path + '.tmp', 'wb') as file_handle:
+            write_document(file_handle, document,
+                           compress_threshold=self.compress_threshold)
+        replace_file(path + '.tmp', path)
+
+    def delete_document(self, url):
+        path = file_path(url)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def migrate_document(self, url):
+        """ Rewrite a document saved as a pickle in the binary format.
+
+        Returns whether the document needed migrating.
+        """
+        if self.load_header(url) is not None:
+            return False
+        document = self.load_document(url)
+        document.url = url
+        self.save_document(document)
+        return True
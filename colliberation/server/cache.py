@@ -0,0 +1,223 @@
+"""
+A memory bounded cache of the documents held by a server.
+"""
+import os
+from collections import OrderedDict
+from tempfile import mkdtemp
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from colliberation.document import Document
+from colliberation.serializer import BinarySerializer, file_url
+
+SWEEP_RATE = 30
+
+
+class DocumentStub(object):
+
+    """ Stands in for a document whose content has been spilled to storage.
+
+    A stub carries everything the catalog needs, so it can stay in
+    available_docs, be listed to clients and be renamed, without the
+    document's content being held in memory.
+
+    :param document: The document, or a catalog entry describing it.
+    :param spill_url: Where the document's content is stored.
+    :param serializer: The serializer to load the document with, if it
+        wasn't spilled by the cache.
+    """
+
+    def __init__(self, document, spill_url, serializer=None):
+        self.id = document.id
+        self.name = document.name
+        self.version = document.version
+        self.url = document.url
+        # Unknown for documents only known from a catalog entry.
+        self.metadata = getattr(document, 'metadata', None)
+        # Versions are kept with the stub rather than spilled.
+        self.history = getattr(document, 'history', None)
+        self.spill_url = spill_url
+        self.serializer = serializer
+        # What the catalog said, to tell changes made since from it.
+        self.cataloged = (self.name, self.version)
+
+
+class DocumentCache(object):
+
+    """ Keeps the content of the busiest documents of a server in memory.
+
+    Documents which nobody has open, and which haven't been opened or closed
+    for idle_ttl seconds, are spilled through the serializer, and replaced by
+    a DocumentStub in the documents dictionary. If the documents in memory
+    still hold more than max_bytes of content, the least recently used ones
+    are spilled as well, idle or not. Documents are loaded back when they are
+    next opened.
+
+    :param documents: The server's available_docs dictionary.
+    :param registry: The server's ConnectionRegistry, to find out which
+        documents are open.
+    :param max_bytes: Content held in memory before documents are spilled,
+        or None for no limit.
+    :param idle_ttl: Seconds before an unused document is spilled, or None
+        to only spill documents when over max_bytes.
+    :param directory: Where spilled documents are stored. Defaults to a new
+        temporary directory.
+    """
+    doc_class = Document
+
+    def __init__(self, documents, registry, max_bytes=None, idle_ttl=None,
+                 directory=None, serializer=None, clock=reactor):
+        self.documents = documents
+        self.registry = registry
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.directory = directory
+        self.serializer = serializer or BinarySerializer()
+        self.clock = clock
+        self.used = OrderedDict()  # document id : time, least recent first
+        self.sweep_loop = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes is not None or self.idle_ttl is not None
+
+    def start(self, rate=SWEEP_RATE):
+        """ Start spilling documents periodically, if limits are configured.
+        """
+        if self.enabled and self.sweep_loop is None:
+            self.sweep_loop = LoopingCall(self.sweep)
+            self.sweep_loop.clock = self.clock
+            self.sweep_loop.start(rate, now=False)
+
+    def stop(self):
+        if self.sweep_loop is not None and self.sweep_loop.running:
+            self.sweep_loop.stop()
+        self.sweep_loop = None
+
+    def touch(self, document_id):
+        """ Mark a document as recently used.
+
+        Only loaded documents are tracked; spilled ones are left alone.
+        """
+        self.used.pop(document_id, None)
+        if not isinstance(self.documents.get(document_id), DocumentStub):
+            self.used[document_id] = self.clock.seconds()
+
+    def load(self, document_id):
+        """ Return a document, loading its content back if it was spilled.
+
+        Raises KeyError if the document isn't available.
+        """
+        document = self.documents[document_id]
+        if not isinstance(document, DocumentStub):
+            self.touch(document_id)
+            self.hits += 1
+            return document
+
+        self.misses += 1
+        stub = document
+        serializer = stub.serializer or self.serializer
+        document = serializer.load_document(stub.spill_url)
+        document.id = stub.id
+        if (stub.serializer is None or
+                (stub.name, stub.version) != stub.cataloged):
+            # Spilled by the cache, or changed since, so the stub is current.
+            document.name = stub.name
+            document.version = stub.version
+        elif not document.name:
+            # The catalog is synced after the logs, so it may be behind what
+            # was recovered from them. It is only used when nothing was.
+            document.name = stub.name
+        document.url = stub.url
+        if stub.metadata is not None:
+            document.metadata = stub.metadata
+        if stub.history is not None:
+            document.history = stub.history
+        self.documents[document_id] = document
+        self.touch(document_id)
+        return document
+
+    def evict(self, document_id):
+        """ Spill a document's content to storage, leaving a stub behind.
+        """
+        document = self.documents[document_id]
+        self.used.pop(document_id, None)
+        if isinstance(document, DocumentStub):
+            return
+
+        stub = DocumentStub(document, self.spill_url(document_id))
+        # A fresh copy is saved, as the live document may refer to the
+        # protocols which opened it.
+        self.serializer.save_document(self.doc_class(
+            id=document.id,
+            name=document.name,
+            content=document.content,
+            version=document.version,
+            url=stub.spill_url,
+            metadata=document.metadata
+        ))
+        self.documents[document_id] = stub
+        self.evictions += 1
+
+    def discard(self, document_id):
+        """ Forget a document which is being deleted, and its spilled copy.
+        """
+        self.used.pop(document_id, None)
+        document = self.documents.get(document_id)
+        if isinstance(document, DocumentStub) and document.serializer is None:
+            self.serializer.delete_document(document.spill_url)
+
+    def sweep(self):
+        """ Spill idle documents, then spill documents until under max_bytes.
+        """
+        for document_id in self.used.keys():
+            document = self.documents.get(document_id)
+            if document is None or isinstance(document, DocumentStub):
+                # Deleted, or already spilled.
+                del self.used[document_id]
+
+        if self.idle_ttl is not None:
+            expiry = self.clock.seconds() - self.idle_ttl
+            for document_id, used in self.used.items():
+                if used > expiry:
+                    break
+                if not self.registry.viewers(document_id):
+                    self.evict(document_id)
+
+        if self.max_bytes is not None:
+            excess = self.resident_bytes() - self.max_bytes
+            for document_id in self.used.keys():
+                if excess <= 0:
+                    break
+                if not self.registry.viewers(document_id):
+                    excess -= len(self.documents[document_id].content)
+                    self.evict(document_id)
+
+    def resident_bytes(self):
+        return sum(len(document.content)
+                   for document in self.documents.itervalues()
+                   if not isinstance(document, DocumentStub))
+
+    def spill_url(self, document_id):
+        if self.directory is None:
+            self.directory = mkdtemp(prefix='colliberation-')
+        path = os.path.join(self.directory, '{0}.doc'.format(document_id))
+        return file_url(path)
+
+    def stats(self):
+        resident = sum(1 for document in self.documents.itervalues()
+                       if not isinstance(document, DocumentStub))
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'resident documents': resident,
+            'spilled documents': len(self.documents) - resident,
+            'resident bytes': self.resident_bytes(),
+        }
@@ -0,0 +1,374 @@
+"""
+Cluster mode, spreading documents over several server nodes.
+
+Each node runs a regular CollabServerFactory on its peer port, and a front
+router on its client port. Documents have a home node, chosen by consistent
+hashing of the document id, and the routers relay each client's document
+packets to the home node over ordinary protocol connections.
+
+Nodes announce themselves to each other over cluster links, using the
+node_joined and node_left packets. When membership changes, documents whose
+home node changed are transferred to their new home by their old home.
+"""
+from bisect import bisect, insort
+from hashlib import md5
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, succeed
+from twisted.internet.protocol import ClientFactory, Protocol
+from twisted.internet.task import LoopingCall
+
+from colliberation.document import Document
+from colliberation.packets import make_packet
+from colliberation.protocol import CollaborationProtocol
+from colliberation.server.router import RouterFactory
+
+RING_REPLICAS = 64
+LINK_PING_RATE = 20
+
+#: Number of text_modified packets handled before the transfer client and
+#: the server agree on the document's content.
+SYNC_ROUNDS = 2
+
+
+def ring_hash(key):
+    return int(md5(key).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+
+    """ Maps document ids to nodes by consistent hashing.
+
+    Every node is placed on the ring several times. A document belongs to
+    the first node found clockwise from the document's own hash, so adding or
+    removing a node only moves the documents next to it on the ring.
+
+    A HashRing may be used in place of a router's ShardMap.
+    """
+
+    def __init__(self, nodes=(), local=None, replicas=RING_REPLICAS):
+        self.local = local
+        self.replicas = replicas
+        self.nodes = set()
+        self.keys = []  # Sorted hashes
+        self.points = {}  # hash : node
+
+        for node in nodes:
+            self.add_node(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def node_keys(self, node):
+        host, port = node
+        return [ring_hash('{0}:{1}#{2}'.format(host, port, replica))
+                for replica in xrange(self.replicas)]
+
+    def add_node(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for key in self.node_keys(node):
+            insort(self.keys, key)
+            self.points[key] = node
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for key in self.node_keys(node):
+            self.keys.remove(key)
+            del self.points[key]
+
+    @property
+    def backends(self):
+        return sorted(self.nodes)
+
+    @property
+    def primary(self):
+        """ The node handling packets which don't refer to a document.
+        """
+        if self.local in self.nodes:
+            return self.local
+        return self.backends[0]
+
+    def owner(self, document_id):
+        """ Return the home node of the given document.
+        """
+        index = bisect(self.keys, ring_hash(str(document_id)))
+        return self.points[self.keys[index % len(self.keys)]]
+
+
+class TransferProtocol(CollaborationProtocol):
+
+    """ Moves a document's content onto a server, using the regular protocol.
+
+    The document is added and opened on the server, and synchronized until
+    both sides agree on its content. If new content was given, the local copy
+    is then replaced, and synchronized again, leaving the server with exactly
+    that content.
+    """
+
+    send_delay = 0
+
+    def __init__(self, document, content=None):
+        CollaborationProtocol.__init__(self)
+        self.document_id = document.id
+        self.content = content
+        self.done = Deferred()
+        self.rounds = 0
+
+        self.available_docs[document.id] = Document(
+            id=document.id, name=document.name, version=document.version)
+
+    def connectionMade(self):
+        CollaborationProtocol.connectionMade(self)
+        document = self.available_docs[self.document_id]
+        self.transport.write(
+            make_packet('document_added',
+                        document_id=document.id,
+                        version=document.version,
+                        document_name=document.name) +
+            make_packet('document_opened',
+                        document_id=document.id,
+                        version=document.version)
+        )
+
+    def connectionLost(self, reason):
+        CollaborationProtocol.connectionLost(self, reason)
+        if not self.done.called:
+            self.done.errback(reason)
+
+    def document_added(self, data):
+        # The document is already known, this is the server's broadcast.
+        pass
+
+    def document_synced(self, result, data, document, shadow):
+        CollaborationProtocol.document_synced(
+            self, result, data, document, shadow)
+        if data.document_id != self.document_id:
+            return
+
+        self.rounds += 1
+        if self.rounds == SYNC_ROUNDS and self.content is not None:
+            document.content = self.content
+        elif self.rounds == self.total_rounds:
+            self.done.callback(document.content)
+            self.transport.loseConnection()
+
+    @property
+    def total_rounds(self):
+        if self.content is None:
+            return SYNC_ROUNDS
+        return SYNC_ROUNDS * 2
+
+
+class TransferFactory(ClientFactory):
+
+    def __init__(self, document, content=None):
+        self.protocol_instance = TransferProtocol(document, content)
+
+    @property
+    def done(self):
+        return self.protocol_instance.done
+
+    def buildProtocol(self, addr):
+        return self.protocol_instance
+
+    def clientConnectionFailed(self, connector, reason):
+        self.done.errback(reason)
+
+
+def transfer_document(address, document, content=None):
+    """ Send a document to, or fetch it from, the server at address.
+
+    Returns a Deferred firing with the document's content on the server.
+    """
+    factory = TransferFactory(document, content)
+    host, port = address
+    reactor.connectTCP(host, port, factory)
+    return factory.done
+
+
+class ClusterLink(Protocol):
+
+    """ An outgoing link to another node's peer port.
+
+    Links announce the node and the members it knows of, and are used to
+    notice when a node goes away.
+    """
+
+    def __init__(self, node, address):
+        self.node = node
+        self.address = address
+        self.ping_loop = None
+
+    def connectionMade(self):
+        self.ping_loop = LoopingCall(self.transport.write,
+                                     make_packet('ping', sent=0, echo=0))
+        self.ping_loop.start(LINK_PING_RATE)
+        self.node.link_made(self)
+
+    def connectionLost(self, reason):
+        if self.ping_loop is not None and self.ping_loop.running:
+            self.ping_loop.stop()
+        self.node.link_lost(self)
+
+    def dataReceived(self, data):
+        # Only the server's pings and handshakes are received.
+        pass
+
+    def announce(self, packet, addresses):
+        self.transport.write(''.join(
+            make_packet(packet, host=host, port=port)
+            for host, port in addresses
+        ))
+
+
+class ClusterLinkFactory(ClientFactory):
+
+    def __init__(self, node, address):
+        self.node = node
+        self.address = address
+
+    def buildProtocol(self, addr):
+        return ClusterLink(self.node, self.address)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.node.link_failed(self.address, reason)
+
+
+class ClusterNode(object):
+
+    """ A member of a cluster of collaboration servers.
+
+    :param address: The (host, port) other nodes reach this node's server at.
+    :param server_factory: The CollabServerFactory listening at address.
+    :param seeds: Addresses of existing nodes to join.
+    """
+
+    def __init__(self, address, server_factory, seeds=()):
+        self.address = address
+        self.seeds = list(seeds)
+        self.ring = HashRing([address], local=address)
+
+        self.server_factory = server_factory
+        server_factory.cluster = self
+        self.router_factory = RouterFactory(self.ring)
+
+        self.links = {}  # address : ClusterLink
+        self.connecting = set()
+        self.transfers = {}  # document_id : Deferred
+
+    def start(self):
+        for address in self.seeds:
+            self.connect_link(address)
+
+    def leave(self):
+        """ Leave the cluster, moving this node's documents elsewhere first.
+
+        Returns a Deferred firing once every document has been handed over
+        and the other nodes have been told.
+        """
+        others = [node for node in self.ring.nodes if node != self.address]
+        if not others:
+            return succeed(None)
+        remaining = HashRing(others)
+
+        transfers = []
+        for document_id, document in self.documents().iteritems():
+            if self.ring.owner(document_id) == self.address:
+                transfers.append(self.transfer(
+                    document, remaining.owner(document_id)))
+
+        def announce(result):
+            for link in self.links.values():
+                link.announce('node_left', [self.address])
+                link.transport.loseConnection()
+            return result
+        return DeferredList(transfers).addCallback(announce)
+
+    def documents(self):
+        return self.server_factory.available_docs
+
+    # Links
+    def connect_link(self, address):
+        if (address == self.address or address in self.links or
+                address in self.connecting):
+            return
+        self.connecting.add(address)
+        host, port = address
+        reactor.connectTCP(host, port, ClusterLinkFactory(self, address))
+
+    def link_made(self, link):
+        self.connecting.discard(link.address)
+        self.links[link.address] = link
+        link.announce('node_joined', [self.address] + [
+            node for node in self.ring.nodes
+            if node not in (self.address, link.address)
+        ])
+
+    def link_lost(self, link):
+        if self.links.get(link.address) is link:
+            del self.links[link.address]
+            self.remove_node(link.address)
+
+    def link_failed(self, address, reason):
+        print('Cluster node {0} unreachable: {1}'.format(
+            address, reason.getErrorMessage()))
+        self.connecting.discard(address)
+        self.remove_node(address)
+
+    # Membership
+    def node_joined(self, address):
+        self.connect_link(address)
+        if address not in self.ring:
+            self.change_membership(self.ring.add_node, address)
+
+    def node_left(self, address):
+        self.remove_node(address)
+
+    def remove_node(self, address):
+        if address != self.address and address in self.ring:
+            self.change_membership(self.ring.remove_node, address)
+
+    def change_membership(self, change, address):
+        """ Apply a change to the ring, and rebalance the documents.
+        """
+        documents = self.documents()
+        owners = dict((document_id, self.ring.owner(document_id))
+                      for document_id in documents)
+        change(address)
+
+        moved = dict((document_id, owner)
+                     for document_id, owner in owners.iteritems()
+                     if self.ring.owner(document_id) != owner)
+        print('Cluster now has {0} nodes, {1} documents moved.'.format(
+            len(self.ring), len(moved)))
+
+        for router in list(self.router_factory.routers):
+            router.backends_changed(moved)
+        for document_id, owner in moved.iteritems():
+            if owner == self.address:
+                self.transfer(documents[document_id],
+                              self.ring.owner(document_id))
+
+    def transfer(self, document, address):
+        """ Push a document held by this node to another node.
+        """
+        document = self.server_factory.documents.load(document.id)
+        deferred = transfer_document(address, document, document.content)
+        self.transfers[document.id] = deferred
+
+        def finished(result):
+            if self.transfers.get(document.id) is deferred:
+                del self.transfers[document.id]
+            return result
+
+        def failed(failure):
+            print('Transfer of document {0} to {1} failed: {2}'.format(
+                document.id, address, failure.getErrorMessage()))
+        return deferred.addBoth(finished).addErrback(failed)
@@ -1,9 +1,25 @@
+import os
+from itertools import count
 from weakref import WeakValueDictionary
-'''from bravo_plugin import retrieve_named_plugins'''
 
 from twisted.internet.protocol import ServerFactory
 
+from colliberation.catalog import CATALOG_NAME, CatalogIndex
+from colliberation.history import REVISION_LIMIT, VersionHistory
+from colliberation.journal import (GroupCommitSerializer, JournalSerializer,
+                                   SNAPSHOT_EXTENSION)
+from colliberation.plugin import PluginLoader
+from colliberation.protocol import HOOK_NAMES
+from colliberation.server.cache import DocumentCache, DocumentStub
+from colliberation.server.presence import PresenceChannel
 from colliberation.server.protocol import CollabServerProtocol
+from colliberation.server.registry import ConnectionRegistry
+from colliberation.server.scheduler import EditScheduler, OPERATION_LIMIT
+from colliberation.server.timers import TimerWheel
+from colliberation.server.sessions import (GRACE_PERIOD, SESSIONS_NAME,
+                                           SessionStore)
+from colliberation.utils import HookTimings, compile_hooks
+from colliberation.workers import InlineExecutor, JobQueues
 
 
 class CollabServerFactory(ServerFactory):
@@ -12,33 +28,191 @@ class CollabServerFactory(ServerFactory):
     Creates and manages connections to collaboration clients
     """
 
-    def __init__(self, protocol_hooks=None):
+    def __init__(self, protocol_hooks=None, executor=None, cache_size=None,
+                 idle_ttl=None, spill_directory=None, journal_directory=None,
+                 revision_limit=REVISION_LIMIT, grace_period=GRACE_PERIOD,
+                 operation_limit=OPERATION_LIMIT, time_hooks=False,
+                 plugins=None, sessions_name=SESSIONS_NAME):
         print('Starting collaboration server factory.')
 
-        self.protocols = {}
+        self.registry = ConnectionRegistry()
+        self.sessions = SessionStore(grace_period)
+        self.presence = PresenceChannel(self.registry)
+        self.connection_ids = count(1)
         self.available_docs = {}
+        self.revision_limit = revision_limit
+
+        # Documents are only persisted when a journal directory is given.
+        # Sessions are then checkpointed alongside them when the server
+        # stops, so that clients may resume them after a restart. Worker
+        # processes name their checkpoints apart, so that a restart never
+        # hands one worker's sessions to another.
+        self.serializer = None
+        self.sessions_path = None
+        if journal_directory is not None:
+            self.serializer = self.open_journal(journal_directory)
+            self.sessions_path = os.path.join(journal_directory,
+                                              sessions_name)
+            restored = self.sessions.restore(self.sessions_path)
+            print('Restored {0} sessions.'.format(restored))
+
+        # Spills unused documents to storage, see DocumentCache.
+        self.documents = DocumentCache(self.available_docs, self.registry,
+                                       cache_size, idle_ttl, spill_directory)
+
+        # Shared by every protocol, so that edits to a document are handled
+        # in order whichever connection they arrive on.
+        self.executor = executor or InlineExecutor()
+        self.job_queues = JobQueues()
+        self.scheduler = EditScheduler(operation_limit)
+
+        # Drives every connection's pings and idle timeout.
+        self.timers = TimerWheel()
+
+        # Set by a ClusterNode when the server is part of a cluster.
+        self.cluster = None
 
         if protocol_hooks is not None:
             self.hooks = protocol_hooks
         else:
             self.hooks = {}
+        # Compiled once, for every connection. Timing the hooks shows which
+        # of them slow down packet handling.
+        self.hook_timings = HookTimings() if time_hooks else None
+        self.pipelines = self.compile_hooks()
+
+        # Plugins are indexed now, but only loaded once their hooks fire.
+        if plugins is None:
+            plugins = PluginLoader().discover()
+        self.plugins = plugins
+
+    def compile_hooks(self):
+        """ Compile the hook lists into the pipelines new connections use.
+        """
+        return compile_hooks(
+            dict((name, self.hooks.get(name, [])) for name in HOOK_NAMES),
+            self.hook_timings)
+
+    def open_journal(self, directory):
+        """ Persist documents in a directory, and list the documents in it.
+
+        The stored documents are listed from the directory's catalog, and
+        their content is only loaded once they are opened. The journal is
+        written from a thread, and saves are synced to disk in groups.
+        """
+        catalog = CatalogIndex(os.path.join(directory, CATALOG_NAME))
+        catalog.reconcile(directory, SNAPSHOT_EXTENSION)
+        journal = JournalSerializer(directory, catalog=catalog)
+        for entry in catalog:
+            self.available_docs[entry.id] = DocumentStub(
+                entry, entry.url, journal)
+        print('Found {0} stored documents.'.format(len(catalog)))
+        return GroupCommitSerializer(journal)
 
     def startFactory(self):
+        self.documents.start()
         print('Factory started')
 
     def stopFactory(self):
+        self.documents.stop()
+        self.scheduler.stop()
+        self.presence.stop()
+        self.timers.stop()
+        if self.sessions_path is not None:
+            self.sessions.checkpoint(
+                self.sessions_path,
+                [(protocol.session, protocol.other_name, protocol.shadow_docs)
+                 for protocol in self.registry if protocol.session],
+                self.available_docs
+            )
+        self.sessions.stop()
+        self.executor.stop()
+        if self.serializer is not None:
+            self.serializer.close()
         print('Factory stopped')
 
-    def broadcast(self, packet):
-        for protocol in self.protocols.itervalues():
-            protocol.transport.write(packet)
+    @property
+    def protocols(self):
+        """ Live connections, by address.
+        """
+        return self.registry.connections
+
+    def latency(self):
+        """ Return the round trip statistics of the live connections, by
+        address.
+        """
+        return dict((protocol.address, protocol.latency.stats())
+                    for protocol in self.registry)
+
+    def broadcast(self, packet, subscribers=None, key=None, critical=True):
+        """ Send a packet to several connections.
+
+        :param str packet: The packet bytestream, encoded once for everyone.
+        :param subscribers: The connections to send to, such as the viewers
+            of a document. Defaults to every connection.
+        :param key: Coalescing key for connections which have fallen behind.
+        :param bool critical: Whether slow connections may drop the packet.
+        """
+        if subscribers is None:
+            subscribers = self.registry
+        for protocol in list(subscribers):
+            protocol.send(packet, key, critical)
+
+    def document_created(self, document):
+        """ Start persisting a document added by a client.
+        """
+        self.documents.touch(document.id)
+        if self.serializer is not None:
+            if not document.url:
+                document.url = self.serializer.url_for(document.id)
+            self.serializer.save_document(document)
+
+    def document_committed(self, document):
+        """ Record a version of a document which is being saved.
+        """
+        if document.history is None:
+            document.history = VersionHistory(self.revision_limit)
+        document.commit()
+
+    def edits_applied(self, document, edits):
+        """ Record edits made to a document's content.
+        """
+        if self.serializer is not None and edits:
+            self.serializer.log_edits(document, edits)
+
+    def document_removed(self, document_id):
+        """ Forget a document which is being deleted.
+        """
+        self.documents.discard(document_id)
+        document = self.available_docs.get(document_id)
+        if self.serializer is not None and document is not None:
+            self.serializer.delete_document(document.url)
+
+    def connection_lost(self, protocol):
+        """ Forget a connection which has been lost or has timed out.
+
+        The connection's session is kept, so that the client may resume it.
+        """
+        if protocol.session:
+            self.sessions.detach(protocol.session, protocol.other_name,
+                                 dict(protocol.shadow_docs))
+            protocol.session = ''
+        self.scheduler.remove(protocol)
+        self.presence.remove(protocol)
+        self.registry.remove(protocol)
 
     def buildProtocol(self, addr):
         print('{0} is connecting...'.format(str(addr)))
 
         protocol = CollabServerProtocol(
-            factory=self, address=addr, **self.hooks)
+            factory=self, address=addr, executor=self.executor,
+            job_queues=self.job_queues, pipelines=self.pipelines,
+            hook_timings=self.hook_timings, plugins=self.plugins,
+            **self.hooks)
+        protocol.connection_id = next(self.connection_ids)
         protocol.available_docs = self.available_docs
+        if self.serializer is not None:
+            protocol.serializer = self.serializer
 
-        self.protocols[addr] = protocol
+        self.registry.add(protocol)
         return protocol
@@ -0,0 +1,226 @@
+"""
+Flow control for the packets a server sends to its connections.
+"""
+from collections import OrderedDict
+from itertools import count
+from struct import unpack
+
+from zope.interface import implements
+from twisted.internet.interfaces import IPushProducer
+
+#: Bytes which may be queued for a paused connection before it is dropped.
+MAX_QUEUED_BYTES = 4 * 1024 * 1024
+
+#: Priority lanes, highest first.
+CONTROL, INTERACTIVE, BULK = range(3)
+
+#: Packets which don't depend on the order of document traffic: ping,
+#: handshake, message and error.
+CONTROL_PACKETS = frozenset([0, 4, 5, 6])
+
+#: Packets about a single document, whose document id follows the header.
+DOCUMENT_PACKETS = frozenset([10, 11, 12, 13, 14, 15, 20, 21, 22, 23])
+
+#: Catalog packets, sent in bursts to connections which shake hands.
+CATALOG_PACKETS = frozenset([13, 14, 15])
+
+#: Bytes above which a document packet is bulk rather than interactive.
+BULK_SIZE = 16 * 1024
+
+
+def classify(packet):
+    """ Return the priority lane of a packet, and the id of the document it
+    is about, or None.
+    """
+    header = ord(packet[0]) if packet else None
+    if header in CONTROL_PACKETS:
+        return CONTROL, None
+    if header not in DOCUMENT_PACKETS or len(packet) < 5:
+        return INTERACTIVE, None
+    document_id = unpack('>I', packet[1:5])[0]
+    if header in CATALOG_PACKETS or len(packet) > BULK_SIZE:
+        return BULK, document_id
+    return INTERACTIVE, document_id
+
+
+class OutputQueue(object):
+
+    """ Writes packets to a connection, holding them back while it is slow.
+
+    The queue registers itself as a streaming producer on the connection's
+    transport. While the transport's buffer is full the queue is paused, and
+    packets are held back instead of being buffered without limit:
+
+        - Critical packets are queued, in order.
+        - Non-critical packets with a coalescing key replace any queued
+          packet with the same key, so only the latest value is sent.
+        - Other non-critical packets are dropped.
+
+    Held back packets are queued in priority lanes: control packets, then
+    interactive edits, then bulk transfers such as catalogs and large
+    documents. When the connection catches up the lanes are written highest
+    first, one packet at a time, so a control packet only waits for the
+    packet being written and what the transport already buffers, however
+    much bulk data is queued. Packets about a document never overtake each
+    other: one sent while the document has bulk packets queued goes in the
+    bulk lane too.
+
+    If more than max_queued bytes are held back, the connection is dropped.
+    """
+    implements(IPushProducer)
+
+    def __init__(self, protocol, max_queued=MAX_QUEUED_BYTES):
+        self.protocol = protocol
+        self.max_queued = max_queued
+        self.paused = False
+        self.lanes = [OrderedDict() for _ in (CONTROL, INTERACTIVE, BULK)]
+        self.documents = {}  # document id : [queued packets, lowest lane]
+        self.queued_bytes = 0
+        self.sequence = count()
+
+        # Metrics
+        self.sent = 0
+        self.lane_sent = [0, 0, 0]
+        self.overtook = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.disconnected = False
+
+    @property
+    def queue(self):
+        """ Queued packets, by key, in the order they will be written.
+        """
+        queue = OrderedDict()
+        for lane in self.lanes:
+            queue.update(lane)
+        return queue
+
+    @property
+    def writable(self):
+        """ Whether a packet sent now would be written straight away.
+        """
+        return not (self.paused or self.disconnected or any(self.lanes))
+
+    def register(self):
+        self.protocol.transport.registerProducer(self, True)
+
+    def send(self, packet, key=None, critical=True, priority=None):
+        """ Send a packet, or hold it back if the connection is slow.
+
+        :param str packet: The packet bytestream.
+        :param key: Coalescing key for non-critical packets.
+        :param bool critical: Whether the packet may never be dropped.
+        :param int priority: The lane to queue the packet in, instead of the
+            one its header calls for.
+        """
+        if self.disconnected:
+            return
+        if not self.paused and not any(self.lanes):
+            self.sent += 1
+            self.protocol.transport.write(packet)
+            return
+
+        if not (critical or key is not None):
+            self.dropped += 1
+            return
+
+        lane, document_id = classify(packet)
+        if priority is not None:
+            lane = priority
+        if key is None:
+            key = next(self.sequence)
+        else:
+            self.unqueue(key)
+        if document_id is not None:
+            queued = self.documents.setdefault(document_id, [0, lane])
+            lane = queued[1] = max(lane, queued[1])
+            queued[0] += 1
+        self.lanes[lane][key] = (packet, document_id)
+        self.queued_bytes += len(packet)
+
+        if self.queued_bytes > self.max_queued:
+            self.disconnect()
+
+    def unqueue(self, key):
+        """ Take back a queued packet, which has been coalesced.
+        """
+        for lane in self.lanes:
+            previous = lane.pop(key, None)
+            if previous is not None:
+                self.coalesced += 1
+                self.dequeued(*previous)
+                return
+
+    def dequeued(self, packet, document_id):
+        self.queued_bytes -= len(packet)
+        if document_id is not None:
+            queued = self.documents[document_id]
+            queued[0] -= 1
+            if not queued[0]:
+                del self.documents[document_id]
+
+    def disconnect(self):
+        """ Drop a connection which has fallen too far behind.
+        """
+        self.clear()
+        transport = self.protocol.transport
+        if hasattr(transport, 'abortConnection'):
+            transport.abortConnection()
+        else:
+            transport.loseConnection()
+
+    def clear(self):
+        self.disconnected = True
+        for lane in self.lanes:
+            lane.clear()
+        self.documents.clear()
+        self.queued_bytes = 0
+
+    def flush(self):
+        """ Write queued packets, highest lane first, until the transport's
+        buffer fills again.
+        """
+        transport = self.protocol.transport
+        while not self.paused:
+            for index, lane in enumerate(self.lanes):
+                if lane:
+                    break
+            else:
+                return
+            packet, document_id = lane.popitem(last=False)[1]
+            self.dequeued(packet, document_id)
+            self.sent += 1
+            self.lane_sent[index] += 1
+            if any(self.lanes[index + 1:]):
+                self.overtook += 1
+            # Writing may fill the transport's buffer, pausing us again.
+            transport.write(packet)
+
+    # IPushProducer
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.flush()
+
+    def stopProducing(self):
+        self.paused = True
+        self.clear()
+
+    def stats(self):
+        return {
+            'paused': self.paused,
+            'queued packets': sum(len(lane) for lane in self.lanes),
+            'queued bytes': self.queued_bytes,
+            'queued control': len(self.lanes[CONTROL]),
+            'queued interactive': len(self.lanes[INTERACTIVE]),
+            'queued bulk': len(self.lanes[BULK]),
+            'sent': self.sent,
+            'sent control': self.lane_sent[CONTROL],
+            'sent interactive': self.lane_sent[INTERACTIVE],
+            'sent bulk': self.lane_sent[BULK],
+            'overtook': self.overtook,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,155 @@
+"""
+Latest-value-wins delivery of cursors and selections.
+"""
+from twisted.internet import reactor
+
+from colliberation.packets import make_packet
+
+#: Presence flushes each connection may receive per second.
+PRESENCE_RATE = 10
+
+
+class PresenceChannel(object):
+
+    """ Passes each connection's presence on to the other viewers of a
+    document.
+
+    Each connection has one slot per document, holding only its latest
+    presence. Updates aren't sent as they arrive: dirty documents are
+    flushed rate times a second, and each viewer is sent the slots which
+    changed since it was last flushed, in a single write. A viewer whose
+    connection has packets held back is skipped until it catches up, so
+    presence never waits behind document traffic, and it is sent only the
+    latest values once it does.
+    """
+
+    def __init__(self, registry, rate=PRESENCE_RATE, clock=reactor):
+        self.registry = registry
+        self.interval = 1.0 / rate
+        self.clock = clock
+        self.slots = {}  # document id : {protocol : (sequence, packet)}
+        self.seen = {}  # (protocol, document id) : sequence flushed
+        self.departed = set()  # (protocol, document id)
+        self.sequence = 0
+        self.flushed = 0
+        self.dirty = set()  # document ids
+        self.call = None
+
+        # Metrics
+        self.received = 0
+        self.superseded = 0
+        self.sent = 0
+        self.writes = 0
+        self.held = 0
+
+    def update(self, protocol, data):
+        """ Fill a connection's slot in a document with its latest presence.
+        """
+        self.received += 1
+        packet = make_packet('presence',
+                             document_id=data.document_id,
+                             connection=protocol.connection_id,
+                             username=protocol.other_name,
+                             regions=data.regions)
+        self.fill(protocol, data.document_id, packet)
+
+    def fill(self, protocol, document_id, packet):
+        slots = self.slots.setdefault(document_id, {})
+        previous = slots.get(protocol)
+        if previous is not None and previous[0] > self.flushed:
+            self.superseded += 1
+        self.sequence += 1
+        slots[protocol] = (self.sequence, packet)
+        self.dirty.add(document_id)
+        self.schedule()
+
+    def subscribe(self, protocol, document_id):
+        """ Send a connection which opened a document everyone's presence.
+        """
+        self.seen.pop((protocol, document_id), None)
+        if document_id in self.slots:
+            self.dirty.add(document_id)
+            self.schedule()
+
+    def unsubscribe(self, protocol, document_id):
+        """ Forget a connection which closed a document, telling the other
+        viewers that it left.
+        """
+        self.seen.pop((protocol, document_id), None)
+        slots = self.slots.get(document_id)
+        if slots is None or protocol not in slots:
+            return
+        self.departed.add((protocol, document_id))
+        self.fill(protocol, document_id, make_packet(
+            'presence',
+            document_id=document_id,
+            connection=protocol.connection_id,
+            username=protocol.other_name,
+            regions=[]
+        ))
+
+    def remove(self, protocol):
+        """ Forget a connection which has been lost.
+        """
+        for document_id in self.slots.keys():
+            self.unsubscribe(protocol, document_id)
+
+    def schedule(self):
+        if self.call is None:
+            self.call = self.clock.callLater(self.interval, self.flush)
+
+    def flush(self):
+        """ Send each viewer of the dirty documents the slots it hasn't seen.
+        """
+        self.call = None
+        dirty = set()
+        for document_id in self.dirty:
+            slots = self.slots.get(document_id)
+            if not slots:
+                continue
+            for viewer in self.registry.viewers(document_id):
+                key = (viewer, document_id)
+                if not viewer.output.writable:
+                    self.held += 1
+                    dirty.add(document_id)
+                    continue
+                seen = self.seen.get(key, 0)
+                packets = [packet
+                           for sender, (sequence, packet) in slots.iteritems()
+                           if sequence > seen and sender is not viewer]
+                if packets:
+                    viewer.transport.write(''.join(packets))
+                    self.sent += len(packets)
+                    self.writes += 1
+                self.seen[key] = self.sequence
+
+        # Departures are only kept until they have been sent.
+        for protocol, document_id in self.departed:
+            slots = self.slots.get(document_id)
+            if slots is not None and document_id not in dirty:
+                slots.pop(protocol, None)
+                if not slots:
+                    del self.slots[document_id]
+        self.departed = set(departure for departure in self.departed
+                            if departure[1] in dirty)
+
+        self.flushed = self.sequence
+        self.dirty = dirty
+        if self.dirty:
+            self.schedule()
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def stats(self):
+        return {
+            'documents': len(self.slots),
+            'slots': sum(len(slots) for slots in self.slots.itervalues()),
+            'received': self.received,
+            'superseded': self.superseded,
+            'sent': self.sent,
+            'writes': self.writes,
+            'held': self.held,
+        }
@@ -1,6 +1,8 @@
 
-from colliberation.protocol import CollaborationProtocol
+from colliberation.protocol import CollaborationProtocol, TEXT_MODIFIED
 from colliberation.packets import make_packet
+from colliberation.server.flow import OutputQueue
+from colliberation.server.sessions import ShadowCheckpoint, restore_shadow
 
 WAITING_FOR_AUTH = 1
 AUTHORIZED = 2
@@ -13,20 +15,186 @@ class CollabServerProtocol(CollaborationProtocol):
     The server protocol is quite active compared to it's client counterpart.
     It acts on incoming requests, merging in changes, etc.
     """
+    # Identifies the connection to others, set by the factory.
+    connection_id = 0
+    # Time data was last received, by the factory's timer wheel.
+    last_received = 0
 
     def __init__(self, **kwargs):
         CollaborationProtocol.__init__(self, **kwargs)
+        self.packet_handlers.update({
+            # Cluster actions
+            30: self.node_joined,
+            31: self.node_left,
+        })
+        self.output = OutputQueue(self)
+
+    def connectionMade(self):
+        self.output.register()
+        CollaborationProtocol.connectionMade(self)
+
+    def connectionLost(self, reason):
+        CollaborationProtocol.connectionLost(self, reason)
+        self.factory.timers.cancel(self)
+        self.factory.connection_lost(self)
+
+    # Heartbeat
+    def setTimeout(self, period):
+        """ Set the idle timeout, checked by the factory's timer wheel
+        rather than a timed call of the connection's own.
+        """
+        self.timeOut = period
+
+    def resetTimeout(self):
+        self.last_received = self.factory.timers.now
+
+    def start_heartbeat(self):
+        """ Ping the client and watch for it going idle from the factory's
+        timer wheel.
+        """
+        timers = self.factory.timers
+        self.last_received = timers.now
+        self.next_ping = timers.now + self.timeout_rate
+        timers.schedule(self, self.heartbeat_delay(), self.heartbeat)
+
+    def heartbeat_delay(self):
+        due = self.next_ping
+        if self.timeOut is not None:
+            due = min(due, self.last_received + self.timeOut)
+        return due - self.factory.timers.now
+
+    def heartbeat(self):
+        """ Time the connection out if it has gone idle, or send a ping if
+        one is due.
+        """
+        timers = self.factory.timers
+        if (self.timeOut is not None and
+                timers.now - self.last_received >= self.timeOut):
+            self.timeoutConnection()
+            return
+        if timers.now >= self.next_ping:
+            self.send_ping()
+            self.next_ping = timers.now + self.timeout_rate
+        timers.schedule(self, self.heartbeat_delay(), self.heartbeat)
+
+    def handle_packet(self, header, payload):
+        """ Handle a packet, in order with the edits sent before it.
+
+        Edits are queued with the edit scheduler rather than applied as
+        they arrive. Other packets about a document, such as saves and
+        closes, are held back until the connection's queued edits to the
+        document have been applied, as are any packets after them.
+        """
+        if (header != TEXT_MODIFIED and 'document_id' in payload and
+                payload.document_id not in self.suspended):
+            scheduler = self.factory.scheduler
+            if scheduler.busy(self, payload.document_id):
+                self.suspend(payload.document_id, scheduler.drained(
+                    self, payload.document_id))
+        CollaborationProtocol.handle_packet(self, header, payload)
+
+    def timeoutConnection(self):
+        CollaborationProtocol.timeoutConnection(self)
+        self.factory.timers.cancel(self)
+        self.factory.connection_lost(self)
+        self.transport.loseConnection()
+
+    def send(self, packet, key=None, critical=True, priority=None):
+        """ Send a packet through the connection's output queue.
+
+        :param key: Coalescing key, for packets where only the latest value
+            matters if the connection falls behind.
+        :param bool critical: Whether the packet may never be dropped.
+        :param int priority: Lane of the output queue, if not the one the
+            packet's header calls for.
+        """
+        self.output.send(packet, key, critical, priority)
+
+    def send_handshake(self):
+        """ Wait for the client's handshake.
+
+        The server answers the client's handshake instead, once it knows
+        which session the connection has.
+        """
 
     def handshake_recieved(self, data):
         CollaborationProtocol.handshake_recieved(self, data)
-        for doc_id, document in self.available_docs.iteritems():
-            packet = make_packet(
+        self.factory.registry.set_username(self, data.username)
+
+    def session_started(self, session):
+        """ Resume the client's session, or start a new one.
+
+        A resumed connection gets back the documents it had open and their
+        shadows, and is only sent the catalog changes it missed. Shadows of
+        sessions restored from a checkpoint are rebuilt from the recovered
+        documents. A
+        text_modified packet without modifications is sent for each
+        restored document, carrying the hash of its shadow, so that the
+        client may check that its shadow still matches.
+        """
+        sessions = self.factory.sessions
+        resumed = None
+        if session:
+            resumed = sessions.resume(session, self.other_name)
+
+        if resumed is None:
+            self.session = sessions.create()
+            CollaborationProtocol.send_handshake(self)
+            self.send_catalog(self.available_docs)
+            return
+
+        self.session = resumed.token
+        CollaborationProtocol.send_handshake(self)
+        self.send_catalog(sessions.catalog_changes(resumed.catalog_sequence))
+        for document_id, shadow in resumed.shadows.iteritems():
+            if document_id not in self.available_docs:
+                continue
+            document = self.factory.documents.load(document_id)
+            if isinstance(shadow, ShadowCheckpoint):
+                checkpoint = shadow
+                shadow = self.shadow_class()
+                shadow.update(document)
+                restore_shadow(checkpoint, shadow)
+            self.open_docs[document_id] = document
+            self.shadow_docs[document_id] = shadow
+            self.factory.registry.document_opened(self, document_id)
+            self.factory.presence.subscribe(self, document_id)
+            self.send(make_packet(
+                'text_modified',
+                document_id=document_id,
+                version=document.version,
+                modifications='',
+                hash=str(hash(shadow.content))
+            ))
+
+    def send_catalog(self, document_ids):
+        """ Tell the client about the current state of some documents.
+
+        Documents which no longer exist are sent as deleted. Others are sent
+        as added, and then renamed, in case the client already knew of them
+        under another name.
+        """
+        full = document_ids is self.available_docs
+        for doc_id in document_ids:
+            document = self.available_docs.get(doc_id)
+            if document is None:
+                self.send(make_packet('document_deleted',
+                                      document_id=doc_id,
+                                      version=0))
+                continue
+            self.send(make_packet(
                 'document_added',
                 document_id=doc_id,
                 version=document.version,
                 document_name=document.name
-            )
-            self.transport.write(packet)
+            ))
+            if not full:
+                self.send(make_packet(
+                    'name_modified',
+                    document_id=doc_id,
+                    version=document.version,
+                    new_name=document.name
+                ))
 
     # Document event handlers
     def document_opened(self, data):
@@ -34,9 +202,21 @@ class CollabServerProtocol(CollaborationProtocol):
 
         Send a document_opened packet, then send a text_modified packet,
         since we assume that the document opened on the client end is blank.
+        Documents spilled by the server's cache are loaded back first.
         """
-
-        CollaborationProtocol.document_opened(self, data)
+        if data.document_id in self.available_docs:
+            self.factory.documents.load(data.document_id)
+        return CollaborationProtocol.document_opened(self, data)
+
+    def document_opened_hooked(self, document, data, shadow):
+        opened = CollaborationProtocol.document_opened_hooked(
+            self, document, data, shadow)
+        if opened:
+            self.factory.registry.document_opened(self, data.document_id)
+            self.factory.presence.subscribe(self, data.document_id)
+        elif data.document_id not in self.shadow_docs:
+            # A hook refused to open the document.
+            return opened
         packet = make_packet('document_opened',
                              document_id=data.document_id,
                              version=data.version)
@@ -51,57 +231,84 @@ class CollabServerProtocol(CollaborationProtocol):
             hash=str(hash(self.shadow_docs[data.document_id].content))
         )
 
-        self.transport.write(packet)
-        self.transport.write(mod_packet)
+        self.send(packet)
+        self.send(mod_packet)
+        return opened
 
-    def document_closed(self, data):
+    def document_closed_hooked(self, document, data):
         """ Close a document.
 
         Send a document_closed packet.
         """
-        CollaborationProtocol.document_closed(self, data)
+        closed = CollaborationProtocol.document_closed_hooked(
+            self, document, data)
+        self.factory.registry.document_closed(self, data.document_id)
+        self.factory.presence.unsubscribe(self, data.document_id)
+        self.factory.documents.touch(data.document_id)
         packet = make_packet('document_closed',
                              document_id=data.document_id,
                              version=data.version)
 
-        self.transport.write(packet)
+        self.send(packet)
+        return closed
 
-    def document_saved(self, data):
+    def document_saved_hooked(self, document, data):
         """ Save a document.
 
-        Send a document_saved packet.
+        Unless a hook cancelled the save, commits the document as a new
+        version. Sends a document_saved packet with the document's version.
         """
-        CollaborationProtocol.document_saved(self, data)
+        if document is not None:
+            self.factory.document_committed(document)
+        saved = CollaborationProtocol.document_saved_hooked(
+            self, document, data)
+        version = data.version
+        if data.document_id in self.open_docs:
+            version = self.open_docs[data.document_id].version
         packet = make_packet('document_saved',
                              document_id=data.document_id,
-                             version=data.version)
+                             version=version)
 
-        self.factory.broadcast(packet)
+        self.factory.broadcast(
+            packet,
+            self.factory.registry.viewers(data.document_id),
+            key=('document_saved', data.document_id),
+            critical=False
+        )
+        return saved
 
-    def document_added(self, data):
+    def document_added_hooked(self, document, data):
         """ Add a document.
 
         Send a document_added packet.
         """
-        CollaborationProtocol.document_added(self, data)
+        added = CollaborationProtocol.document_added_hooked(
+            self, document, data)
+        if added:
+            self.factory.document_created(
+                self.available_docs[data.document_id])
+            self.factory.sessions.catalog_changed(data.document_id)
         packet = make_packet('document_added',
                              document_id=data.document_id,
                              version=data.version,
                              document_name=data.document_name)
 
-        self.factory.broadcast(packet)
+        self.factory.broadcast(packet, self.factory.registry.watchers)
+        return added
 
     def document_deleted(self, data):
         """ Delete a document.
 
         Send a document_deleted packet.
         """
+        self.factory.document_removed(data.document_id)
         CollaborationProtocol.document_deleted(self, data)
+        self.factory.sessions.catalog_changed(data.document_id)
         packet = make_packet('document_deleted',
                              document_id=data.document_id,
                              version=data.version)
 
-        self.transport.write(packet)
+        self.send(packet)
 
     def name_modified(self, data):
         """ Modify the name of a document.
@@ -109,13 +316,46 @@ class CollabServerProtocol(CollaborationProtocol):
         Send a name_modified packet.
         """
         CollaborationProtocol.name_modified(self, data)
+        self.factory.sessions.catalog_changed(data.document_id)
         packet = make_packet(
             'name_modified',
             document_id=data.document_id,
             version=data.version,
             new_name=data.new_name
         )
-        self.factory.broadcast(packet)
+        self.factory.broadcast(
+            packet,
+            self.factory.registry.watchers,
+            key=('name_modified', data.document_id),
+            critical=False
+        )
+
+    def text_modified(self, data):
+        """ Queue modifications with the server's edit scheduler.
+
+        The modifications are applied once the scheduler gives this
+        connection its turn, see apply_text_modified.
+        """
+        self.factory.scheduler.submit(self, data)
+
+    def apply_text_modified(self, data):
+        """ Apply modifications admitted by the edit scheduler.
+        """
+        return CollaborationProtocol.text_modified(self, data)
+
+    def presence_changed(self, data):
+        """ Pass the client's cursors and selections on to the other
+        viewers of the document, see PresenceChannel.
+        """
+        if data.document_id in self.open_docs:
+            self.factory.presence.update(self, data)
+
+    def document_synced(self, result, data, document, shadow):
+        """ Finish a synchronization step, recording the edits made.
+        """
+        CollaborationProtocol.document_synced(
+            self, result, data, document, shadow)
+        self.factory.edits_applied(document, result[0])
 
     def content_modified(self, data):
         """ Modify the content of a document.
@@ -124,19 +364,27 @@ class CollabServerProtocol(CollaborationProtocol):
         """
         CollaborationProtocol.content_modified(self, data)
 
-    def metadata_modified(self, data):
+    def metadata_modified_hooked(self, document, data):
         """ Modify the metadata of a document.
 
         Send a metadata_modified packet.
         """
-        CollaborationProtocol.metadata_modified(self, data)
+        modified = CollaborationProtocol.metadata_modified_hooked(
+            self, document, data)
         packet = make_packet('metadata_modified',
                              document_id=data.document_id,
+                             version=data.version,
                              type=data.type,
                              key=data.key,
                              value=data.value)
 
-        self.factory.broadcast(packet)
+        self.factory.broadcast(
+            packet,
+            self.factory.registry.viewers(data.document_id),
+            key=('metadata_modified', data.document_id, data.key),
+            critical=False
+        )
+        return modified
 
     def version_modified(self, data):
         """ Modify the version of a document.
@@ -149,4 +397,23 @@ class CollabServerProtocol(CollaborationProtocol):
                              version=data.version,
                              new_version=data.new_version)
 
-        self.transport.write(packet)
+        self.send(packet)
+
+    # Cluster event handlers
+    def node_joined(self, data):
+        """ A cluster node has announced itself.
+
+        Ignored unless the server is part of a cluster.
+        """
+        cluster = getattr(self.factory, 'cluster', None)
+        if cluster is not None:
+            cluster.node_joined((data.host, data.port))
+
+    def node_left(self, data):
+        """ A cluster node is leaving the cluster.
+
+        Ignored unless the server is part of a cluster.
+        """
+        cluster = getattr(self.factory, 'cluster', None)
+        if cluster is not None:
+            cluster.node_left((data.host, data.port))
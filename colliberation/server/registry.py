@@ -0,0 +1,111 @@
+"""
+Bookkeeping of the connections held by a server.
+"""
+from sys import getsizeof
+
+
+class ConnectionRegistry(object):
+
+    """ Indexes a server's live connections.
+
+    Connections are indexed by address, by username, and by the documents
+    they have open, so that questions such as "who is editing document X"
+    are answered without scanning every connection. Connections must be
+    removed when they are lost, which drops them from every index.
+    """
+
+    def __init__(self):
+        self.connections = {}  # address : protocol
+        self.users = {}  # username : set(protocol)
+        self.documents = {}  # document id : set(protocol)
+        self.usernames = {}  # protocol : username
+        self.open_documents = {}  # protocol : set(document id)
+
+        #: Connections which completed a handshake, and follow the catalog.
+        self.watchers = set()
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __iter__(self):
+        return self.connections.itervalues()
+
+    def __contains__(self, protocol):
+        return protocol in self.open_documents
+
+    def add(self, protocol):
+        self.connections[protocol.address] = protocol
+        self.open_documents[protocol] = set()
+
+    def remove(self, protocol):
+        """ Remove a connection from every index.
+
+        Removing a connection which isn't registered does nothing.
+        """
+        if protocol not in self.open_documents:
+            return
+        if self.connections.get(protocol.address) is protocol:
+            del self.connections[protocol.address]
+        for document_id in self.open_documents.pop(protocol):
+            self._discard(self.documents, document_id, protocol)
+        username = self.usernames.pop(protocol, None)
+        if username is not None:
+            self._discard(self.users, username, protocol)
+        self.watchers.discard(protocol)
+
+    def set_username(self, protocol, username):
+        if protocol not in self.open_documents:
+            return
+        previous = self.usernames.get(protocol)
+        if previous is not None:
+            self._discard(self.users, previous, protocol)
+        self.usernames[protocol] = username
+        self.users.setdefault(username, set()).add(protocol)
+        self.watchers.add(protocol)
+
+    def document_opened(self, protocol, document_id):
+        if protocol not in self.open_documents:
+            return
+        self.open_documents[protocol].add(document_id)
+        self.documents.setdefault(document_id, set()).add(protocol)
+
+    def document_closed(self, protocol, document_id):
+        if protocol not in self.open_documents:
+            return
+        self.open_documents[protocol].discard(document_id)
+        self._discard(self.documents, document_id, protocol)
+
+    def viewers(self, document_id):
+        """ Return the connections which have the given document open.
+        """
+        return self.documents.get(document_id, frozenset())
+
+    def connections_of(self, username):
+        """ Return the connections authenticated as the given user.
+        """
+        return self.users.get(username, frozenset())
+
+    def stats(self):
+        """ Return counts of the indexed connections, and an estimate of the
+        memory used by the indexes, in bytes.
+        """
+        indexes = (self.connections, self.users, self.documents,
+                   self.usernames, self.open_documents, self.watchers)
+        memory = sum(getsizeof(index) for index in indexes)
+        for index in (self.users, self.documents, self.open_documents):
+            memory += sum(getsizeof(members) for members in index.itervalues())
+        return {
+            'connections': len(self.connections),
+            'users': len(self.users),
+            'watchers': len(self.watchers),
+            'open documents': len(self.documents),
+            'memory': memory,
+        }
+
+    @staticmethod
+    def _discard(index, key, protocol):
+        members = index.get(key)
+        if members is not None:
+            members.discard(protocol)
+            if not members:
+                del index[key]
@@ -0,0 +1,285 @@
+"""
+A front router which shards documents across several server processes.
+
+The router owns the client connections. For every client it opens one
+connection to each backend server, forwards document packets to the backend
+owning the document, and passes the backends' replies back to the client.
+"""
+from zlib import crc32
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList
+from twisted.internet.protocol import (ClientFactory, ClientCreator,
+                                       Protocol, ServerFactory)
+from twisted.internet.task import deferLater
+
+from colliberation.packets import parse_packets, build_packet, make_packet
+
+#: Packets describing the document catalog, which every backend must see.
+CATALOG_PACKETS = frozenset((
+    13,  # document_added
+    14,  # document_deleted
+    15,  # name_modified
+))
+
+#: Connection level packets, which every backend connection must see.
+CONNECTION_PACKETS = frozenset((
+    0,  # ping
+    4,  # handshake
+))
+
+HANDSHAKE = 4
+DOCUMENT_OPENED = 10
+DOCUMENT_CLOSED = 11
+
+CONNECT_RETRY_DELAY = .25
+DOCUMENT_MOVED = 'Document {0} has moved to another server, please reopen it.'
+
+
+class ShardMap(object):
+
+    """ Maps document ids to backends by hashing.
+
+    Every router must use the same list of backends, in the same order, for
+    documents to have a single owner.
+    """
+
+    def __init__(self, backends):
+        self.backends = list(backends)
+
+    def __len__(self):
+        return len(self.backends)
+
+    @property
+    def primary(self):
+        """ The backend handling packets which don't refer to a document.
+        """
+        return self.backends[0]
+
+    def owner(self, document_id):
+        """ Return the backend owning the given document.
+        """
+        index = (crc32(str(document_id)) & 0xffffffff) % len(self.backends)
+        return self.backends[index]
+
+
+class BackendProtocol(Protocol):
+
+    """ One router client's connection to a backend server.
+    """
+
+    def __init__(self, router, address):
+        self.router = router
+        self.address = address
+        self.buffer = ""
+
+    def connectionMade(self):
+        self.router.backend_connected(self)
+
+    def dataReceived(self, data):
+        self.buffer += data
+        packets, self.buffer = parse_packets(self.buffer)
+        for header, payload in packets:
+            self.router.backend_packet(self, header, payload)
+
+    def connectionLost(self, reason):
+        self.router.backend_lost(self, reason)
+
+
+class BackendFactory(ClientFactory):
+
+    """ Connects a router client to a single backend server.
+    """
+
+    def __init__(self, router, address):
+        self.router = router
+        self.address = address
+
+    def buildProtocol(self, addr):
+        return BackendProtocol(self.router, self.address)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.router.backend_failed(self.address, reason)
+
+
+class RouterProtocol(Protocol):
+
+    """ A client connection held by the router.
+
+    Packets from the client are parsed, and forwarded to the backends which
+    need them. Packets from the backends are filtered, so that the client
+    sees each reply once, from the backend owning the document.
+    """
+
+    def __init__(self, factory, address):
+        self.factory = factory
+        self.address = address
+        self.shards = factory.shards
+        self.buffer = ""
+
+        self.backends = {}  # address : BackendProtocol
+        self.pending = {}  # address : [data]
+
+        # Replayed to backends connected after the client's handshake.
+        self.handshake = None
+        self.open_documents = set()
+
+    def connectionMade(self):
+        self.factory.routers.add(self)
+        for address in self.shards.backends:
+            self.pending[address] = []
+            self.connect_backend(address)
+
+    def connect_backend(self, address):
+        host, port = address
+        reactor.connectTCP(host, port, BackendFactory(self, address))
+
+    def connectionLost(self, reason):
+        self.connected = False
+        self.factory.routers.discard(self)
+        for backend in self.backends.values():
+            backend.transport.loseConnection()
+        self.backends.clear()
+        self.pending.clear()
+
+    def dataReceived(self, data):
+        self.buffer += data
+        packets, self.buffer = parse_packets(self.buffer)
+        for header, payload in packets:
+            if header == HANDSHAKE:
+                # Each backend would give the client its own session, so
+                # sessions aren't resumed through a router.
+                payload.session = ''
+            data = build_packet(header, payload)
+            if header == HANDSHAKE:
+                self.handshake = data
+            elif header == DOCUMENT_OPENED:
+                self.open_documents.add(payload.document_id)
+            elif header == DOCUMENT_CLOSED:
+                self.open_documents.discard(payload.document_id)
+            for address in self.targets(header, payload):
+                self.send_to_backend(address, data)
+
+    def targets(self, header, payload):
+        """ Return the backends a packet from the client should go to.
+        """
+        if header in CATALOG_PACKETS or header in CONNECTION_PACKETS:
+            return self.shards.backends
+        if 'document_id' in payload:
+            return (self.shards.owner(payload.document_id),)
+        return (self.shards.primary,)
+
+    def accepts(self, address, header, payload):
+        """ Return whether a packet from a backend should reach the client.
+        """
+        if 'document_id' in payload:
+            return self.shards.owner(payload.document_id) == address
+        return address == self.shards.primary
+
+    def send_to_backend(self, address, data):
+        backend = self.backends.get(address)
+        if backend is not None:
+            backend.transport.write(data)
+        elif address in self.pending:
+            self.pending[address].append(data)
+
+    def backends_changed(self, owners):
+        """ Follow a change in the set of backends.
+
+        Connections are made to new backends and dropped from removed ones.
+        Documents the client has open which changed owner are closed, since
+        the new owner holds no shadow for this connection.
+
+        :param dict owners: Maps each document id which changed owner to its
+            previous owner.
+        """
+        backends = set(self.shards.backends)
+        for address in list(self.backends):
+            if address not in backends:
+                self.backends.pop(address).transport.loseConnection()
+        for address in list(self.pending):
+            if address not in backends:
+                del self.pending[address]
+        for address in backends:
+            if address in self.backends or address in self.pending:
+                continue
+            self.pending[address] = []
+            if self.handshake is not None:
+                self.pending[address].append(self.handshake)
+            self.connect_backend(address)
+
+        for document_id, previous in owners.iteritems():
+            if document_id not in self.open_documents:
+                continue
+            self.open_documents.discard(document_id)
+            closed = make_packet('document_closed',
+                                 document_id=document_id, version=0)
+            self.send_to_backend(previous, closed)
+            self.transport.write(closed)
+            self.transport.write(make_packet(
+                'message', message=DOCUMENT_MOVED.format(document_id)))
+
+    # Backend events
+    def backend_connected(self, backend):
+        if not self.connected:
+            backend.transport.loseConnection()
+            return
+        self.backends[backend.address] = backend
+        pending = self.pending.pop(backend.address, ())
+        if pending:
+            backend.transport.write(''.join(pending))
+
+    def backend_packet(self, backend, header, payload):
+        if self.accepts(backend.address, header, payload):
+            self.transport.write(build_packet(header, payload))
+
+    def backend_lost(self, backend, reason):
+        # Without every backend, some documents can't be served.
+        if self.backends.get(backend.address) is backend:
+            del self.backends[backend.address]
+            self.transport.loseConnection()
+
+    def backend_failed(self, address, reason):
+        print('Backend {0} unavailable: {1}'.format(
+            address, reason.getErrorMessage()))
+        self.transport.loseConnection()
+
+
+class RouterFactory(ServerFactory):
+
+    """ A factory for router client connections.
+    """
+
+    protocol_class = RouterProtocol
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.routers = set()
+
+    def buildProtocol(self, addr):
+        return self.protocol_class(self, addr)
+
+
+def wait_for_backends(addresses, attempts=40):
+    """ Wait until every backend server accepts connections.
+
+    Returns a Deferred which fires once a connection has been made to each
+    backend, or fails once a backend has refused every attempt.
+    """
+    def attempt(address, remaining):
+        host, port = address
+        deferred = ClientCreator(reactor, Protocol).connectTCP(host, port)
+
+        def connected(protocol):
+            protocol.transport.loseConnection()
+            return address
+
+        def failed(failure):
+            if remaining <= 1:
+                return failure
+            return deferLater(reactor, CONNECT_RETRY_DELAY,
+                              attempt, address, remaining - 1)
+        return deferred.addCallbacks(connected, failed)
+
+    return DeferredList([attempt(address, attempts) for address in addresses],
+                        fireOnOneErrback=True, consumeErrors=True)
@@ -0,0 +1,268 @@
+"""
+Fair scheduling of the edits a server receives.
+"""
+from collections import OrderedDict
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+#: Edit operations a connection may start per second, as the
+#: "operation limit" setting.
+OPERATION_LIMIT = 20
+
+#: Edit operations started per reactor turn, before other events are let in.
+BATCH_SIZE = 32
+
+#: Waiting text_modified packets of a connection before reading from it is
+#: paused.
+MAX_PENDING = 256
+
+
+class TokenBucket(object):
+
+    """ Allows rate operations per second, in bursts of up to capacity.
+    """
+
+    def __init__(self, rate, capacity, clock=reactor):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock.seconds()
+
+    def refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """ Take a token, returning False if there are none left.
+        """
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self):
+        """ Seconds until the next token is available.
+        """
+        self.refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+
+class EditScheduler(object):
+
+    """ Admits the text_modified packets of a server's connections fairly.
+
+    Packets aren't handled as they are read, but queued by connection and
+    document. Connections are served in turn, one document at a time, each
+    turn starting one synchronization step. A step covers every packet
+    waiting for that connection and document, composed into one, so a
+    connection which sends faster than it is served has its edits merged
+    rather than queued without end.
+
+    Each connection may start limit steps per second, in bursts of up to
+    limit, and only one step per document at a time. Steps are started from
+    the reactor, BATCH_SIZE at a time, so that a busy connection can't hold
+    up the handling of other connections' packets.
+
+    :param int limit: Steps a connection may start per second, or None for
+        no limit.
+    """
+
+    def __init__(self, limit=OPERATION_LIMIT, batch_size=BATCH_SIZE,
+                 max_pending=MAX_PENDING, clock=reactor):
+        self.limit = limit
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.clock = clock
+
+        self.pending = {}  # protocol : OrderedDict(document id : [payload])
+        self.counts = {}  # protocol : waiting packets
+        self.buckets = {}  # protocol : TokenBucket
+        # Connections with packets waiting for a step, in turn.
+        self.ready = OrderedDict()  # protocol : None
+        self.running = set()  # (protocol, document id)
+        self.paused = set()  # protocols which aren't being read from
+        # Deferreds waiting for a connection's edits to a document, see
+        # drained.
+        self.waiting = {}  # (protocol, document id) : [Deferred]
+        self.call = None
+
+        # Metrics
+        self.submitted = 0
+        self.started = 0
+        self.coalesced = 0
+        self.throttled = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return sum(self.counts.itervalues())
+
+    def submit(self, protocol, data):
+        """ Queue a text_modified packet from a connection.
+        """
+        documents = self.pending.get(protocol)
+        if documents is None:
+            documents = self.pending[protocol] = OrderedDict()
+            self.counts[protocol] = 0
+        documents.setdefault(data.document_id, []).append(data)
+        self.ready[protocol] = None
+        self.counts[protocol] += 1
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, len(self))
+
+        if (self.counts[protocol] >= self.max_pending and
+                protocol not in self.paused):
+            self.pause(protocol)
+        self.schedule()
+
+    def busy(self, protocol, document_id):
+        """ Whether edits of a connection to a document are queued or
+        running.
+        """
+        return ((protocol, document_id) in self.running or
+                document_id in self.pending.get(protocol, ()))
+
+    def drained(self, protocol, document_id):
+        """ Return a Deferred which fires once the edits of a connection to
+        a document, queued or running, have all finished.
+        """
+        deferred = Deferred()
+        if self.busy(protocol, document_id):
+            key = (protocol, document_id)
+            self.waiting.setdefault(key, []).append(deferred)
+        else:
+            deferred.callback(None)
+        return deferred
+
+    def remove(self, protocol):
+        """ Forget a connection which has been lost.
+        """
+        self.pending.pop(protocol, None)
+        self.counts.pop(protocol, None)
+        self.buckets.pop(protocol, None)
+        self.paused.discard(protocol)
+        self.ready.pop(protocol, None)
+        for key in [key for key in self.waiting if key[0] is protocol]:
+            del self.waiting[key]
+
+    def schedule(self, delay=0):
+        if self.call is None and self.ready:
+            self.call = self.clock.callLater(delay, self.service)
+
+    def service(self):
+        """ Start steps for up to batch_size connections, in turn.
+        """
+        self.call = None
+        started = False
+        wait = None
+        for _ in xrange(min(self.batch_size, len(self.ready))):
+            protocol = self.ready.popitem(last=False)[0]
+            document_id = self.next_document(protocol)
+            if document_id is None:
+                # Every waiting document has a step running. The connection
+                # is served again once one finishes.
+                continue
+
+            bucket = self.bucket(protocol)
+            if bucket is not None and not bucket.take():
+                self.throttled += 1
+                self.ready[protocol] = None
+                delay = bucket.delay()
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            started = True
+            self.start(protocol, document_id)
+            if protocol in self.pending:
+                self.ready[protocol] = None
+
+        # Only wait when every connection served was throttled.
+        self.schedule(0 if started else wait or 0)
+
+    def next_document(self, protocol):
+        for document_id in self.pending[protocol]:
+            if (protocol, document_id) not in self.running:
+                return document_id
+        return None
+
+    def bucket(self, protocol):
+        if self.limit is None:
+            return None
+        bucket = self.buckets.get(protocol)
+        if bucket is None:
+            bucket = self.buckets[protocol] = TokenBucket(
+                self.limit, self.limit, self.clock)
+        return bucket
+
+    def start(self, protocol, document_id):
+        """ Start a step for every waiting packet of a connection's document.
+        """
+        documents = self.pending[protocol]
+        run = documents.pop(document_id)
+        self.counts[protocol] -= len(run)
+        if not documents:
+            del self.pending[protocol]
+            del self.counts[protocol]
+        if protocol in self.paused and \
+                self.counts.get(protocol, 0) < self.max_pending // 2:
+            self.resume(protocol)
+
+        self.started += 1
+        self.coalesced += len(run) - 1
+        if document_id in protocol.shadow_docs:
+            data = protocol.merge_text_modified(run)
+        else:
+            data = run[-1]
+
+        key = (protocol, document_id)
+        self.running.add(key)
+        deferred = protocol.apply_text_modified(data)
+        if deferred is None:
+            self.finished(None, key)
+        else:
+            deferred.addBoth(self.finished, key)
+
+    def finished(self, result, key):
+        self.running.discard(key)
+        protocol = key[0]
+        if protocol in self.pending:
+            self.ready[protocol] = None
+            self.schedule()
+        if key in self.waiting and not self.busy(*key):
+            for deferred in self.waiting.pop(key):
+                deferred.callback(None)
+        return result
+
+    def pause(self, protocol):
+        transport = protocol.transport
+        if hasattr(transport, 'pauseProducing'):
+            transport.pauseProducing()
+        self.paused.add(protocol)
+
+    def resume(self, protocol):
+        transport = protocol.transport
+        if hasattr(transport, 'resumeProducing'):
+            transport.resumeProducing()
+        self.paused.discard(protocol)
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def stats(self):
+        return {
+            'queued packets': len(self),
+            'ready connections': len(self.ready),
+            'running steps': len(self.running),
+            'paused connections': len(self.paused),
+            'submitted': self.submitted,
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'throttled': self.throttled,
+            'max queued packets': self.max_depth,
+        }
@@ -0,0 +1,249 @@
+"""
+Sessions which let clients pick up where they left off after reconnecting.
+"""
+import cPickle as pickle
+import os
+from collections import deque, namedtuple
+from zlib import crc32
+
+from twisted.internet import reactor
+
+from colliberation.serializer import replace_file
+from colliberation.server.cache import DocumentStub
+
+#: Seconds a lost connection's session is kept for it to be resumed.
+GRACE_PERIOD = 60
+
+#: Catalog changes remembered for resuming sessions.
+CATALOG_LOG_SIZE = 10000
+
+#: Checkpoint of the sessions of a server, in its journal directory.
+SESSIONS_NAME = 'sessions.ckpt'
+
+#: A shadow as stored in a checkpoint. Shadows matching their document are
+#: only stored as the document's version, checksum and length, and content
+#: is None. Other shadows are stored in full.
+ShadowCheckpoint = namedtuple('ShadowCheckpoint', [
+    'version', 'checksum', 'length', 'content'
+])
+
+
+def checksum(content):
+    return crc32(content) & 0xffffffff
+
+
+def checkpoint_shadow(shadow, document):
+    """ Return the ShadowCheckpoint of a shadow of a document.
+
+    :param document: The document, or None if its content isn't loaded.
+    """
+    content = shadow.content
+    if document is not None and document.content == content:
+        content = None
+    return ShadowCheckpoint(shadow.version, checksum(shadow.content),
+                            len(shadow.content), content)
+
+
+def restore_shadow(checkpoint, shadow):
+    """ Restore the content of a checkpointed shadow.
+
+    If the checkpoint only holds a fingerprint of the document, and the
+    recovered document doesn't match it, the shadow is left empty, so that
+    the client's check of its shadow fails and it opens the document again.
+
+    :param shadow: A new shadow, updated from the recovered document.
+    """
+    if checkpoint.content is not None:
+        shadow.content = checkpoint.content
+    elif (len(shadow.content) != checkpoint.length or
+            checksum(shadow.content) != checkpoint.checksum):
+        shadow.content = ''
+    shadow.version = checkpoint.version
+    return shadow
+
+
+class Session(object):
+
+    """ The state of a lost connection, kept for it to resume.
+
+    :param str token: The token the client resumes the session with.
+    :param str username: The user the connection was authenticated as.
+    :param dict shadows: The connection's shadows, by document id. The
+        documents they shadow were the ones the connection had open.
+    :param int catalog_sequence: The last catalog change the connection was
+        told about.
+    """
+
+    def __init__(self, token, username, shadows, catalog_sequence):
+        self.token = token
+        self.username = username
+        self.shadows = shadows
+        self.catalog_sequence = catalog_sequence
+        self.expiry = None
+
+
+class SessionStore(object):
+
+    """ Holds the sessions of lost connections for a grace period.
+
+    Each connection is given a random token in reply to its handshake. When
+    a connection is lost, its shadows are detached into a Session, which is
+    resumed if the client reconnects with the same token and username
+    within grace_period seconds. The store also keeps a bounded log of
+    which documents were added, deleted or renamed, so that a resumed
+    connection is only told about the catalog changes it missed.
+    """
+
+    def __init__(self, grace_period=GRACE_PERIOD, clock=reactor,
+                 log_size=CATALOG_LOG_SIZE):
+        self.grace_period = grace_period
+        self.clock = clock
+        self.sessions = {}  # token : Session
+        self.catalog_log = deque(maxlen=log_size)  # (sequence, document id)
+        self.catalog_sequence = 0
+
+        # Metrics
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, token):
+        return token in self.sessions
+
+    def create(self):
+        """ Return a token for a new session.
+        """
+        self.created += 1
+        return os.urandom(16).encode('hex')
+
+    def detach(self, token, username, shadows, catalog_sequence=None):
+        """ Keep the state of a lost connection for the grace period.
+        """
+        if not self.grace_period:
+            return
+        if catalog_sequence is None:
+            catalog_sequence = self.catalog_sequence
+        session = Session(token, username, shadows, catalog_sequence)
+        session.expiry = self.clock.callLater(
+            self.grace_period, self.expire, token)
+        self.sessions[token] = session
+
+    def resume(self, token, username):
+        """ Take back a detached session.
+
+        Returns None if there is no such session for the user, or the
+        session missed more catalog changes than are remembered.
+        """
+        session = self.sessions.get(token)
+        if session is None or session.username != username:
+            return None
+        self.discard(token)
+        if self.catalog_changes(session.catalog_sequence) is None:
+            return None
+        self.resumed += 1
+        return session
+
+    def expire(self, token):
+        session = self.sessions.pop(token, None)
+        if session is not None:
+            self.expired += 1
+
+    def discard(self, token):
+        session = self.sessions.pop(token, None)
+        if session is not None and session.expiry.active():
+            session.expiry.cancel()
+
+    def stop(self):
+        for token in self.sessions.keys():
+            self.discard(token)
+
+    # Catalog
+    def catalog_changed(self, document_id):
+        """ Note that a document was added, deleted or renamed.
+        """
+        self.catalog_sequence += 1
+        self.catalog_log.append((self.catalog_sequence, document_id))
+
+    def catalog_changes(self, sequence):
+        """ Return the ids of documents changed after a catalog sequence.
+
+        Returns None if changes that far back have been forgotten.
+        """
+        if sequence == self.catalog_sequence:
+            return set()
+        if not self.catalog_log or self.catalog_log[0][0] > sequence + 1:
+            return None
+        return set(document_id
+                   for change_sequence, document_id in self.catalog_log
+                   if change_sequence > sequence)
+
+    # Checkpoints
+    def checkpoint(self, path, connections, documents):
+        """ Write the sessions to a file, so that they may be resumed after
+        the server restarts.
+
+        :param connections: (token, username, shadows) of the live
+            connections, which are checkpointed as if they were lost.
+        :param documents: The server's documents, by id.
+        """
+        sessions = [(session.token, session.username, session.shadows,
+                     session.catalog_sequence)
+                    for session in self.sessions.itervalues()]
+        sessions.extend((token, username, shadows, self.catalog_sequence)
+                        for token, username, shadows in connections)
+
+        checkpoints = []
+        for token, username, shadows, catalog_sequence in sessions:
+            shadow_checkpoints = {}
+            for document_id, shadow in shadows.iteritems():
+                if not isinstance(shadow, ShadowCheckpoint):
+                    document = documents.get(document_id)
+                    # Spilled documents aren't loaded to be compared.
+                    if isinstance(document, DocumentStub):
+                        document = None
+                    shadow = checkpoint_shadow(shadow, document)
+                shadow_checkpoints[document_id] = shadow
+            checkpoints.append((token, username, shadow_checkpoints,
+                                catalog_sequence))
+
+        with open(path + '.tmp', 'wb') as checkpoint_file:
+            pickle.dump({
+                'catalog sequence': self.catalog_sequence,
+                'catalog log': list(self.catalog_log),
+                'sessions': checkpoints,
+            }, checkpoint_file, pickle.HIGHEST_PROTOCOL)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        replace_file(path + '.tmp', path)
+
+    def restore(self, path):
+        """ Take back the sessions of a checkpoint, as detached sessions.
+
+        The checkpoint is removed once read, so that a later crash doesn't
+        restore sessions which have moved on since. Returns the number of
+        sessions restored.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+        os.remove(path)
+
+        self.catalog_sequence = checkpoint['catalog sequence']
+        self.catalog_log.extend(checkpoint['catalog log'])
+        for token, username, shadows, catalog_sequence in \
+                checkpoint['sessions']:
+            self.detach(token, username, shadows, catalog_sequence)
+        return len(checkpoint['sessions'])
+
+    def stats(self):
+        return {
+            'detached sessions': len(self.sessions),
+            'created': self.created,
+            'resumed': self.resumed,
+            'expired': self.expired,
+            'catalog sequence': self.catalog_sequence,
+        }
@@ -0,0 +1,100 @@
+"""
+A hashed timer wheel for the coarse timers of a server's connections.
+"""
+from math import ceil
+
+from twisted.internet import reactor
+
+#: Seconds between turns of the wheel.
+TICK = 1.0
+
+#: Slots of the wheel. Timers further away than a full turn wait for the
+#: wheel to come round again.
+WHEEL_SIZE = 256
+
+
+class TimerWheel(object):
+
+    """ Runs many coarse timers off a single reactor call.
+
+    Timers are hashed into slots by the tick they are due on, and the wheel
+    visits one slot a tick. Scheduling or cancelling a timer is a dict
+    operation, and the reactor only ever holds the call for the next tick,
+    however many timers there are. Timers fire up to one tick late.
+
+    Each timer has a key, such as the connection it belongs to, and a key
+    has at most one timer: scheduling it again moves it.
+    """
+
+    def __init__(self, tick=TICK, size=WHEEL_SIZE, clock=reactor):
+        self.tick = tick
+        self.clock = clock
+        self.slots = [{} for _ in xrange(size)]  # key : (due tick, callback)
+        self.where = {}  # key : slot index
+        self.ticks = 0
+        self.now = clock.seconds()
+        self.call = None
+
+        # Metrics
+        self.scheduled = 0
+        self.fired = 0
+        self.turns = 0
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def schedule(self, key, delay, callback):
+        """ Call callback() in about delay seconds, replacing any timer of
+        the key.
+        """
+        self.cancel(key)
+        if self.call is None:
+            # The wheel stood still, so its idea of the time is stale.
+            self.now = self.clock.seconds()
+        due = self.ticks + max(1, int(ceil(delay / self.tick)))
+        index = due % len(self.slots)
+        self.slots[index][key] = (due, callback)
+        self.where[key] = index
+        self.scheduled += 1
+        if self.call is None:
+            self.call = self.clock.callLater(self.tick, self.advance)
+
+    def cancel(self, key):
+        index = self.where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self):
+        """ Turn the wheel a tick, firing the timers due.
+        """
+        self.call = None
+        self.ticks += 1
+        self.turns += 1
+        self.now = self.clock.seconds()
+        slot = self.slots[self.ticks % len(self.slots)]
+        due = [(key, callback) for key, (tick, callback) in slot.iteritems()
+               if tick <= self.ticks]
+        for key, callback in due:
+            del slot[key]
+            del self.where[key]
+        for key, callback in due:
+            self.fired += 1
+            callback()
+        if self.where and self.call is None:
+            self.call = self.clock.callLater(self.tick, self.advance)
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def stats(self):
+        return {
+            'timers': len(self),
+            'scheduled': self.scheduled,
+            'fired': self.fired,
+            'turns': self.turns,
+        }
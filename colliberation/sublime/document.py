@@ -1,6 +1,7 @@
 import sublime
 
 from colliberation.document import Document
+from colliberation.patching import replace_edit
 
 from sublime_utils import enable_listener, disable_listener, views_from_buffer
 
@@ -8,10 +9,17 @@ from sublime_plugin import EventListener
 
 DEBUG = False
 
+#: How other connections' cursors and selections are outlined in a view.
+PRESENCE_KEY = 'collaboration-presence-{0}'
+PRESENCE_SCOPE = 'comment'
 
-def log(text):
+
+def log(text, *args):
+    """ Print a debugging message, formatted with args only when
+    debugging is enabled.
+    """
     if DEBUG:
-        print(text)
+        print(text.format(*args) if args else text)
 
 
 class SublimeDocument(Document, EventListener):
@@ -22,10 +30,21 @@ class SublimeDocument(Document, EventListener):
     """
 
     def __init__(self, **kwargs):
-        log("Initialized document {0}".format(self))
+        log("Initialized document {0}", self)
         self.buffer_id = None
         self.view = None
+        # The view's content, as of the view's change count _cache_count.
+        # While no view is open, _cache is the document's content.
         self._cache = ''
+        self._cache_count = None
+        # Called with the document when the view's selection moves, see
+        # SublimeCollabProtocol.selection_modified.
+        self.selection_listener = None
+        # Keys of the regions outlining other connections' presence.
+        self._presence_keys = set()
+        # The view edit which change_text and delete_text join, while
+        # apply_edits runs.
+        self._edit = None
         self._name = ''
         Document.__init__(self, **kwargs)
 
@@ -33,46 +52,87 @@ class SublimeDocument(Document, EventListener):
     def on_close(self, view):
         self_buffer_id = self.buffer_id
         if view.buffer_id() == self_buffer_id:
-            log("{0}: View closed. Switching...".format(self))
+            log("{0}: View closed. Switching...", self)
             available_views = views_from_buffer(self_buffer_id)
             if available_views:
-                self.view = available_views[0]
+                self.view, window = available_views[0]
+                self._cache_count = None
+                self._presence_keys = set()
             elif self.state_deferral is not None:
-                log("{0}: Switching failed.".format(self))
-                log("{0}: Nulling state_deferral, calling".format(self))
+                log("{0}: Switching failed.", self)
+                log("{0}: Nulling state_deferral, calling", self)
                 deferral = self.state_deferral
                 self.state_deferral = None
                 deferral.callback(self)
             else:
                 raise Exception("Ran out of views when not opened")
 
+    def on_selection_modified(self, view):
+        if (self.selection_listener is not None and
+                view.buffer_id() == self.buffer_id):
+            self.selection_listener(self)
+
+    def selection(self):
+        """ Return (start, end) tuples of the view's selections.
+        """
+        if self.view is None:
+            return []
+        return [(region.a, region.b) for region in self.view.sel()]
+
+    def show_presence(self, presence):
+        """ Outline other connections' cursors and selections in the view.
+
+        :param presence: Presence packets, by connection id.
+        """
+        self_view = self.view
+        if self_view is None:
+            return
+        keys = set()
+        for connection, data in presence.iteritems():
+            key = PRESENCE_KEY.format(connection)
+            keys.add(key)
+            regions = [sublime.Region(region.start, region.end)
+                       for region in data.regions]
+            self_view.add_regions(key, regions, PRESENCE_SCOPE, '',
+                                  sublime.DRAW_EMPTY | sublime.DRAW_OUTLINED)
+        for key in self._presence_keys - keys:
+            self_view.erase_regions(key)
+        self._presence_keys = keys
+
     # Document methods
 
     @property
     def content(self):
-        log("{0}: Content retrieved".format(self))
-        if self.view is not None:
-            log("{0}: Using view's content".format(self))
-            region = sublime.Region(0, self.view.size())
-            return self.view.substr(region)
-        else:
-            log("{0}: Using cached content.".format(self))
-            return self._cache
+        """ The document's text.
+
+        Text is only copied out of the view again once the view's change
+        count has moved since it was last read.
+        """
+        self_view = self.view
+        if self_view is not None:
+            change_count = self_view.change_count()
+            if change_count != self._cache_count:
+                log("{0}: Reading view's content", self)
+                region = sublime.Region(0, self_view.size())
+                self._cache = self_view.substr(region)
+                self._cache_count = change_count
+        return self._cache
 
     @content.setter
     def content(self, value):
-        log("{0}: Setting document content".format(self))
-        if self.view is not None:
-            log("{0}: Directly setting view content".format(self))
-            self_view = self.view
-            region = sublime.Region(0, self.view.size())
-
-            edit = self_view.begin_edit()
-            self.view.replace(edit, region, value)
-            self_view.end_edit(edit)
+        log("{0}: Setting document content", self)
+        self_view = self.view
+        if self_view is not None:
+            # Only replace the part of the view that differs, which keeps
+            # the selection, scroll position and undo history of the rest.
+            edit = replace_edit(self.content, value)
+            if edit is not None:
+                log("{0}: Editing view content", self)
+                self.apply_edits([edit])
+            self._cache_count = self_view.change_count()
         else:
-            log("{0}: Setting cache content".format(self))
-            self._cache = value
+            log("{0}: Setting cache content", self)
+        self._cache = value
 
     @property
     def name(self):
@@ -83,32 +143,55 @@ class SublimeDocument(Document, EventListener):
         self._name = value
         if self.buffer_id is not None:
             views = views_from_buffer(self.buffer_id)
-            for window, view in views:
+            for view, window in views:
                 view.set_name(value)
 
     def change_text(self, start, text, end):
-        log("{0}: Changing text.".format(self))
-        region = sublime.Region(start, end)
-        edit = self.view.begin_edit()
-        self.view.replace(edit, region, text)
-        self.view.end_edit(edit)
+        log("{0}: Changing text.", self)
+        self.edit_view(self.view.replace, sublime.Region(start, end), text)
 
     def delete_text(self, start, end):
-        log("{0}: Deleting text.".format(self))
-        region = sublime.Region(start, end)
-        edit = self.view.begin_edit()
-        self.view.erase(edit, region)
-        self.view.end_edit(edit)
+        log("{0}: Deleting text.", self)
+        self.edit_view(self.view.erase, sublime.Region(start, end))
+
+    def edit_view(self, method, *args):
+        """ Call a view method taking an edit, such as replace, in the
+        edit apply_edits opened, or else in an edit of its own.
+        """
+        edit = self._edit
+        if edit is not None:
+            return method(edit, *args)
+        self_view = self.view
+        edit = self_view.begin_edit()
+        try:
+            return method(edit, *args)
+        finally:
+            self_view.end_edit(edit)
+
+    def apply_edits(self, edits):
+        """ Apply a sequence of edits to the view, as a single edit.
+
+        A peer's changes are then undone in one step, like a local edit.
+        """
+        if self.view is None or self._edit is not None:
+            return Document.apply_edits(self, edits)
+        self_view = self.view
+        self._edit = self_view.begin_edit()
+        try:
+            Document.apply_edits(self, edits)
+        finally:
+            self_view.end_edit(self._edit)
+            self._edit = None
 
     def open(self):
         """
         Enable listening to events,
         Create view and buffer_id
         """
-        log("{0}: Opened".format(self))
+        log("{0}: Opened", self)
         enable_listener(self)
         if self.buffer_id is None:
-            log("{0}: Empty buffer ID. Creating view.".format(self))
+            log("{0}: Empty buffer ID. Creating view.", self)
             self_view = sublime.active_window().new_file()
             self_view.set_scratch(True)
             self_view.set_name(self.name)
@@ -119,11 +202,11 @@ class SublimeDocument(Document, EventListener):
         return Document.open(self)
 
     def close(self):
-        log("{0}: Closing".format(self))
+        log("{0}: Closing", self)
         disable_listener(self)
         open_views = views_from_buffer(self.buffer_id)
         args = {'group': None, 'index': None}
-        for window, view in open_views:
+        for view, window in open_views:
             args['group'], args['index'] = window.get_view_index(view)
             window.run_command("close_by_index", args)
 
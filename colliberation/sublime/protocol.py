@@ -3,10 +3,18 @@ from colliberation.sublime.document import SublimeDocument
 
 from sublime_utils import current_view
 
+#: Seconds over which selection changes are gathered into one presence packet.
+PRESENCE_DELAY = .1
+
 
 class SublimeCollabProtocol(CollaborationProtocol):
     doc_class = SublimeDocument
 
+    def __init__(self, **kwargs):
+        CollaborationProtocol.__init__(self, **kwargs)
+        # Pending calls of send_selection, see selection_modified.
+        self.selection_calls = {}  # document id : call
+
     def connectionMade(self):
         view = current_view()
         if view is not None:
@@ -20,3 +28,53 @@ class SublimeCollabProtocol(CollaborationProtocol):
                 "Collaboration",
                 "Connection lost. ({0})".format(reason)
             )
+        for call in self.selection_calls.itervalues():
+            call.cancel()
+        self.selection_calls.clear()
+        CollaborationProtocol.connectionLost(self, reason)
+
+    def ping_recieved(self, data):
+        CollaborationProtocol.ping_recieved(self, data)
+        view = current_view()
+        if data.echo and view is not None:
+            view.set_status(
+                "Collaboration",
+                "Connected ({0:.0f} ms, jitter {1:.0f} ms)".format(
+                    self.latency.srtt * 1000, self.latency.jitter * 1000)
+            )
+
+    def document_opened_hooked(self, document, data, shadow):
+        opened = CollaborationProtocol.document_opened_hooked(
+            self, document, data, shadow)
+        if opened:
+            document.selection_listener = self.selection_modified
+            document.show_presence(self.presence.get(data.document_id, {}))
+        return opened
+
+    def document_closed_hooked(self, document, data):
+        call = self.selection_calls.pop(data.document_id, None)
+        if call is not None:
+            call.cancel()
+        if document is not None:
+            document.selection_listener = None
+        return CollaborationProtocol.document_closed_hooked(
+            self, document, data)
+
+    def presence_changed(self, data):
+        CollaborationProtocol.presence_changed(self, data)
+        document = self.open_docs.get(data.document_id)
+        if document is not None:
+            document.show_presence(self.presence[data.document_id])
+
+    def selection_modified(self, document):
+        """ Send where our cursors are in a document, at most once every
+        PRESENCE_DELAY seconds however often the selection moves.
+        """
+        if document.id not in self.selection_calls:
+            self.selection_calls[document.id] = self.clock.callLater(
+                PRESENCE_DELAY, self.send_selection, document)
+
+    def send_selection(self, document):
+        del self.selection_calls[document.id]
+        if document.id in self.open_docs:
+            self.send_presence(document.id, document.selection())
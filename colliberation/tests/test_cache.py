@@ -0,0 +1,107 @@
+"""
+Document cache tests.
+"""
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from mock import MagicMock
+from twisted.internet.task import Clock
+
+from colliberation.document import Document
+from colliberation.server.cache import DocumentCache, DocumentStub
+from colliberation.server.registry import ConnectionRegistry
+
+
+class DocumentCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.clock = Clock()
+        self.registry = ConnectionRegistry()
+        self.documents = {}
+        for document_id in xrange(1, 4):
+            self.documents[document_id] = Document(
+                id=document_id, name='{0}.txt'.format(document_id),
+                content='x' * 100 * document_id)
+        self.cache = DocumentCache(self.documents, self.registry,
+                                   directory=self.directory, clock=self.clock)
+        for document_id in self.documents:
+            self.cache.touch(document_id)
+
+    def tearDown(self):
+        self.cache.stop()
+        rmtree(self.directory)
+
+    def test_evict_load(self):
+        self.documents[2].open()
+        self.cache.evict(2)
+        self.assertIsInstance(self.documents[2], DocumentStub)
+
+        self.documents[2].name = 'renamed.txt'
+        document = self.cache.load(2)
+        self.assertIs(self.documents[2], document)
+        self.assertEqual(document.content, 'x' * 200)
+        self.assertEqual(document.name, 'renamed.txt')
+        self.assertEqual(document.id, 2)
+        self.assertEqual(document.url, '')
+
+        self.cache.load(2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_idle_ttl(self):
+        self.cache.idle_ttl = 60
+        viewer = MagicMock('protocol', address=('127.0.0.1', 1000))
+        self.registry.add(viewer)
+        self.registry.document_opened(viewer, 1)
+        self.clock.advance(30)
+        self.cache.touch(3)
+        self.clock.advance(40)
+        self.cache.sweep()
+
+        # Document 1 is open, and document 3 was used recently.
+        self.assertIsInstance(self.documents[1], Document)
+        self.assertIsInstance(self.documents[2], DocumentStub)
+        self.assertIsInstance(self.documents[3], Document)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_max_bytes(self):
+        self.cache.max_bytes = 450
+        self.cache.touch(1)
+        self.cache.sweep()
+
+        # Document 2 is the least recently used, and spilling it is enough.
+        self.assertIsInstance(self.documents[2], DocumentStub)
+        self.assertEqual(self.cache.resident_bytes(), 400)
+        stats = self.cache.stats()
+        self.assertEqual(stats['spilled documents'], 1)
+        self.assertEqual(stats['resident documents'], 2)
+
+    def test_max_bytes_stub(self):
+        # Stubbed behind the cache's back, as a catalog entry would be.
+        self.documents[1] = DocumentStub(self.documents[1], 'elsewhere')
+        self.cache.touch(1)
+        self.cache.max_bytes = 350
+        self.cache.sweep()
+
+        self.assertNotIn(1, self.cache.used)
+        self.assertIsInstance(self.documents[2], DocumentStub)
+        self.assertEqual(self.cache.resident_bytes(), 300)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_discard(self):
+        self.cache.evict(3)
+        self.cache.discard(3)
+        del self.documents[3]
+        self.cache.sweep()
+        self.assertNotIn(3, self.cache.used)
+        self.assertRaises(KeyError, self.cache.load, 3)
+
+    def test_start(self):
+        self.cache.start()
+        self.assertIsNone(self.cache.sweep_loop)
+
+        self.cache.idle_ttl = 10
+        self.cache.start(rate=5)
+        self.clock.advance(15)
+        self.assertEqual(self.cache.evictions, 3)
@@ -0,0 +1,121 @@
+"""
+Document catalog tests.
+"""
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from colliberation.catalog import CATALOG_NAME, CatalogIndex
+from colliberation.document import Document
+from colliberation.journal import JournalSerializer, SNAPSHOT_EXTENSION
+from colliberation.server.cache import DocumentCache, DocumentStub
+from colliberation.server.registry import ConnectionRegistry
+
+
+class CatalogIndexTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, CATALOG_NAME)
+        self.catalog = CatalogIndex(self.path)
+        self.journal = JournalSerializer(self.directory)
+
+    def tearDown(self):
+        self.catalog.close()
+        rmtree(self.directory)
+
+    def make_document(self, document_id, content='hello'):
+        document = Document(id=document_id, name='{0}.txt'.format(document_id),
+                            content=content)
+        document.url = self.journal.url_for(document_id)
+        return document
+
+    def reopen(self):
+        self.catalog.close()
+        self.catalog = CatalogIndex(self.path)
+
+    def test_put_delete(self):
+        for document_id in xrange(3):
+            self.catalog.put(self.make_document(document_id))
+        document = self.make_document(1, 'hello world')
+        document.version = 4
+        self.catalog.put(document)
+        self.catalog.delete(2)
+        self.reopen()
+
+        self.assertEqual(sorted(entry.id for entry in self.catalog), [0, 1])
+        entry = self.catalog.get(1)
+        self.assertEqual((entry.name, entry.version, entry.size),
+                         ('1.txt', 4, 11))
+        self.assertEqual(entry.url, document.url)
+
+        self.catalog.delete_url(document.url)
+        self.assertNotIn(1, self.catalog)
+
+    def test_torn_record(self):
+        self.catalog.put(self.make_document(1))
+        self.catalog.put(self.make_document(2))
+        self.catalog.close()
+        with open(self.path, 'r+b') as catalog_file:
+            catalog_file.truncate(os.path.getsize(self.path) - 1)
+
+        self.catalog = CatalogIndex(self.path)
+        self.assertEqual([entry.id for entry in self.catalog], [1])
+        self.catalog.put(self.make_document(3))
+        self.reopen()
+        self.assertEqual(len(self.catalog), 2)
+
+    def test_compact(self):
+        document = self.make_document(1)
+        for version in xrange(1100):
+            document.version = version
+            self.catalog.put(document)
+        self.assertLess(self.catalog.records, 1100)
+        self.reopen()
+        self.assertEqual(self.catalog.get(1).version, 1099)
+
+    def test_reconcile(self):
+        self.journal.snapshot(self.make_document(1))
+        self.catalog.put(self.make_document(2))
+        self.catalog.reconcile(self.directory, SNAPSHOT_EXTENSION)
+
+        self.assertEqual([entry.id for entry in self.catalog], [1])
+        self.assertEqual(self.catalog.get(1).size, 5)
+
+    def test_journal(self):
+        self.journal.catalog = self.catalog
+        document = self.make_document(1)
+        self.journal.save_document(document)
+        document.name = 'renamed.txt'
+        self.journal.save_document(document)
+        self.assertEqual(self.catalog.get(1).name, 'renamed.txt')
+
+        self.journal.delete_document(document.url)
+        self.assertEqual(len(self.catalog), 0)
+
+    def load_stub(self, entry, name=None):
+        journal = JournalSerializer(self.directory)
+        stub = DocumentStub(entry, entry.url, journal)
+        if name is not None:
+            stub.name = name
+        cache = DocumentCache({entry.id: stub}, ConnectionRegistry())
+        return cache.load(entry.id)
+
+    def test_stale_catalog(self):
+        self.journal.catalog = self.catalog
+        document = self.make_document(1)
+        self.journal.save_document(document)
+        # A crash after the logs were synced, before the catalog was.
+        self.journal.catalog = None
+        document.name = 'renamed.txt'
+        document.version = 2
+        self.journal.save_document(document)
+        self.journal.close()
+
+        entry = self.catalog.get(1)
+        self.assertEqual((entry.name, entry.version), ('1.txt', 0))
+        loaded = self.load_stub(entry)
+        self.assertEqual((loaded.name, loaded.version), ('renamed.txt', 2))
+        # Changes made to the stub since it was listed still win.
+        self.assertEqual(self.load_stub(entry, 'moved.txt').name, 'moved.txt')
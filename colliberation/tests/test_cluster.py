@@ -0,0 +1,55 @@
+"""
+Cluster mode tests.
+"""
+from unittest import TestCase
+
+from colliberation.server.cluster import HashRing
+
+NODES = [('127.0.0.1', 7200 + index) for index in range(4)]
+DOCUMENTS = range(1000)
+
+
+class HashRingTest(TestCase):
+
+    def setUp(self):
+        self.ring = HashRing(NODES[:3], local=NODES[1])
+
+    def owners(self, ring):
+        return dict((document_id, ring.owner(document_id))
+                    for document_id in DOCUMENTS)
+
+    def test_owner_stable(self):
+        self.assertEqual(self.owners(self.ring),
+                         self.owners(HashRing(reversed(NODES[:3]))))
+
+    def test_owner_balance(self):
+        owners = self.owners(self.ring).values()
+        for node in NODES[:3]:
+            self.assertGreater(owners.count(node), len(DOCUMENTS) / 6)
+
+    def test_add_node_moves_to_new_node_only(self):
+        before = self.owners(self.ring)
+        self.ring.add_node(NODES[3])
+        after = self.owners(self.ring)
+
+        moved = [document_id for document_id in DOCUMENTS
+                 if before[document_id] != after[document_id]]
+        self.assertTrue(moved)
+        self.assertLess(len(moved), len(DOCUMENTS) / 2)
+        for document_id in moved:
+            self.assertEqual(after[document_id], NODES[3])
+
+    def test_remove_node_moves_its_documents_only(self):
+        before = self.owners(self.ring)
+        self.ring.remove_node(NODES[0])
+        after = self.owners(self.ring)
+
+        for document_id in DOCUMENTS:
+            if before[document_id] != NODES[0]:
+                self.assertEqual(before[document_id], after[document_id])
+            self.assertNotEqual(after[document_id], NODES[0])
+
+    def test_primary(self):
+        self.assertEqual(self.ring.primary, NODES[1])
+        self.ring.remove_node(NODES[1])
+        self.assertEqual(self.ring.primary, NODES[0])
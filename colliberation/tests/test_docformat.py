@@ -0,0 +1,133 @@
+"""
+Binary document format tests.
+"""
+import os
+import pickle
+from cStringIO import StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from urllib import pathname2url
+
+from colliberation.docformat import (DocumentFormatError, HEADER_SIZE,
+                                     is_document_file, read_document,
+                                     read_header, write_document)
+from colliberation.document import Document
+from colliberation.serializer import BinarySerializer
+
+
+class DocumentFormatTest(TestCase):
+
+    def setUp(self):
+        self.document = Document(id=12, name='test.py', content='hello ' * 10,
+                                 version=6, metadata={'owner': 'foo'})
+
+    def write(self, document, **kwargs):
+        file_handle = StringIO()
+        write_document(file_handle, document, **kwargs)
+        return file_handle.getvalue()
+
+    def test_round_trip(self):
+        data = self.write(self.document, sequence=40)
+        document, header = read_document(StringIO(data))
+        self.assertEqual(document, self.document)
+        self.assertEqual(document.id, 12)
+        self.assertEqual(header.sequence, 40)
+        self.assertFalse(header.compressed)
+
+    def test_header_only(self):
+        data = self.write(self.document)
+        # The content isn't needed to read the header.
+        truncated = data[:HEADER_SIZE + len('test.py') +
+                         len(pickle.dumps({'owner': 'foo'}, 2))]
+        header = read_header(StringIO(truncated))
+        self.assertEqual(header.name, 'test.py')
+        self.assertEqual(header.version, 6)
+        self.assertEqual(header.size, 60)
+
+    def test_compressed(self):
+        data = self.write(self.document, compress_threshold=10)
+        self.assertLess(len(data), len(self.write(self.document)))
+        document, header = read_document(StringIO(data))
+        self.assertTrue(header.compressed)
+        self.assertEqual(document.content, self.document.content)
+
+    def test_unicode(self):
+        document = Document(id=3, name=u'caf\xe9.txt',
+                            content=u'na\xefve \u2603 ' * 100)
+        for threshold in (None, 10):
+            loaded, header = read_document(StringIO(
+                self.write(document, compress_threshold=threshold)))
+            self.assertEqual((loaded.name, loaded.content),
+                             (document.name, document.content))
+            self.assertEqual(header.name, u'caf\xe9.txt')
+
+        # Text comes back as the type it was saved as.
+        document = Document(id=3, name=u'plain.txt', content=u'plain')
+        loaded, header = read_document(StringIO(self.write(document)))
+        self.assertIsInstance(loaded.content, unicode)
+        self.assertIsInstance(loaded.name, unicode)
+        loaded, header = read_document(StringIO(self.write(self.document)))
+        self.assertIsInstance(loaded.content, str)
+        self.assertIsInstance(loaded.name, str)
+
+    def test_corrupt(self):
+        data = self.write(self.document)
+        self.assertRaises(DocumentFormatError, read_document,
+                          StringIO(data[:-1] + 'x'))
+        self.assertRaises(DocumentFormatError, read_header,
+                          StringIO(pickle.dumps(self.document)))
+
+    def test_is_document_file(self):
+        file_handle = StringIO(self.write(self.document))
+        self.assertTrue(is_document_file(file_handle))
+        self.assertEqual(file_handle.tell(), 0)
+        self.assertFalse(is_document_file(StringIO('')))
+
+
+class BinarySerializerTest(TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.path = os.path.join(self.folder, 'test.py')
+        self.url = 'file:' + pathname2url(self.path)
+        self.document = Document(name='test.py', content='hello world',
+                                 version=6, url=self.url,
+                                 metadata={'owner': 'foo'})
+        self.serializer = BinarySerializer()
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+    def test_save_load(self):
+        self.serializer.save_document(self.document)
+        self.assertEqual(self.serializer.load_document(self.url),
+                         self.document)
+        self.assertEqual(self.serializer.load_header(self.url).version, 6)
+        self.assertEqual(os.listdir(self.folder), ['test.py'])
+
+    def test_save_load_unicode(self):
+        self.document.name = u'\u65e5\u672c.txt'
+        self.document.content = u'\u3053\u3093\u306b\u3061\u306f'
+        self.serializer.save_document(self.document)
+        self.assertEqual(self.serializer.load_document(self.url),
+                         self.document)
+        self.assertEqual(self.serializer.load_header(self.url).name,
+                         self.document.name)
+
+    def test_migrate(self):
+        with open(self.path, 'w') as file_handle:
+            pickle.dump(self.document, file_handle)
+        self.assertIsNone(self.serializer.load_header(self.url))
+        self.assertEqual(self.serializer.load_document(self.url),
+                         self.document)
+
+        self.assertTrue(self.serializer.migrate_document(self.url))
+        self.assertFalse(self.serializer.migrate_document(self.url))
+        self.assertEqual(self.serializer.load_document(self.url),
+                         self.document)
+
+    def test_delete(self):
+        self.serializer.save_document(self.document)
+        self.serializer.delete_document(self.url)
+        self.assertEqual(os.listdir(self.folder), [])
@@ -1,4 +1,5 @@
 from colliberation.document import Document
+from colliberation.history import NoSuchVersion
 from unittest import TestCase
 
 TEST_NAME = 'testDoc'
@@ -39,13 +40,35 @@ class DocumentTest(TestCase):
         pass
 
     def test_commit(self):
-        pass
+        self.document.commit()
+        self.document.content = TEST_INSERTION_TEXT
+        self.document.commit()
+        self.assertEqual(self.document.version, TEST_VERSION + 1)
 
     def test_revert(self):
-        pass
+        self.document.commit()
+        self.document.content = TEST_INSERTION_TEXT
+        self.document.name = 'renamed'
+        self.document.commit()
+
+        self.document.revert(TEST_VERSION)
+        self.assertEqual(self.document.content, TEST_CONTENT)
+        self.assertEqual(self.document.name, TEST_NAME)
+        self.assertEqual(self.document.version, TEST_VERSION + 2)
+        self.assertRaises(NoSuchVersion, self.document.revert, 99)
 
     def test_available_versions(self):
-        pass
+        self.assertEqual(self.document.available_versions(), [])
+        self.document.commit()
+        self.document.commit()
+        self.assertEqual(self.document.available_versions(),
+                         [TEST_VERSION, TEST_VERSION + 1])
 
     def test_retrieve_version_data(self):
-        pass
+        self.assertRaises(NoSuchVersion,
+                          self.document.retrieve_version_data, TEST_VERSION)
+        self.document.commit()
+        self.document.metadata['Owner'] = 'someone else'
+        data = self.document.retrieve_version_data(TEST_VERSION)
+        self.assertEqual(data['content'], TEST_CONTENT)
+        self.assertEqual(data['metadata'], {'Owner': 'tester'})
@@ -0,0 +1,185 @@
+"""
+Output flow control tests.
+"""
+from unittest import TestCase
+
+from mock import MagicMock
+
+from colliberation.packets import make_packet, parse_packets
+from colliberation.server.factory import CollabServerFactory
+from colliberation.server.flow import (OutputQueue, classify, BULK_SIZE,
+                                       CONTROL, INTERACTIVE, BULK)
+from colliberation.tests.utils import generate_packets
+
+
+class RecordingTransport(object):
+
+    def __init__(self):
+        self.data = []
+        self.producer = None
+        self.aborted = False
+        self.lost = False
+
+    def write(self, data):
+        self.data.append(data)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def abortConnection(self):
+        self.aborted = True
+
+    def loseConnection(self):
+        self.lost = True
+
+
+class OutputQueueTest(TestCase):
+
+    def setUp(self):
+        self.transport = RecordingTransport()
+        self.protocol = MagicMock('protocol', transport=self.transport)
+        self.queue = OutputQueue(self.protocol, max_queued=10)
+        self.queue.register()
+
+    def test_register(self):
+        self.assertIs(self.transport.producer, self.queue)
+
+    def test_send(self):
+        self.queue.send('abc')
+        self.assertEqual(self.transport.data, ['abc'])
+
+    def test_paused(self):
+        self.queue.pauseProducing()
+        self.queue.send('a')
+        self.queue.send('b', key='status', critical=False)
+        self.queue.send('c', critical=False)
+        self.queue.send('d', key='status', critical=False)
+        self.queue.send('e')
+        self.assertEqual(self.transport.data, [])
+        self.assertEqual(self.queue.dropped, 1)
+        self.assertEqual(self.queue.coalesced, 1)
+
+        self.queue.resumeProducing()
+        self.assertEqual(self.transport.data, ['a', 'd', 'e'])
+        self.assertEqual(self.queue.queued_bytes, 0)
+
+        # Packets sent after resuming are no longer held back.
+        self.queue.send('f', critical=False)
+        self.assertEqual(self.transport.data[-1], 'f')
+
+    def test_order_kept_after_resume(self):
+        self.queue.pauseProducing()
+        self.queue.send('a')
+        self.queue.paused = False
+        # Still queued packets go first.
+        self.queue.send('b')
+        self.assertEqual(self.transport.data, [])
+        self.queue.flush()
+        self.assertEqual(self.transport.data, ['a', 'b'])
+
+    def test_disconnect(self):
+        self.queue.pauseProducing()
+        self.queue.send('x' * 6)
+        self.assertFalse(self.transport.aborted)
+        self.queue.send('x' * 6)
+        self.assertTrue(self.transport.aborted)
+
+        self.queue.resumeProducing()
+        self.queue.send('y')
+        self.assertEqual(self.transport.data, [])
+
+
+class BroadcastTest(TestCase):
+
+    def setUp(self):
+        self.factory = CollabServerFactory()
+        self.packets = generate_packets()
+        self.viewer = self.connect(1000)
+        self.watcher = self.connect(1001)
+        self.viewer.document_added(self.packets['add_packet'])
+        self.viewer.document_opened(self.packets['open_packet'])
+        del self.viewer.transport.data[:]
+        del self.watcher.transport.data[:]
+
+    def connect(self, port):
+        protocol = self.factory.buildProtocol(('127.0.0.1', port))
+        protocol.makeConnection(RecordingTransport())
+        protocol.handshake_recieved(self.packets['handshake_packet'])
+        return protocol
+
+    def tearDown(self):
+        for protocol in (self.viewer, self.watcher):
+            protocol.connectionLost(None)
+
+    def test_viewers_only(self):
+        self.watcher.document_saved(self.packets['save_packet'])
+        self.assertEqual(len(self.viewer.transport.data), 1)
+        self.assertEqual(self.watcher.transport.data, [])
+
+    def test_slow_viewer(self):
+        self.viewer.output.pauseProducing()
+        for _ in xrange(3):
+            self.watcher.document_saved(self.packets['save_packet'])
+        self.assertEqual(len(self.viewer.output.queue), 1)
+
+        self.viewer.output.resumeProducing()
+        self.assertEqual(len(self.viewer.transport.data), 1)
+
+
+class PriorityLaneTest(TestCase):
+
+    def setUp(self):
+        self.transport = RecordingTransport()
+        self.protocol = MagicMock('protocol', transport=self.transport)
+        self.queue = OutputQueue(self.protocol)
+        self.queue.register()
+        self.queue.pauseProducing()
+
+    def written(self):
+        packets, _ = parse_packets(''.join(self.transport.data))
+        return [header for header, payload in packets]
+
+    def test_classify(self):
+        ping = make_packet('ping', sent=0, echo=0)
+        self.assertEqual(classify(ping), (CONTROL, None))
+        modified = make_packet('text_modified', document_id=3, version=0,
+                               modifications='', hash='')
+        self.assertEqual(classify(modified), (INTERACTIVE, 3))
+        added = make_packet('document_added', document_id=4, version=0,
+                            document_name='a')
+        self.assertEqual(classify(added), (BULK, 4))
+
+    def test_control_first(self):
+        for document_id in xrange(3):
+            self.queue.send(make_packet('text_modified',
+                                        document_id=document_id, version=0,
+                                        modifications='x' * BULK_SIZE,
+                                        hash=''))
+        self.queue.send(make_packet('text_modified', document_id=9,
+                                    version=0, modifications='', hash=''))
+        self.queue.send(make_packet('ping', sent=0, echo=0))
+        self.assertEqual(self.queue.stats()['queued bulk'], 3)
+
+        # Only one frame is written before the transport fills again.
+        self.transport.write = lambda data: (
+            self.transport.data.append(data), self.queue.pauseProducing())
+        self.queue.resumeProducing()
+        self.assertEqual(self.written(), [0])
+        self.queue.resumeProducing()
+        self.queue.resumeProducing()
+        self.assertEqual(self.written(), [0, 20, 20])
+        self.assertEqual(self.queue.stats()['overtook'], 2)
+
+    def test_document_order_kept(self):
+        self.queue.send(make_packet('document_added', document_id=1,
+                                    version=0, document_name='a'))
+        self.queue.send(make_packet('document_opened', document_id=1,
+                                    version=0))
+        self.queue.send(make_packet('document_opened', document_id=2,
+                                    version=0))
+        self.queue.resumeProducing()
+        packets, _ = parse_packets(''.join(self.transport.data))
+        self.assertEqual([(header, payload.document_id)
+                          for header, payload in packets],
+                         [(10, 2), (13, 1), (10, 1)])
+        self.assertEqual(self.queue.documents, {})
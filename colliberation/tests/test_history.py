@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from colliberation.history import (NoSuchVersion, VersionHistory,
+                                   apply_delta, make_delta)
+
+TEST_CONTENT = 'A quick red fox jumped over the brown lazy dog.'
+
+
+def edit(content, version):
+    position = (version * 7) % len(content)
+    return content[:position] + str(version) + content[position + 1:]
+
+
+class DeltaTest(TestCase):
+
+    def test_round_trip(self):
+        new_content = 'A quick brown fox jumped over the \xff lazy dog!'
+        delta = make_delta(new_content, TEST_CONTENT)
+        self.assertEqual(apply_delta(new_content, delta), TEST_CONTENT)
+
+    def test_identical(self):
+        delta = make_delta(TEST_CONTENT, TEST_CONTENT)
+        self.assertEqual(delta, (len(TEST_CONTENT),))
+
+
+class VersionHistoryTest(TestCase):
+
+    def setUp(self):
+        self.history = VersionHistory(limit=25, keyframe_interval=4)
+        self.contents = {}
+        content = TEST_CONTENT
+        for version in range(30):
+            content = edit(content, version)
+            self.contents[version] = content
+            self.history.commit(version, content, 'name', {'version': version})
+
+    def test_retrieve(self):
+        for version in self.history.versions():
+            data = self.history.retrieve(version)
+            self.assertEqual(data['content'], self.contents[version])
+            self.assertEqual(data['metadata'], {'version': version})
+            self.assertEqual(data['version'], version)
+
+    def test_limit(self):
+        self.assertEqual(self.history.versions(), range(5, 30))
+        self.assertRaises(NoSuchVersion, self.history.retrieve, 4)
+
+    def test_keyframes(self):
+        revisions = [self.history.revisions[version]
+                     for version in self.history.versions()]
+        self.assertTrue(revisions[-1].keyframe)
+        # No version is more than keyframe_interval - 1 deltas away from
+        # a keyframe.
+        run = 0
+        for revision in revisions:
+            run = 0 if revision.keyframe else run + 1
+            self.assertTrue(run < 4)
+        self.assertEqual(self.history.stats()['keyframes'], 7)
+
+    def test_commit_older(self):
+        self.assertRaises(ValueError, self.history.commit, 29, '')
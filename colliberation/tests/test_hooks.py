@@ -0,0 +1,196 @@
+"""
+Hook pipeline tests.
+"""
+from unittest import TestCase
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+
+from colliberation.packets import make_packet
+from colliberation.protocol import CollaborationProtocol
+from colliberation.server.factory import CollabServerFactory
+from colliberation.tests.test_flow import RecordingTransport
+from colliberation.tests.utils import generate_packets
+from colliberation.utils import (CANCEL, AsyncHook, HookTimings,
+                                 compile_pipeline, pipeline_funcs)
+
+
+def append(suffix):
+    def hook(data):
+        return True, False, data + suffix
+    return hook
+
+
+def stop(data):
+    return False, False, data
+
+
+def cancel(data):
+    return True, True, data
+
+
+class CompilePipelineTest(TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(compile_pipeline([]))
+        self.assertEqual(pipeline_funcs([], 'a'), 'a')
+
+    def test_chain(self):
+        pipeline = compile_pipeline([append('b'), append('c')])
+        self.assertEqual(pipeline('a'), 'abc')
+
+    def test_stop(self):
+        pipeline = compile_pipeline([append('b'), stop, append('c')])
+        self.assertEqual(pipeline('a'), 'ab')
+
+    def test_cancel(self):
+        pipeline = compile_pipeline([append('b'), cancel, append('c')])
+        self.assertIsNone(pipeline('a'))
+
+    def test_flags(self):
+        self.assertEqual(pipeline_funcs([lambda data: (False, data + 'b')],
+                                        'a', can_stop=False), 'ab')
+        self.assertEqual(pipeline_funcs([lambda data: data + 'b'], 'a',
+                                        can_stop=False, can_cancel=False),
+                         'ab')
+
+    def test_timings(self):
+        timings = HookTimings()
+        hook = append('b')
+        pipeline = compile_pipeline([hook], timings=timings)
+        pipeline('a')
+        pipeline('a')
+        stats = timings.stats()
+        self.assertEqual(stats[__name__ + '.hook']['calls'], 2)
+        self.assertGreaterEqual(stats[__name__ + '.hook']['seconds'], 0)
+
+
+class ProtocolHooksTest(TestCase):
+
+    def setUp(self):
+        self.packets = generate_packets()
+
+    def test_cancel_metadata(self):
+        protocol = CollaborationProtocol(metadata_mod_hooks=[cancel])
+        protocol.document_added(self.packets['add_packet'])
+        protocol.document_opened(self.packets['open_packet'])
+        protocol.metadata_modified(self.packets['metadata_mod_packet'])
+        document = protocol.open_docs[self.packets['document_id']]
+        self.assertNotIn('owner', document.metadata)
+
+        protocol.metadata_mod_hooks = []
+        protocol.compile_hooks()
+        protocol.metadata_modified(self.packets['metadata_mod_packet'])
+        self.assertEqual(document.metadata['owner'], 'tester')
+
+    def test_func_hooks(self):
+        protocol = CollaborationProtocol()
+        self.assertEqual(protocol.run_hooks('message_hooks', 'a'), 'a')
+        self.assertEqual(
+            protocol.run_hooks('message_hooks', 'a', [append('b')]), 'ab')
+
+    def test_shared(self):
+        factory = CollabServerFactory(
+            protocol_hooks={'doc_open_hooks': [append('b')]},
+            time_hooks=True)
+        first = factory.buildProtocol(('127.0.0.1', 1000))
+        second = factory.buildProtocol(('127.0.0.1', 1001))
+        self.assertIs(first.pipelines, second.pipelines)
+        self.assertIsNone(first.pipelines['text_mod_hooks'])
+        first.run_hooks('doc_open_hooks', 'a')
+        self.assertEqual(
+            factory.hook_timings.stats()[__name__ + '.hook']['calls'], 1)
+
+    def test_cancel_save(self):
+        factory = CollabServerFactory(
+            protocol_hooks={'doc_save_hooks': [cancel]})
+        protocol = factory.buildProtocol(('127.0.0.1', 1000))
+        protocol.transport = RecordingTransport()
+        protocol.document_added(self.packets['add_packet'])
+        protocol.document_opened(self.packets['open_packet'])
+        document = protocol.open_docs[self.packets['document_id']]
+        protocol.document_saved(self.packets['save_packet'])
+        # The cancelled save didn't commit a version.
+        self.assertIsNone(document.history)
+
+
+class AsyncHookTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.calls = []
+
+    def deferred_hook(self, name, concurrent=False, **kwargs):
+        deferreds = []
+
+        def hook(data):
+            self.calls.append(name)
+            deferreds.append(Deferred())
+            return deferreds[-1]
+        return AsyncHook(hook, concurrent=concurrent, clock=self.clock,
+                         **kwargs), deferreds
+
+    def result(self, deferred):
+        results = []
+        deferred.addCallback(results.append)
+        return results
+
+    def test_chain(self):
+        hook, deferreds = self.deferred_hook('a')
+        pipeline = compile_pipeline([hook, append('c')])
+        results = self.result(pipeline('a'))
+        self.assertEqual(results, [])
+        deferreds[0].callback((True, False, 'ab'))
+        self.assertEqual(results, ['abc'])
+
+    def test_concurrent(self):
+        first, first_deferreds = self.deferred_hook('first', True)
+        second, second_deferreds = self.deferred_hook('second', True)
+        results = self.result(compile_pipeline([first, second])('a'))
+        self.assertEqual(self.calls, ['first', 'second'])
+
+        second_deferreds[0].callback((True, True, None))
+        first_deferreds[0].callback((True, False, 'ignored'))
+        self.assertEqual(results, [None])
+
+    def test_timeout(self):
+        hook, deferreds = self.deferred_hook('a', timeout=5)
+        results = self.result(compile_pipeline([hook])('a'))
+        self.clock.advance(5)
+        self.assertEqual(results, ['a'])
+        self.assertEqual(hook.timeouts, 1)
+
+        hook.on_failure = CANCEL
+        results = self.result(compile_pipeline([hook])('a'))
+        self.clock.advance(5)
+        self.assertEqual(results, [None])
+
+    def test_failure(self):
+        def broken(data):
+            raise ValueError(data)
+        hook = AsyncHook(broken, on_failure=CANCEL, clock=self.clock)
+        self.assertEqual(self.result(compile_pipeline([hook])('a')), [None])
+        self.assertEqual(hook.failures, 1)
+
+    def test_document_suspended(self):
+        hook, deferreds = self.deferred_hook('open')
+        protocol = CollaborationProtocol(doc_open_hooks=[hook])
+        protocol.transport = RecordingTransport()
+        for document_id in (1, 2):
+            protocol.dataReceived(make_packet(
+                'document_added', document_id=document_id, version=0,
+                document_name=str(document_id)))
+        protocol.dataReceived(''.join([
+            make_packet('document_opened', document_id=1, version=0),
+            make_packet('document_closed', document_id=1, version=0),
+            make_packet('document_opened', document_id=2, version=0),
+        ]))
+        # Document 2's hook started while document 1's waits.
+        self.assertEqual(self.calls, ['open', 'open'])
+        self.assertEqual(protocol.suspended.keys(), [1, 2])
+
+        deferreds[0].callback((True, False, protocol.available_docs[1]))
+        # The held back close was handled once the open finished.
+        self.assertNotIn(1, protocol.open_docs)
+        self.assertNotIn(1, protocol.suspended)
+        self.assertNotIn(2, protocol.open_docs)
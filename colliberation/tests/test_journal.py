@@ -0,0 +1,200 @@
+"""
+Journal serializer tests.
+"""
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from colliberation.document import Document
+from colliberation.journal import (GroupCommitSerializer, JournalSerializer,
+                                   LOG_EXTENSION, file_path)
+from colliberation.patching import dmp, parse_patches, sync_text
+from colliberation.server.factory import CollabServerFactory
+from colliberation.tests.utils import FakeTransport, generate_packets
+from colliberation.workers import InlineExecutor
+
+
+class JournalSerializerTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.journal = JournalSerializer(self.directory, min_log_bytes=0)
+        self.document = Document(id=7, name='test.py', content='hello world',
+                                 metadata={'owner': 'foo'})
+        self.document.url = self.journal.url_for(7)
+        self.journal.save_document(self.document)
+
+    def tearDown(self):
+        self.journal.close()
+        rmtree(self.directory)
+
+    def edit(self, edits):
+        self.document.apply_edits(edits)
+        self.journal.log_edits(self.document, edits)
+
+    def recover(self):
+        self.journal.close()
+        self.journal = JournalSerializer(self.directory, min_log_bytes=1000)
+        return self.journal.recover()
+
+    def test_snapshot_on_save(self):
+        self.assertTrue(os.path.exists(file_path(self.document.url)))
+        self.assertEqual(self.recover(), {7: self.document})
+
+    def test_replay(self):
+        self.journal.min_log_bytes = 1000
+        self.edit([(0, 'j', 1), (6, '', 11)])
+        self.edit([(6, 'there', 6)])
+        self.document.name = 'renamed.py'
+        self.journal.save_document(self.document)
+        self.assertEqual(self.journal.snapshots, 1)
+
+        documents = self.recover()
+        self.assertEqual(documents[7].content, 'jello there')
+        self.assertEqual(documents[7], self.document)
+
+        # Appends after recovery continue the same log.
+        self.document = documents[7]
+        self.edit([(0, 'h', 1)])
+        self.assertEqual(self.recover()[7].content, 'hello there')
+
+    def test_replay_unicode(self):
+        self.journal.min_log_bytes = 1000
+        new_text = u'h\xe9llo w\xf6rld \u2603'
+        modifications = dmp.patch_toText(
+            dmp.patch_make(u'hello world', new_text))
+        edits, shadow_text, _ = sync_text(
+            self.document.content, self.document.content,
+            parse_patches(modifications))
+        self.edit(edits)
+        self.edit([(len(new_text), u' \u2603', len(new_text))])
+
+        self.assertEqual(self.recover()[7].content, new_text + u' \u2603')
+
+    def test_periodic_snapshot(self):
+        self.edit([(0, 'h', 1)])
+        self.assertEqual(self.journal.snapshots, 2)
+        self.assertEqual(
+            os.path.getsize(file_path(self.document.url) + LOG_EXTENSION), 0)
+        self.assertEqual(self.recover()[7], self.document)
+
+    def test_torn_record(self):
+        self.journal.min_log_bytes = 1000
+        self.edit([(0, 'j', 1)])
+        self.edit([(0, 'y', 1)])
+        self.journal.close()
+        log_path = file_path(self.document.url) + LOG_EXTENSION
+        with open(log_path, 'r+b') as log_file:
+            log_file.truncate(os.path.getsize(log_path) - 1)
+
+        self.assertEqual(self.recover()[7].content, 'jello world')
+        self.edit([(0, 'm', 1)])
+        self.assertEqual(self.recover()[7].content, 'mello world')
+
+    def test_stale_log(self):
+        self.journal.min_log_bytes = 1000
+        self.edit([(0, 'j', 1)])
+
+        # A journal which didn't load the document snapshots it afresh.
+        self.journal.close()
+        self.journal = JournalSerializer(self.directory)
+        self.document.content = 'fresh'
+        self.journal.log_edits(self.document, [(0, 'f', 1)])
+        self.assertEqual(self.recover()[7].content, 'fresh')
+
+    def test_delete(self):
+        self.journal.delete_document(self.document.url)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class GroupCommitSerializerTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.clock = Clock()
+        self.journal = JournalSerializer(self.directory)
+        self.serializer = GroupCommitSerializer(
+            self.journal, window=.01, executor=InlineExecutor(),
+            clock=self.clock)
+        self.documents = []
+        for document_id in xrange(3):
+            document = Document(id=document_id, content='hello')
+            document.url = self.serializer.url_for(document_id)
+            self.journal.save_document(document)
+            self.documents.append(document)
+        self.journal.syncs = 0
+
+    def tearDown(self):
+        self.serializer.close()
+        rmtree(self.directory)
+
+    def test_group_commit(self):
+        saved = []
+        for _ in xrange(5):
+            for document in self.documents[:2]:
+                document.version += 1
+                self.serializer.save_document(document).addCallback(
+                    saved.append)
+        self.assertEqual(saved, [])
+
+        self.clock.advance(.01)
+        self.assertEqual(len(saved), 10)
+        self.assertEqual(self.journal.syncs, 2)
+        self.assertEqual(self.serializer.commits, 1)
+
+        documents = JournalSerializer(self.directory).recover()
+        self.assertEqual(documents[1].version, 5)
+
+    def test_detached(self):
+        self.documents[0].open()
+        self.serializer.log_edits(self.documents[0], [(0, 'j', 1)])
+        self.serializer.save_document(self.documents[0])
+        self.clock.advance(.01)
+        recovered = JournalSerializer(self.directory).recover()
+        self.assertEqual(recovered[0].content, 'jello')
+
+    def test_failed_save(self):
+        failures = []
+        document = Document(id=9, url='http://example.com/9')
+        self.serializer.save_document(document).addErrback(failures.append)
+        self.serializer.save_document(self.documents[0])
+        self.clock.advance(.01)
+        self.assertEqual(len(failures), 1)
+
+    def test_close(self):
+        saved = []
+        self.serializer.save_document(self.documents[2]).addCallback(
+            saved.append)
+        self.serializer.close()
+        self.assertEqual(len(saved), 1)
+        self.assertFalse(self.clock.getDelayedCalls())
+
+
+class FactoryJournalTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.packets = generate_packets()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_recover(self):
+        factory = CollabServerFactory(journal_directory=self.directory)
+        protocol = factory.buildProtocol(('127.0.0.1', 1000))
+        protocol.transport = FakeTransport()
+        protocol.document_added(self.packets['add_packet'])
+
+        document = factory.available_docs[self.packets['document_id']]
+        edits = [(0, 'hello', 0)]
+        document.apply_edits(edits)
+        factory.edits_applied(document, edits)
+        factory.stopFactory()
+
+        factory = CollabServerFactory(journal_directory=self.directory)
+        self.assertEqual(factory.available_docs.keys(), [document.id])
+        self.assertEqual(factory.documents.load(document.id), document)
+        factory.stopFactory()
@@ -0,0 +1,73 @@
+"""
+Round trip measurement tests.
+"""
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from colliberation.latency import RoundTripStats, elapsed, timestamp
+from colliberation.packets import parse_packets
+from colliberation.protocol import (CollaborationProtocol, MAX_SEND_DELAY,
+                                    MIN_SEND_DELAY)
+from colliberation.tests.test_flow import RecordingTransport
+
+
+class RoundTripStatsTest(TestCase):
+
+    def test_sample(self):
+        stats = RoundTripStats()
+        stats.sample(.1)
+        self.assertEqual((stats.srtt, stats.jitter), (.1, .05))
+        stats.sample(.5)
+        self.assertAlmostEqual(stats.srtt, .15)
+        self.assertAlmostEqual(stats.jitter, .1375)
+        self.assertEqual(stats.stats()['last rtt ms'], 500)
+
+    def test_wrap(self):
+        clock = Clock()
+        clock.advance(2 ** 32 / 1000.0 - .01)
+        sent = timestamp(clock)
+        clock.advance(.03)
+        self.assertAlmostEqual(elapsed(clock, sent), .03, places=3)
+
+
+class PingTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.client = self.connect()
+        self.server = self.connect()
+
+    def connect(self):
+        protocol = CollaborationProtocol()
+        protocol.clock = self.clock
+        protocol.transport = RecordingTransport()
+        return protocol
+
+    def deliver(self, sender, receiver):
+        packets, _ = parse_packets(''.join(sender.transport.data))
+        del sender.transport.data[:]
+        for header, payload in packets:
+            receiver.ping_recieved(payload)
+
+    def test_echo(self):
+        self.clock.advance(100)
+        self.client.send_ping()
+        self.clock.advance(.2)
+        self.deliver(self.client, self.server)
+        self.deliver(self.server, self.client)
+        self.assertAlmostEqual(self.client.latency.srtt, .2)
+        self.assertEqual(self.server.latency.samples, 0)
+        # Echoes aren't echoed.
+        self.assertEqual(self.client.transport.data, [])
+
+    def test_sync_delay(self):
+        self.assertEqual(self.client.sync_delay(), self.client.send_delay)
+        self.client.latency.sample(.3)
+        self.assertAlmostEqual(self.client.sync_delay(), .15)
+        self.client.latency = RoundTripStats()
+        self.client.latency.sample(10)
+        self.assertEqual(self.client.sync_delay(), MAX_SEND_DELAY)
+        self.client.latency = RoundTripStats()
+        self.client.latency.sample(0)
+        self.assertEqual(self.client.sync_delay(), MIN_SEND_DELAY)
@@ -0,0 +1,147 @@
+"""
+Patch utility tests.
+"""
+from random import Random
+from string import printable
+from unittest import TestCase
+
+from colliberation.document import Document
+from colliberation.patching import (PatchCache, apply_patches,
+                                    compose_patches, dmp, replace_edit,
+                                    sync_text, trim_edit)
+
+TEST_TEXT = 'A quick red fox jumped over the brown lazy dog.'
+TEST_NEW_TEXT = 'A quick brown fox jumped over the red lazy dog!'
+ALPHABET = printable[:62] + ' \n'
+
+
+def make_patch_text(old, new):
+    return dmp.patch_toText(dmp.patch_make(old, new))
+
+
+class PatchCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = PatchCache(size=2)
+        self.text = make_patch_text(TEST_TEXT, TEST_NEW_TEXT)
+
+    def test_parse(self):
+        patches = self.cache.parse(self.text)
+        self.assertEqual(dmp.patch_toText(list(patches)), self.text)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_parse_shared(self):
+        patches = self.cache.parse(self.text)
+        self.assertIs(self.cache.parse(self.text), patches)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_eviction(self):
+        self.cache.parse(self.text)
+        self.cache.parse(make_patch_text(TEST_TEXT, ''))
+        self.cache.parse(self.text)
+        self.cache.parse(make_patch_text('', TEST_TEXT))
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIn(self.text, self.cache.entries)
+
+    def test_shared_patches_apply_twice(self):
+        patches = self.cache.parse(self.text)
+        document = Document(content=TEST_TEXT)
+        shadow = Document(content=TEST_TEXT)
+        document.patch(patches, dmp)
+        shadow.patch(patches, dmp)
+
+        self.assertEqual(document.content, TEST_NEW_TEXT)
+        self.assertEqual(shadow.content, TEST_NEW_TEXT)
+
+
+class ComposePatchesTest(TestCase):
+
+    """ Property tests for compose_patches.
+
+    Random edit sequences are generated against random texts, and composing
+    their patches must produce the same text as applying them in order.
+    """
+
+    iterations = 200
+
+    def setUp(self):
+        self.random = Random(1024)
+
+    def random_text(self, length):
+        return ''.join(self.random.choice(ALPHABET) for _ in xrange(length))
+
+    def random_edit(self, text):
+        start = self.random.randint(0, len(text))
+        end = self.random.randint(start, min(len(text), start + 10))
+        insertion = self.random_text(self.random.randint(0, 10))
+        return text[:start] + insertion + text[end:]
+
+    def random_patch_lists(self, text, count):
+        patch_lists = []
+        for _ in xrange(count):
+            new_text = self.random_edit(text)
+            patch_lists.append(dmp.patch_make(text, new_text))
+            text = new_text
+        return patch_lists, text
+
+    def test_compose_matches_sequential(self):
+        for _ in xrange(self.iterations):
+            base = self.random_text(self.random.randint(0, 200))
+            patch_lists, expected = self.random_patch_lists(
+                base, self.random.randint(1, 8))
+
+            patches = compose_patches(base, patch_lists)
+            self.assertEqual(apply_patches(patches, base)[0], expected)
+
+    def test_compose_single_list(self):
+        patches = dmp.patch_make(TEST_TEXT, TEST_NEW_TEXT)
+        composed = compose_patches(TEST_TEXT, [patches])
+        self.assertEqual(apply_patches(composed, TEST_TEXT)[0], TEST_NEW_TEXT)
+
+    def test_compose_nothing(self):
+        self.assertEqual(compose_patches(TEST_TEXT, []), [])
+
+    def test_compose_inverse(self):
+        forward = dmp.patch_make(TEST_TEXT, TEST_NEW_TEXT)
+        backward = dmp.patch_make(TEST_NEW_TEXT, TEST_TEXT)
+        self.assertEqual(compose_patches(TEST_TEXT, [forward, backward]), [])
+
+
+class TrimEditTest(TestCase):
+
+    def test_trim(self):
+        self.assertEqual(trim_edit('abcdef', 1, 'bXe', 5), (2, 'X', 4))
+        self.assertEqual(trim_edit('abcdef', 1, 'bcde', 5), None)
+        self.assertEqual(trim_edit('aaa', 0, 'aaaa', 3), (3, 'a', 3))
+
+    def test_replace(self):
+        self.assertEqual(replace_edit(TEST_TEXT, TEST_TEXT + '!'),
+                         (len(TEST_TEXT), '!', len(TEST_TEXT)))
+        self.assertEqual(replace_edit('abc', ''), (0, '', 3))
+        self.assertEqual(replace_edit('', ''), None)
+
+
+class SyncTextTest(TestCase):
+
+    def test_sync_text(self):
+        document_text = TEST_TEXT + ' The end.'
+        patches = dmp.patch_make(TEST_TEXT, TEST_NEW_TEXT)
+        edits, shadow_text, modifications = sync_text(
+            document_text, TEST_TEXT, patches)
+
+        document = Document(content=document_text)
+        document.apply_edits(edits)
+        self.assertEqual(document.content, TEST_NEW_TEXT + ' The end.')
+        self.assertEqual(shadow_text, TEST_NEW_TEXT)
+
+        outgoing = dmp.patch_fromText(modifications)
+        self.assertEqual(apply_patches(outgoing, shadow_text)[0],
+                         document.content)
+
+    def test_minimal_edits(self):
+        patches = dmp.patch_make(TEST_TEXT, TEST_TEXT.replace('fox', 'cat'))
+        edits, shadow_text, modifications = sync_text(
+            TEST_TEXT, TEST_TEXT, patches)
+        # Only the changed characters are edited, without the patch context.
+        self.assertEqual(edits, [(12, 'cat', 15)])
@@ -0,0 +1,102 @@
+"""
+Plugin discovery tests.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+from colliberation.plugin import CACHE_NAME, PluginLoader
+from colliberation.protocol import CollaborationProtocol
+from colliberation.server.factory import CollabServerFactory
+from colliberation.tests.test_flow import RecordingTransport
+from colliberation.tests.utils import generate_packets
+
+PACKAGE = 'colliberation_test_plugins'
+
+PLUGIN_MODULE = '''
+from zope.interface import implements
+
+from colliberation.interfaces import IDocOpenedHook, IMessageHook
+
+
+class Rename(object):
+    implements(IDocOpenedHook, IMessageHook)
+
+    def document_opened(self, protocol, document):
+        document.name = 'opened by ' + protocol.username
+        return True, False, document
+
+    def message_recieved(self, protocol, message):
+        return True, False, message.upper()
+
+rename = Rename()
+'''
+
+
+class PluginLoaderTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        package = os.path.join(self.directory, PACKAGE)
+        os.mkdir(package)
+        open(os.path.join(package, '__init__.py'), 'w').close()
+        with open(os.path.join(package, 'rename.py'), 'w') as module:
+            module.write(PLUGIN_MODULE)
+        sys.path.insert(0, self.directory)
+        self.module_name = PACKAGE + '.rename'
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        for name in (PACKAGE, self.module_name):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.directory)
+
+    def unload(self):
+        sys.modules.pop(self.module_name, None)
+
+    def test_discover(self):
+        loader = PluginLoader(PACKAGE).discover()
+        self.assertEqual(loader.plugins('doc_open_hooks'),
+                         [(self.module_name, 'rename', 'document_opened')])
+        self.assertEqual(loader.hook_lists(),
+                         set(['doc_open_hooks', 'message_hooks']))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, PACKAGE, CACHE_NAME)))
+
+    def test_cached(self):
+        PluginLoader(PACKAGE).discover()
+        self.unload()
+
+        loader = PluginLoader(PACKAGE).discover()
+        self.assertEqual(loader.stats()['indexed'], 0)
+        self.assertNotIn(self.module_name, sys.modules)
+        self.assertEqual(len(loader.plugins('message_hooks')), 1)
+
+    def test_lazy_hook(self):
+        PluginLoader(PACKAGE).discover()
+        self.unload()
+        loader = PluginLoader(PACKAGE).discover()
+
+        protocol = CollaborationProtocol(plugins=loader)
+        self.assertNotIn(self.module_name, sys.modules)
+        self.assertEqual(protocol.run_hooks('message_hooks', 'hi'), 'HI')
+        self.assertIn(self.module_name, sys.modules)
+        self.assertEqual(loader.stats()['imported'], 1)
+
+    def test_server(self):
+        packets = generate_packets()
+        loader = PluginLoader(PACKAGE).discover()
+        factory = CollabServerFactory(plugins=loader)
+        protocol = factory.buildProtocol(('127.0.0.1', 1000))
+        protocol.transport = RecordingTransport()
+        protocol.username = 'server'
+        # Hook lists without plugins still share the factory's pipelines.
+        self.assertIs(protocol.pipelines['doc_close_hooks'],
+                      factory.pipelines['doc_close_hooks'])
+
+        protocol.document_added(packets['add_packet'])
+        protocol.document_opened(packets['open_packet'])
+        document = protocol.open_docs[packets['document_id']]
+        self.assertEqual(document.name, 'opened by server')
@@ -0,0 +1,124 @@
+"""
+Presence channel tests.
+"""
+from unittest import TestCase
+
+from construct import Container
+from twisted.internet.task import Clock
+
+from colliberation.packets import parse_packets
+from colliberation.protocol import CollaborationProtocol
+from colliberation.server.factory import CollabServerFactory
+from colliberation.tests.test_flow import RecordingTransport
+from colliberation.tests.utils import generate_packets
+
+PRESENCE = 23
+
+
+class PresenceChannelTest(TestCase):
+
+    def setUp(self):
+        self.factory = CollabServerFactory()
+        self.clock = Clock()
+        self.factory.presence.clock = self.clock
+        self.packets = generate_packets()
+        self.document_id = self.packets['document_id']
+        self.first = self.connect(1000)
+        self.first.document_added(self.packets['add_packet'])
+        self.second = self.connect(1001)
+        self.first.document_opened(self.packets['open_packet'])
+        self.second.document_opened(self.packets['open_packet'])
+        self.clear()
+
+    def tearDown(self):
+        self.factory.presence.stop()
+
+    def connect(self, port):
+        protocol = self.factory.buildProtocol(('127.0.0.1', port))
+        protocol.makeConnection(RecordingTransport())
+        protocol.handshake_recieved(self.packets['handshake_packet'])
+        return protocol
+
+    def clear(self):
+        for protocol in self.factory.registry:
+            del protocol.transport.data[:]
+
+    def move(self, protocol, start, end=None):
+        if end is None:
+            end = start
+        protocol.presence_changed(Container(
+            document_id=self.document_id, connection=0, username='',
+            regions=[Container(start=start, end=end)]))
+
+    def received(self, protocol):
+        packets, _ = parse_packets(''.join(protocol.transport.data))
+        return [payload for header, payload in packets if header == PRESENCE]
+
+    def test_latest_wins(self):
+        for position in xrange(5):
+            self.move(self.first, position)
+        self.assertEqual(self.received(self.second), [])
+
+        self.clock.advance(self.factory.presence.interval)
+        presence = self.received(self.second)
+        self.assertEqual(len(presence), 1)
+        self.assertEqual(presence[0].regions[0].start, 4)
+        self.assertEqual(presence[0].connection, self.first.connection_id)
+        self.assertEqual(self.received(self.first), [])
+        self.assertEqual(self.factory.presence.stats()['superseded'], 4)
+
+    def test_held_while_behind(self):
+        self.second.output.pauseProducing()
+        self.move(self.first, 1)
+        self.clock.advance(self.factory.presence.interval)
+        self.move(self.first, 2)
+        self.clock.advance(self.factory.presence.interval)
+        self.assertEqual(self.received(self.second), [])
+
+        self.second.output.resumeProducing()
+        self.clock.advance(self.factory.presence.interval)
+        presence = self.received(self.second)
+        self.assertEqual([p.regions[0].start for p in presence], [2])
+
+    def test_new_viewer(self):
+        self.move(self.first, 3, 7)
+        self.clock.advance(self.factory.presence.interval)
+
+        third = self.connect(1002)
+        third.document_opened(self.packets['open_packet'])
+        self.clock.advance(self.factory.presence.interval)
+        presence = self.received(third)
+        self.assertEqual(len(presence), 1)
+        self.assertEqual(presence[0].regions[0].end, 7)
+
+    def test_departure(self):
+        self.move(self.first, 3)
+        self.clock.advance(self.factory.presence.interval)
+        self.clear()
+
+        self.first.connectionLost(None)
+        self.clock.advance(self.factory.presence.interval)
+        presence = self.received(self.second)
+        self.assertEqual(len(presence), 1)
+        self.assertEqual(presence[0].regions, [])
+        self.assertEqual(self.factory.presence.slots, {})
+
+
+class ClientPresenceTest(TestCase):
+
+    def test_presence_changed(self):
+        protocol = CollaborationProtocol()
+        protocol.presence_changed(Container(
+            document_id=1, connection=5, username='',
+            regions=[Container(start=0, end=0)]))
+        self.assertEqual(protocol.presence[1].keys(), [5])
+        protocol.presence_changed(Container(
+            document_id=1, connection=5, username='', regions=[]))
+        self.assertEqual(protocol.presence[1], {})
+
+    def test_many_cursors(self):
+        protocol = CollaborationProtocol()
+        protocol.transport = RecordingTransport()
+        protocol.send_presence(1, [(index, index) for index in xrange(300)])
+        packets, _ = parse_packets(''.join(protocol.transport.data))
+        self.assertEqual(len(packets[0][1].regions), 300)
@@ -4,8 +4,14 @@ Collaboration server protocol tests.
 from unittest import TestCase
 from colliberation.tests.utils import FakeTransport, generate_packets
 from twisted.internet.task import LoopingCall
-from colliberation.protocol import (CollaborationProtocol,
-                                    WAITING_FOR_AUTH, AUTHORIZED)
+import colliberation.protocol
+from colliberation.packets import parse_packets
+from colliberation.protocol import (CollaborationProtocol, SYNC_FAILED,
+                                    WAITING_FOR_AUTH, AUTHORIZED, log)
+from colliberation.tests.test_flow import RecordingTransport
+from twisted.internet.defer import Deferred, fail
+from colliberation.patching import apply_patches, dmp
+from construct import Container
 from mock import MagicMock
 
 
@@ -92,6 +98,30 @@ class CollaborationProtocolTest(TestCase):
                 self.protocol.text_modified(self.packets['text_mod_packet'])
     """
 
+    def test_coalesce_packets(self):
+        self.protocol.document_added(self.packets['add_packet'])
+        self.protocol.document_opened(self.packets['open_packet'])
+        doc_id = self.packets['document_id']
+        self.protocol.shadow_docs[doc_id].content = 'hello'
+
+        first = dmp.patch_toText(dmp.patch_make('hello', 'hello world'))
+        second = dmp.patch_toText(dmp.patch_make('hello world', 'hi world'))
+        packets = [
+            (20, Container(document_id=doc_id, version=0,
+                           modifications=first, hash='')),
+            (20, Container(document_id=doc_id, version=1,
+                           modifications=second, hash='')),
+            (12, self.packets['save_packet']),
+        ]
+
+        coalesced = self.protocol.coalesce_packets(packets)
+        self.assertEqual(len(coalesced), 2)
+        header, payload = coalesced[0]
+        self.assertEqual(payload.version, 1)
+        patches = dmp.patch_fromText(payload.modifications)
+        self.assertEqual(apply_patches(patches, 'hello')[0], 'hi world')
+        self.assertEqual(coalesced[1][0], 12)
+
     def test_metadata_modified(self):
         self.protocol.document_added(self.packets['add_packet'])
         self.protocol.document_opened(self.packets['open_packet'])
@@ -113,3 +143,85 @@ class CollaborationProtocolTest(TestCase):
 
     def get_available_doc(self):
         return self.protocol.available_docs[self.packets['document_id']]
+
+
+class LogTest(TestCase):
+
+    def setUp(self):
+        self.debug = colliberation.protocol.DEBUG
+
+    def tearDown(self):
+        colliberation.protocol.DEBUG = self.debug
+
+    def test_lazy(self):
+        class Unformattable(object):
+            def __format__(self, spec):
+                raise AssertionError('Formatted while not debugging')
+        colliberation.protocol.DEBUG = False
+        log('{0}', Unformattable())
+
+
+class ManualExecutor(object):
+
+    """ Runs jobs when told to, as if they ran in another thread.
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def run(self, func, *args):
+        self.jobs.append((func, args, Deferred()))
+        return self.jobs[-1][2]
+
+    def finish(self):
+        func, args, deferred = self.jobs.pop(0)
+        deferred.callback(func(*args))
+
+
+class SyncTest(TestCase):
+
+    def setUp(self):
+        self.executor = ManualExecutor()
+        self.protocol = CollaborationProtocol(executor=self.executor)
+        self.protocol.transport = RecordingTransport()
+        self.packets = generate_packets()
+        self.document_id = self.packets['document_id']
+        self.protocol.document_added(self.packets['add_packet'])
+        self.protocol.document_opened(self.packets['open_packet'])
+        self.document = self.protocol.open_docs[self.document_id]
+
+    def text_modified(self, text):
+        return Container(
+            document_id=self.document_id, version=0,
+            modifications=dmp.patch_toText(dmp.patch_make('', text)),
+            hash=str(hash(text)))
+
+    def test_document_moved(self):
+        self.protocol.text_modified(self.text_modified('hello'))
+        # Edited locally while the step runs.
+        self.document.content = 'world'
+        self.executor.finish()
+        self.assertEqual(self.document.content, 'world')
+
+        self.executor.finish()
+        self.assertEqual(self.executor.jobs, [])
+        self.assertIn('hello', self.document.content)
+        self.assertIn('world', self.document.content)
+
+    def test_retries_exhausted(self):
+        self.protocol.text_modified(self.text_modified('hello'))
+        for index in xrange(colliberation.protocol.SYNC_RETRIES):
+            self.document.content = str(index)
+            self.executor.finish()
+        # The last attempt runs inline, on the reactor thread.
+        self.assertEqual(self.executor.jobs, [])
+        self.assertIn('hello', self.document.content)
+
+    def test_failure(self):
+        self.protocol.executor.run = lambda func, *args: fail(
+            ValueError('broken'))
+        self.protocol.text_modified(self.text_modified('hello'))
+        packets, _ = parse_packets(''.join(self.protocol.transport.data))
+        header, error = packets[-1]
+        self.assertEqual(error.error_type, SYNC_FAILED)
+        self.assertIn('broken', error.message)
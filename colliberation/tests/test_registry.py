@@ -0,0 +1,92 @@
+"""
+Connection registry tests.
+"""
+from unittest import TestCase
+
+from mock import MagicMock
+
+from colliberation.server.factory import CollabServerFactory
+from colliberation.server.registry import ConnectionRegistry
+from colliberation.tests.utils import FakeTransport, generate_packets
+
+
+def make_connection(address):
+    return MagicMock('protocol', address=address)
+
+
+class ConnectionRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = ConnectionRegistry()
+        self.first = make_connection(('127.0.0.1', 1000))
+        self.second = make_connection(('127.0.0.1', 1001))
+        self.registry.add(self.first)
+        self.registry.add(self.second)
+
+    def test_add(self):
+        self.assertEqual(len(self.registry), 2)
+        self.assertIn(self.first, self.registry)
+        self.assertEqual(set(self.registry), set([self.first, self.second]))
+
+    def test_viewers(self):
+        self.registry.document_opened(self.first, 5)
+        self.registry.document_opened(self.second, 5)
+        self.registry.document_opened(self.second, 6)
+
+        self.assertEqual(self.registry.viewers(5),
+                         set([self.first, self.second]))
+        self.assertEqual(self.registry.viewers(6), set([self.second]))
+        self.assertEqual(self.registry.viewers(7), set())
+
+        self.registry.document_closed(self.second, 6)
+        self.assertNotIn(6, self.registry.documents)
+
+    def test_usernames(self):
+        self.registry.set_username(self.first, 'alice')
+        self.registry.set_username(self.second, 'alice')
+        self.registry.set_username(self.second, 'bob')
+
+        self.assertEqual(self.registry.connections_of('alice'),
+                         set([self.first]))
+        self.assertEqual(self.registry.connections_of('bob'),
+                         set([self.second]))
+
+    def test_remove(self):
+        self.registry.set_username(self.first, 'alice')
+        self.registry.document_opened(self.first, 5)
+        self.registry.remove(self.first)
+        self.registry.remove(self.first)
+
+        self.assertEqual(len(self.registry), 1)
+        self.assertEqual(self.registry.viewers(5), set())
+        self.assertEqual(self.registry.connections_of('alice'), set())
+        self.registry.document_opened(self.first, 5)
+        self.assertEqual(self.registry.viewers(5), set())
+
+    def test_stats(self):
+        self.registry.document_opened(self.first, 5)
+        stats = self.registry.stats()
+        self.assertEqual(stats['connections'], 2)
+        self.assertEqual(stats['open documents'], 1)
+        self.assertGreater(stats['memory'], 0)
+
+
+class FactoryRegistryTest(TestCase):
+
+    def setUp(self):
+        self.factory = CollabServerFactory()
+        self.packets = generate_packets()
+        self.protocol = self.factory.buildProtocol(('127.0.0.1', 1000))
+        self.protocol.transport = FakeTransport()
+
+    def test_connection_lost(self):
+        self.protocol.handshake_recieved(self.packets['handshake_packet'])
+        self.protocol.document_added(self.packets['add_packet'])
+        self.protocol.document_opened(self.packets['open_packet'])
+        document_id = self.packets['document_id']
+        self.assertEqual(self.factory.registry.viewers(document_id),
+                         set([self.protocol]))
+
+        self.protocol.connectionLost(None)
+        self.assertEqual(self.factory.protocols, {})
+        self.assertEqual(self.factory.registry.viewers(document_id), set())
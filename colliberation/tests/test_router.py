@@ -0,0 +1,55 @@
+"""
+Front router tests.
+"""
+from unittest import TestCase
+
+from construct import Container
+
+from colliberation.server.router import RouterFactory, ShardMap
+from colliberation.tests.utils import FakeTransport
+
+BACKENDS = [('127.0.0.1', 7000 + index) for index in range(4)]
+
+
+class ShardMapTest(TestCase):
+
+    def setUp(self):
+        self.shards = ShardMap(BACKENDS)
+
+    def test_owner_stable(self):
+        for document_id in range(100):
+            self.assertEqual(self.shards.owner(document_id),
+                             ShardMap(BACKENDS).owner(document_id))
+
+    def test_owner_spread(self):
+        owners = set(self.shards.owner(document_id)
+                     for document_id in range(100))
+        self.assertEqual(owners, set(BACKENDS))
+
+
+class RouterProtocolTest(TestCase):
+
+    def setUp(self):
+        self.shards = ShardMap(BACKENDS)
+        self.router = RouterFactory(self.shards).buildProtocol(None)
+        self.router.transport = FakeTransport()
+
+    def test_document_packet_targets_owner(self):
+        payload = Container(document_id=5, version=0)
+        self.assertEqual(list(self.router.targets(10, payload)),
+                         [self.shards.owner(5)])
+
+    def test_catalog_packet_targets_all(self):
+        payload = Container(document_id=5, version=0, document_name='a')
+        self.assertEqual(list(self.router.targets(13, payload)), BACKENDS)
+
+    def test_accepts_owner_replies_only(self):
+        payload = Container(document_id=5, version=0)
+        accepted = [address for address in BACKENDS
+                    if self.router.accepts(address, 13, payload)]
+        self.assertEqual(accepted, [self.shards.owner(5)])
+
+    def test_accepts_primary_connection_packets(self):
+        accepted = [address for address in BACKENDS
+                    if self.router.accepts(address, 0, Container())]
+        self.assertEqual(accepted, [self.shards.primary])
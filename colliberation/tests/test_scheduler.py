@@ -0,0 +1,195 @@
+"""
+Edit scheduler tests.
+"""
+from unittest import TestCase
+
+from construct import Container
+from mock import MagicMock
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+
+from colliberation.packets import make_packet
+from colliberation.patching import dmp
+from colliberation.server.factory import CollabServerFactory
+from colliberation.server.scheduler import EditScheduler, TokenBucket
+from colliberation.tests.test_flow import RecordingTransport
+
+
+def make_connection():
+    protocol = MagicMock('protocol')
+    protocol.shadow_docs = {}
+    protocol.transport = MagicMock()
+    protocol.apply_text_modified = MagicMock(return_value=None)
+    protocol.merge_text_modified = lambda run: run[-1]
+    return protocol
+
+
+def packet(document_id, modifications=''):
+    return Container(document_id=document_id, version=0,
+                     modifications=modifications, hash='')
+
+
+class TokenBucketTest(TestCase):
+
+    def test_take(self):
+        clock = Clock()
+        bucket = TokenBucket(2, 2, clock)
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        self.assertEqual(bucket.delay(), 0.5)
+
+        clock.advance(0.5)
+        self.assertTrue(bucket.take())
+
+
+class EditSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = EditScheduler(limit=2, batch_size=10,
+                                       max_pending=4, clock=self.clock)
+        self.flooder = make_connection()
+        self.other = make_connection()
+
+    def started(self, protocol):
+        return [args[0][0].modifications
+                for args in protocol.apply_text_modified.call_args_list]
+
+    def test_queued(self):
+        self.scheduler.submit(self.flooder, packet(1))
+        self.assertEqual(self.started(self.flooder), [])
+        self.assertEqual(self.scheduler.stats()['queued packets'], 1)
+
+        self.clock.advance(0)
+        self.assertEqual(self.started(self.flooder), [''])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_coalesced(self):
+        self.flooder.shadow_docs[1] = None
+        for index in xrange(3):
+            self.scheduler.submit(self.flooder, packet(1, str(index)))
+        self.clock.advance(0)
+        self.assertEqual(self.started(self.flooder), ['2'])
+        self.assertEqual(self.scheduler.stats()['coalesced'], 2)
+
+    def test_round_robin(self):
+        for document_id in xrange(3):
+            self.scheduler.submit(self.flooder, packet(document_id, 'flood'))
+        self.scheduler.submit(self.other, packet(9, 'other'))
+        self.clock.advance(0)
+        self.assertEqual(self.started(self.other), ['other'])
+        self.assertEqual(len(self.started(self.flooder)), 2)
+
+    def test_throttled(self):
+        for document_id in xrange(3):
+            self.scheduler.submit(self.flooder, packet(document_id))
+        self.clock.advance(0)
+        self.assertEqual(len(self.started(self.flooder)), 2)
+        self.assertEqual(self.scheduler.stats()['throttled'], 1)
+
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.started(self.flooder)), 3)
+
+    def test_one_step_per_document(self):
+        steps = []
+
+        def apply_text_modified(data):
+            steps.append(Deferred())
+            return steps[-1]
+        self.flooder.apply_text_modified = apply_text_modified
+
+        self.scheduler.submit(self.flooder, packet(1))
+        self.clock.advance(0)
+        self.scheduler.submit(self.flooder, packet(1))
+        self.clock.advance(0)
+        self.assertEqual(len(steps), 1)
+
+        steps[0].callback(None)
+        self.clock.advance(0)
+        self.assertEqual(len(steps), 2)
+
+    def test_paused(self):
+        for _ in xrange(4):
+            self.scheduler.submit(self.flooder, packet(1))
+        self.flooder.transport.pauseProducing.assert_called_once_with()
+        self.clock.advance(0)
+        self.flooder.transport.resumeProducing.assert_called_once_with()
+
+    def test_remove(self):
+        self.scheduler.submit(self.flooder, packet(1))
+        self.scheduler.remove(self.flooder)
+        self.clock.advance(0)
+        self.assertEqual(self.started(self.flooder), [])
+
+    def test_drained(self):
+        drained = []
+        self.scheduler.drained(self.flooder, 1).addCallback(drained.append)
+        self.assertEqual(drained, [None])
+
+        del drained[:]
+        self.scheduler.submit(self.flooder, packet(1))
+        self.assertTrue(self.scheduler.busy(self.flooder, 1))
+        self.scheduler.drained(self.flooder, 1).addCallback(drained.append)
+        self.assertEqual(drained, [])
+        self.clock.advance(0)
+        self.assertEqual(drained, [None])
+        self.assertFalse(self.scheduler.busy(self.flooder, 1))
+
+
+class PacketOrderTest(TestCase):
+
+    """ A connection's packets about a document are handled in the order
+    they were sent, though its edits wait for the edit scheduler.
+    """
+
+    def setUp(self):
+        self.saved = []
+
+        def record_save(document):
+            self.saved.append(document.content)
+            return True, False, document
+        self.factory = CollabServerFactory(
+            protocol_hooks={'doc_save_hooks': [record_save]})
+        self.clock = self.factory.scheduler.clock = Clock()
+        self.protocol = self.factory.buildProtocol(('127.0.0.1', 1000))
+        self.protocol.makeConnection(RecordingTransport())
+        self.protocol.handshake_recieved(
+            Container(username='user', session=''))
+        self.protocol.dataReceived(''.join([
+            make_packet('document_added', document_id=1, version=0,
+                        document_name='a'),
+            make_packet('document_opened', document_id=1, version=0),
+        ]))
+        self.document = self.factory.available_docs[1]
+
+    def tearDown(self):
+        self.protocol.connectionLost(None)
+        self.factory.stopFactory()
+
+    def edit(self, text):
+        return make_packet(
+            'text_modified', document_id=1, version=0,
+            modifications=dmp.patch_toText(dmp.patch_make('', text)),
+            hash=str(hash(text)))
+
+    def test_edit_then_save(self):
+        self.protocol.dataReceived(
+            self.edit('hello') +
+            make_packet('document_saved', document_id=1, version=0))
+        self.assertEqual(self.saved, [])
+        self.assertIn(1, self.protocol.suspended)
+
+        self.clock.advance(0)
+        self.assertEqual(self.saved, ['hello'])
+        self.assertNotIn(1, self.protocol.suspended)
+
+    def test_edit_then_close(self):
+        self.protocol.dataReceived(
+            self.edit('hello') +
+            make_packet('document_closed', document_id=1, version=0))
+        self.assertIn(1, self.protocol.open_docs)
+
+        self.clock.advance(0)
+        self.assertNotIn(1, self.protocol.open_docs)
+        self.assertEqual(self.document.content, 'hello')
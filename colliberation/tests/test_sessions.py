@@ -0,0 +1,225 @@
+"""
+Session resume tests.
+"""
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from construct import Container
+from twisted.internet.task import Clock
+
+from colliberation.document import Document
+from colliberation.packets import parse_packets
+from colliberation.protocol import CollaborationProtocol
+from colliberation.server.factory import CollabServerFactory
+from colliberation.server.sessions import (SESSIONS_NAME, SessionStore,
+                                           ShadowCheckpoint, restore_shadow)
+from colliberation.tests.test_flow import RecordingTransport
+from colliberation.tests.utils import FakeTransport, generate_packets
+
+
+class SessionStoreTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.store = SessionStore(grace_period=10, clock=self.clock,
+                                  log_size=3)
+        self.token = self.store.create()
+
+    def test_resume(self):
+        self.store.detach(self.token, 'user', {1: Document()})
+        self.assertIsNone(self.store.resume(self.token, 'someone else'))
+        session = self.store.resume(self.token, 'user')
+        self.assertEqual(session.shadows.keys(), [1])
+        self.assertNotIn(self.token, self.store)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_expire(self):
+        self.store.detach(self.token, 'user', {})
+        self.clock.advance(10)
+        self.assertIsNone(self.store.resume(self.token, 'user'))
+        self.assertEqual(self.store.stats()['expired'], 1)
+
+    def test_catalog_changes(self):
+        self.store.detach(self.token, 'user', {})
+        self.store.catalog_changed(5)
+        self.store.catalog_changed(5)
+        self.store.catalog_changed(6)
+        self.assertEqual(self.store.catalog_changes(0), set([5, 6]))
+        self.assertEqual(self.store.catalog_changes(3), set())
+
+        # Changes the session missed have been forgotten.
+        self.store.catalog_changed(7)
+        self.assertIsNone(self.store.catalog_changes(0))
+        self.assertIsNone(self.store.resume(self.token, 'user'))
+
+
+class ResumeTest(TestCase):
+
+    def setUp(self):
+        self.factory = CollabServerFactory()
+        self.factory.sessions.clock = Clock()
+        self.packets = generate_packets()
+        self.document_id = self.packets['document_id']
+
+        self.protocol = self.connect(self.packets['handshake_packet'])
+        self.protocol.document_added(self.packets['add_packet'])
+        self.protocol.document_opened(self.packets['open_packet'])
+        self.shadow = self.protocol.shadow_docs[self.document_id]
+        self.session = self.protocol.session
+        self.protocol.connectionLost(None)
+
+    def connect(self, handshake):
+        protocol = self.factory.buildProtocol(('127.0.0.1', 1000))
+        protocol.makeConnection(RecordingTransport())
+        protocol.handshake_recieved(handshake)
+        return protocol
+
+    def handshake(self, session):
+        return Container(username=self.packets['username'], session=session)
+
+    def received(self, protocol):
+        packets, _ = parse_packets(''.join(protocol.transport.data))
+        return [packet for packet in packets if packet[0] != 0]
+
+    def tearDown(self):
+        self.factory.sessions.stop()
+
+    def test_resume(self):
+        session = self.session
+        self.assertIn(session, self.factory.sessions)
+        self.factory.available_docs[self.document_id].name = 'renamed'
+        self.factory.sessions.catalog_changed(self.document_id)
+
+        protocol = self.connect(self.handshake(session))
+        self.assertIs(protocol.shadow_docs[self.document_id], self.shadow)
+        self.assertIn(protocol, self.factory.registry.viewers(
+            self.document_id))
+
+        headers = [header for header, payload in self.received(protocol)]
+        # Handshake, the renamed document, and the shadow's hash
+        self.assertEqual(headers, [4, 13, 15, 20])
+        self.assertEqual(self.received(protocol)[0][1].session, session)
+        protocol.connectionLost(None)
+
+    def test_unknown_session(self):
+        protocol = self.connect(self.handshake('unknown'))
+        self.assertEqual(protocol.open_docs, {})
+        self.assertNotEqual(protocol.session, 'unknown')
+        protocol.connectionLost(None)
+
+
+class CheckpointTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, SESSIONS_NAME)
+        self.store = SessionStore(clock=Clock())
+        self.document = Document(id=1, content='text', version=3)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def restore(self):
+        store = SessionStore(clock=Clock())
+        self.assertEqual(store.restore(self.path), 1)
+        self.assertFalse(os.path.exists(self.path))
+        return store.resume('token', 'user').shadows[1]
+
+    def test_fingerprint(self):
+        shadow = Document(id=1, content='text', version=3)
+        self.store.checkpoint(self.path, [('token', 'user', {1: shadow})],
+                              {1: self.document})
+        checkpoint = self.restore()
+        self.assertIsNone(checkpoint.content)
+
+        restored = restore_shadow(checkpoint, Document(content='text'))
+        self.assertEqual(restored.content, 'text')
+        self.assertEqual(restored.version, 3)
+        # The recovered document doesn't match the shadow.
+        restored = restore_shadow(checkpoint, Document(content='texts'))
+        self.assertEqual(restored.content, '')
+
+    def test_full(self):
+        shadow = Document(id=1, content='older text', version=2)
+        self.store.detach('token', 'user', {1: shadow})
+        self.store.checkpoint(self.path, [], {1: self.document})
+        self.store.stop()
+        checkpoint = self.restore()
+        self.assertEqual(checkpoint, ShadowCheckpoint(
+            2, checkpoint.checksum, 10, 'older text'))
+
+    def test_restart(self):
+        factory = CollabServerFactory(journal_directory=self.directory)
+        factory.sessions.clock = Clock()
+        packets = generate_packets()
+        protocol = factory.buildProtocol(('127.0.0.1', 1000))
+        protocol.makeConnection(RecordingTransport())
+        protocol.handshake_recieved(packets['handshake_packet'])
+        protocol.document_added(packets['add_packet'])
+        protocol.document_opened(packets['open_packet'])
+
+        document_id = packets['document_id']
+        edits = [(0, 'hello', 0)]
+        factory.available_docs[document_id].apply_edits(edits)
+        factory.edits_applied(factory.available_docs[document_id], edits)
+        protocol.shadow_docs[document_id].content = 'hello'
+        session = protocol.session
+        factory.stopFactory()
+
+        factory = CollabServerFactory(journal_directory=self.directory)
+        protocol = factory.buildProtocol(('127.0.0.1', 1000))
+        protocol.makeConnection(RecordingTransport())
+        protocol.handshake_recieved(Container(username=packets['username'],
+                                              session=session))
+        self.assertEqual(protocol.shadow_docs[document_id].content, 'hello')
+        factory.stopFactory()
+
+    def test_sessions_name(self):
+        factory = CollabServerFactory(journal_directory=self.directory,
+                                      sessions_name='worker-1.ckpt')
+        factory.stopFactory()
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, 'worker-1.ckpt')))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, SESSIONS_NAME)))
+
+
+class ClientSessionTest(TestCase):
+
+    def setUp(self):
+        self.document = Document(id=1, content='text')
+        self.shadow = Document(id=1, content='text')
+        self.protocol = CollaborationProtocol(
+            session='token',
+            open_docs={1: self.document},
+            shadow_docs={1: self.shadow},
+            available_docs={1: self.document}
+        )
+        self.protocol.transport = FakeTransport()
+        self.protocol.transport.data = []
+
+    def test_resumed(self):
+        self.protocol.handshake_recieved(
+            Container(username='', session='token'))
+        self.assertEqual(self.protocol.open_docs, {1: self.document})
+        self.assertEqual(self.protocol.unverified, set([1]))
+
+    def test_new_session(self):
+        self.protocol.handshake_recieved(
+            Container(username='', session='other'))
+        self.assertEqual(self.protocol.session, 'other')
+        self.assertEqual(self.protocol.open_docs, {})
+        self.assertEqual(self.protocol.available_docs, {})
+
+    def test_shadow_differs(self):
+        self.protocol.handshake_recieved(
+            Container(username='', session='token'))
+        self.protocol.text_modified(Container(
+            document_id=1, version=0, modifications='',
+            hash=str(hash('other text'))))
+        self.assertEqual(self.document.content, '')
+        self.assertEqual(self.shadow.content, '')
+        header, payload = parse_packets(self.protocol.transport.data[0])[0][0]
+        self.assertEqual(header, 10)
@@ -0,0 +1,251 @@
+"""
+SublimeDocument tests, against stand-ins for Sublime Text's modules.
+"""
+import sys
+from types import ModuleType
+from unittest import TestCase
+
+from construct import Container
+from twisted.internet.task import Clock
+
+from colliberation.packets import parse_packets
+from colliberation.patching import dmp, sync_text
+from colliberation.tests.test_flow import RecordingTransport
+
+STUBBED = ('sublime', 'sublime_plugin', 'sublime_utils',
+           'colliberation.sublime.document',
+           'colliberation.sublime.protocol')
+
+
+class Region(object):
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+
+class FakeView(object):
+
+    """ A view over a buffer of text, recording what is done to it.
+    """
+
+    def __init__(self, text=''):
+        self.text = text
+        self.changes = 0
+        self.reads = 0
+        self.edits = 0
+        self.replaced = []  # (start, text, end)
+        self.selected = [Region(0, 0)]
+        self.regions = {}  # key : regions
+
+    def buffer_id(self):
+        return 1
+
+    def set_name(self, name):
+        self.name = name
+
+    def sel(self):
+        return self.selected
+
+    def add_regions(self, key, regions, scope, icon, flags):
+        self.regions[key] = [(region.a, region.b) for region in regions]
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+    def change_count(self):
+        return self.changes
+
+    def size(self):
+        return len(self.text)
+
+    def substr(self, region):
+        self.reads += 1
+        return self.text[region.a:region.b]
+
+    def begin_edit(self):
+        self.edits += 1
+        return self.edits
+
+    def end_edit(self, edit):
+        pass
+
+    def replace(self, edit, region, text):
+        self.text = self.text[:region.a] + text + self.text[region.b:]
+        self.changes += 1
+        self.replaced.append((region.a, text, region.b))
+
+    def erase(self, edit, region):
+        self.replace(edit, region, '')
+
+    def type(self, text):
+        """ Edit the buffer as the user would.
+        """
+        self.text += text
+        self.changes += 1
+
+
+class FakeWindow(object):
+
+    def __init__(self, *views):
+        self.open_views = list(views)
+
+    def views(self):
+        return self.open_views
+
+    def get_view_index(self, view):
+        return 0, self.open_views.index(view)
+
+    def run_command(self, command, args):
+        if command == 'close_by_index':
+            del self.open_views[args['index']]
+
+
+def stub_modules(*windows):
+    sublime = ModuleType('sublime')
+    sublime.Region = Region
+    sublime.windows = lambda: windows
+    sublime.DRAW_EMPTY = 1
+    sublime.DRAW_OUTLINED = 2
+    sublime.active_window = None
+    sublime_plugin = ModuleType('sublime_plugin')
+    sublime_plugin.EventListener = object
+    sublime_plugin.all_callbacks = {}
+    sys.modules['sublime'] = sublime
+    sys.modules['sublime_plugin'] = sublime_plugin
+
+
+class SublimeDocumentTest(TestCase):
+
+    def setUp(self):
+        self.view = FakeView('hello world')
+        self.other_view = FakeView('hello world')
+        self.window = FakeWindow(self.view, self.other_view)
+        stub_modules(self.window)
+        from colliberation.sublime.document import SublimeDocument
+        self.document = SublimeDocument()
+        self.document.view = self.view
+
+    def tearDown(self):
+        for name in STUBBED:
+            sys.modules.pop(name, None)
+
+    def test_cache_hit(self):
+        self.assertEqual(self.document.content, 'hello world')
+        self.assertEqual(self.document.content, 'hello world')
+        self.assertEqual(self.view.reads, 1)
+
+    def test_change_count_moved(self):
+        self.document.content
+        self.view.type('!')
+        self.assertEqual(self.document.content, 'hello world!')
+        self.assertEqual(self.view.reads, 2)
+
+    def test_set_content(self):
+        self.document.content
+        self.document.content = 'hello there world'
+        self.assertEqual(self.document.content, 'hello there world')
+        self.assertEqual(self.view.reads, 1)
+
+    def test_set_content_minimal(self):
+        self.document.content = 'hello there world'
+        self.assertEqual(self.view.edits, 1)
+        self.assertEqual(self.view.replaced, [(6, 'there ', 6)])
+
+        self.document.content = 'hello there world'
+        self.assertEqual(self.view.edits, 1)
+
+    def test_remote_patches(self):
+        text = 'A quick red fox jumped over the brown lazy dog.'
+        new_text = 'A quick blue fox jumped over the brown lazy cat.'
+        self.view.text = text
+        self.view.changes += 1
+        edits, shadow_text, modifications = sync_text(
+            text, text, dmp.patch_make(text, new_text))
+
+        self.document.apply_edits(edits)
+        self.assertEqual(self.view.text, new_text)
+        # One edit of the view, touching only the changed characters.
+        self.assertEqual(self.view.edits, 1)
+        self.assertEqual(self.view.replaced,
+                         [(8, 'blue', 11), (44, 'cat', 47)])
+
+    def test_name(self):
+        self.document.buffer_id = 1
+        self.document.name = 'notes.txt'
+        self.assertEqual(self.view.name, 'notes.txt')
+        self.assertEqual(self.other_view.name, 'notes.txt')
+
+    def test_close_view(self):
+        self.document.buffer_id = 1
+        self.document.content
+        self.window.open_views.remove(self.view)
+        self.document.on_close(self.view)
+        self.assertIs(self.document.view, self.other_view)
+        # The new view's content is read afresh.
+        self.other_view.text = 'hello there'
+        self.assertEqual(self.document.content, 'hello there')
+
+
+def presence(connection, *regions):
+    return Container(document_id=1, connection=connection, username='peer',
+                     regions=[Container(start=start, end=end)
+                              for start, end in regions])
+
+
+class SublimePresenceTest(TestCase):
+
+    def setUp(self):
+        self.view = FakeView('hello world')
+        stub_modules(FakeWindow(self.view))
+        from colliberation.sublime.protocol import (PRESENCE_DELAY,
+                                                    SublimeCollabProtocol)
+        self.delay = PRESENCE_DELAY
+        self.clock = Clock()
+        self.protocol = SublimeCollabProtocol()
+        self.protocol.clock = self.clock
+        self.protocol.transport = RecordingTransport()
+        self.document = self.protocol.doc_class(id=1, content='hello world')
+        self.document.buffer_id = 1
+        self.document.view = self.view
+        self.protocol.document_opened_hooked(self.document,
+                                             Container(document_id=1), None)
+
+    def tearDown(self):
+        for name in STUBBED:
+            sys.modules.pop(name, None)
+
+    def sent(self):
+        packets, rest = parse_packets(''.join(self.protocol.transport.data))
+        return [payload for header, payload in packets]
+
+    def test_send_selection(self):
+        for start in xrange(5):
+            self.view.selected = [Region(start, start), Region(8, 10)]
+            self.document.on_selection_modified(self.view)
+        self.assertEqual(self.sent(), [])
+
+        self.clock.advance(self.delay)
+        packets = self.sent()
+        self.assertEqual(len(packets), 1)
+        self.assertEqual([(region.start, region.end)
+                          for region in packets[0].regions],
+                         [(4, 4), (8, 10)])
+
+    def test_closed(self):
+        self.document.on_selection_modified(self.view)
+        self.protocol.document_closed_hooked(self.document,
+                                             Container(document_id=1))
+        self.clock.advance(self.delay)
+        self.assertEqual(self.sent(), [])
+        self.assertIs(self.document.selection_listener, None)
+
+    def test_show_presence(self):
+        self.protocol.presence_changed(presence(7, (2, 2), (3, 6)))
+        self.protocol.presence_changed(presence(8, (0, 1)))
+        self.assertEqual(sorted(self.view.regions.values()),
+                         [[(0, 1)], [(2, 2), (3, 6)]])
+
+        # No regions means the connection left the document.
+        self.protocol.presence_changed(presence(7))
+        self.assertEqual(self.view.regions.values(), [[(0, 1)]])
@@ -0,0 +1,93 @@
+"""
+Timer wheel and heartbeat tests.
+"""
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from colliberation.packets import make_packet, parse_packets
+from colliberation.server.factory import CollabServerFactory
+from colliberation.server.timers import TimerWheel
+from colliberation.tests.test_flow import RecordingTransport
+
+
+class TimerWheelTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(tick=1, size=8, clock=self.clock)
+        self.fired = []
+
+    def callback(self, name):
+        return lambda: self.fired.append(name)
+
+    def test_fire(self):
+        self.wheel.schedule('a', 2, self.callback('a'))
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, ['a'])
+        self.assertEqual(len(self.wheel), 0)
+
+        # The wheel stops once it has nothing left to fire.
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_one_call(self):
+        for key in xrange(100):
+            self.wheel.schedule(key, key % 5 + 1, self.callback(key))
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.pump([1] * 5)
+        self.assertEqual(sorted(self.fired), range(100))
+
+    def test_later_rounds(self):
+        self.wheel.schedule('a', 10, self.callback('a'))
+        self.clock.pump([1] * 9)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, ['a'])
+
+    def test_reschedule(self):
+        self.wheel.schedule('a', 1, self.callback('first'))
+        self.wheel.schedule('a', 3, self.callback('second'))
+        self.clock.pump([1] * 3)
+        self.assertEqual(self.fired, ['second'])
+
+    def test_cancel(self):
+        self.wheel.schedule('a', 1, self.callback('a'))
+        self.wheel.cancel('a')
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [])
+
+
+class HeartbeatTest(TestCase):
+
+    def setUp(self):
+        self.factory = CollabServerFactory()
+        self.clock = Clock()
+        self.factory.timers = TimerWheel(clock=self.clock)
+        self.protocol = self.factory.buildProtocol(('127.0.0.1', 1000))
+        self.protocol.timeout_rate = 10
+        self.protocol.setTimeout(30)
+        self.protocol.makeConnection(RecordingTransport())
+
+    def tearDown(self):
+        self.factory.timers.stop()
+
+    def headers(self):
+        packets, _ = parse_packets(''.join(self.protocol.transport.data))
+        return [header for header, payload in packets]
+
+    def test_ping(self):
+        self.clock.pump([1] * 10)
+        self.assertEqual(self.headers(), [0])
+        self.clock.pump([1] * 10)
+        self.assertEqual(self.headers(), [0, 0])
+
+    def test_idle(self):
+        self.clock.pump([1] * 20)
+        self.protocol.dataReceived(make_packet('ping', sent=0, echo=0))
+        self.clock.pump([1] * 29)
+        self.assertTrue(self.protocol.connected)
+        self.clock.advance(1)
+        self.assertTrue(self.protocol.transport.lost)
+        self.assertNotIn(self.protocol, self.factory.timers)
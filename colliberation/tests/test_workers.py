@@ -0,0 +1,67 @@
+"""
+Executor and job queue tests.
+"""
+from unittest import TestCase
+
+from twisted.internet.defer import Deferred
+
+from colliberation.workers import InlineExecutor, JobQueues, make_executor
+
+
+class InlineExecutorTest(TestCase):
+
+    def test_run(self):
+        results = []
+        InlineExecutor().run(pow, 2, 8).addCallback(results.append)
+        self.assertEqual(results, [256])
+
+    def test_run_failure(self):
+        failures = []
+        InlineExecutor().run(int, 'x').addErrback(failures.append)
+        self.assertEqual(len(failures), 1)
+        failures[0].trap(ValueError)
+
+    def test_make_executor(self):
+        self.assertIsInstance(make_executor(), InlineExecutor)
+
+
+class JobQueuesTest(TestCase):
+
+    def setUp(self):
+        self.queues = JobQueues()
+        self.order = []
+
+    def job(self, name, deferred=None):
+        self.order.append(name)
+        return deferred
+
+    def test_run_idle(self):
+        results = []
+        self.queues.run(1, lambda: 'done').addCallback(results.append)
+        self.assertEqual(results, ['done'])
+        self.assertFalse(self.queues.busy(1))
+
+    def test_same_key_ordered(self):
+        blocker = Deferred()
+        self.queues.run(1, self.job, 'first', blocker)
+        self.queues.run(1, self.job, 'second')
+        self.assertEqual(self.order, ['first'])
+        self.assertTrue(self.queues.busy(1))
+
+        blocker.callback(None)
+        self.assertEqual(self.order, ['first', 'second'])
+        self.assertFalse(self.queues.busy(1))
+        self.assertEqual(len(self.queues), 0)
+
+    def test_different_keys_independent(self):
+        blocker = Deferred()
+        self.queues.run(1, self.job, 'first', blocker)
+        self.queues.run(2, self.job, 'second')
+        self.assertEqual(self.order, ['first', 'second'])
+
+    def test_failure_releases_queue(self):
+        failures = []
+        self.queues.run(1, int, 'x').addErrback(failures.append)
+        self.queues.run(1, self.job, 'second')
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(self.order, ['second'])
@@ -45,7 +45,8 @@ def generate_packets():
         'document_newname': doc_newname,
 
         'handshake_packet': MagicMock('handshake',
-                                      username=user),
+                                      username=user,
+                                      session=''),
 
         'message_packet': MagicMock('message',
                                     message=mess),
@@ -1,6 +1,21 @@
 """
 Plugin and function utilities.
 """
+from timeit import default_timer
+
+from twisted.internet import reactor
+from twisted.internet.defer import (CancelledError, Deferred, gatherResults,
+                                    inlineCallbacks, maybeDeferred,
+                                    returnValue)
+
+#: What an asynchronous hook failing or timing out does to its event:
+#: either carry on as if the hook had passed the data on unchanged, or
+#: cancel the event.
+SKIP = 'skip'
+CANCEL = 'cancel'
+
+#: Seconds an asynchronous hook may take.
+HOOK_TIMEOUT = 10
 
 
 class Pipeline(object):
@@ -34,27 +49,232 @@ class Pipeline(object):
 
 
 def pipeline_funcs(functions, data, can_stop=True, can_cancel=True):
+    """
+    Runs data through a pipeline of functions. Similar to map, but runs
+    the result of each function through the next function.
+
+    Hooks run often should be compiled once with compile_pipeline instead.
+    """
+    pipeline = compile_pipeline(functions, can_stop, can_cancel)
+    if pipeline is None:
+        return data
+    return pipeline(data)
+
+
+def compile_pipeline(functions, can_stop=True, can_cancel=True,
+                     timings=None):
+    """ Compile a chain of hooks into a single callable.
+
+    The callable runs data through each hook in turn, as pipeline_funcs
+    does, and returns the result, or None if a hook cancelled. Depending on
+    can_stop and can_cancel, hooks return (proceed, cancel, data),
+    (cancel, data), (proceed, data) or just data; the flags are only
+    looked at here, not on every call.
+
+    Returns None if there are no hooks, so that callers may skip the
+    pipeline altogether. If any hook is an AsyncHook, the callable returns
+    a Deferred instead, see compile_async_pipeline.
+
+    :param HookTimings timings: Accumulates the time spent in each hook.
+    """
+    hooks = tuple(functions)
+    if not hooks:
+        return None
+    if any(isinstance(hook, AsyncHook) for hook in hooks):
+        return compile_async_pipeline(hooks, can_stop, can_cancel, timings)
+    if timings is not None:
+        hooks = tuple(timings.wrap(hook) for hook in hooks)
+
+    if can_cancel and can_stop:
+        def pipeline(data):
+            for hook in hooks:
+                proceed, cancel, data = hook(data)
+                if cancel:
+                    return None
+                if not proceed:
+                    break
+            return data
+    elif can_cancel:
+        def pipeline(data):
+            for hook in hooks:
+                cancel, data = hook(data)
+                if cancel:
+                    return None
+            return data
+    elif can_stop:
+        def pipeline(data):
+            for hook in hooks:
+                proceed, data = hook(data)
+                if not proceed:
+                    break
+            return data
+    else:
+        def pipeline(data):
+            for hook in hooks:
+                data = hook(data)
+            return data
+    return pipeline
+
+
+def unpack_result(result, can_stop, can_cancel):
+    """ Return a hook's result as (proceed, cancel, data).
+    """
+    if can_cancel and can_stop:
+        return result
+    if can_cancel:
+        return (True,) + tuple(result)
+    if can_stop:
+        return result[0], False, result[1]
+    return True, False, result
+
+
+def compile_async_pipeline(hooks, can_stop=True, can_cancel=True,
+                           timings=None):
+    """ Compile a chain of hooks, some of which return Deferreds.
+
+    The returned callable runs data through the hooks as compile_pipeline's
+    do, returning a Deferred which fires with the result. Neighbouring
+    AsyncHooks which are concurrent are given the same data at the same
+    time, and the chain goes on once they have all finished: any of them
+    may cancel or stop the chain, but the data they return is ignored.
+    """
+    stages = []  # [[(hook, call)]]
+    for hook in hooks:
+        call = timings.wrap(hook) if timings is not None else hook
+        if (stages and getattr(hook, 'concurrent', False) and
+                getattr(stages[-1][0][0], 'concurrent', False)):
+            stages[-1].append((hook, call))
+        else:
+            stages.append([(hook, call)])
+
+    def run_hook(hook, call, data):
+        deferred = maybeDeferred(call, data)
+        deferred.addCallback(unpack_result, can_stop, can_cancel)
+        if isinstance(hook, AsyncHook):
+            deferred.addErrback(hook.failed, data)
+        return deferred
+
+    @inlineCallbacks
+    def pipeline(data):
+        for stage in stages:
+            if len(stage) == 1:
+                results = [(yield run_hook(stage[0][0], stage[0][1], data))]
+                data = results[0][2]
+            else:
+                results = yield gatherResults(
+                    [run_hook(hook, call, data) for hook, call in stage],
+                    consumeErrors=True)
+            if any(cancel for proceed, cancel, _ in results):
+                returnValue(None)
+            if not all(proceed for proceed, cancel, _ in results):
+                break
+        returnValue(data)
+    return pipeline
+
+
+def compile_hooks(hooks, timings=None):
+    """ Compile each list of hooks in a dict, keeping the keys.
+    """
+    return dict((name, compile_pipeline(functions, timings=timings))
+                for name, functions in hooks.iteritems())
+
+
+class AsyncHook(object):
+
+    """ A hook which may return a Deferred.
+
+    Hooks are only waited for when wrapped in an AsyncHook, so that chains
+    of plain hooks stay synchronous.
+
+    :param function: The hook.
+    :param timeout: Seconds to wait for the hook, or None to wait forever.
+    :param str on_failure: SKIP or CANCEL, for when the hook fails or
+        times out.
+    :param bool concurrent: Whether the hook only checks the data rather
+        than changing it, so that it may run alongside its concurrent
+        neighbours.
+    """
+
+    def __init__(self, function, timeout=HOOK_TIMEOUT, on_failure=SKIP,
+                 concurrent=False, clock=reactor):
+        self.function = function
+        self.timeout = timeout
+        self.on_failure = on_failure
+        self.concurrent = concurrent
+        self.clock = clock
+        self.__name__ = hook_name(function)
+
+        # Metrics
+        self.failures = 0
+        self.timeouts = 0
+
+    def __call__(self, data):
+        deferred = maybeDeferred(self.function, data)
+        if self.timeout is None or deferred.called:
+            return deferred
+        call = self.clock.callLater(self.timeout, deferred.cancel)
+
+        def finished(result):
+            if call.active():
+                call.cancel()
+            return result
+        return deferred.addBoth(finished)
+
+    def failed(self, failure, data):
+        """ Apply the failure policy to a failed or timed out call.
         """
-        Runs data through a pipeline of functions. Similar to map, but runs
-        the result of each function through the next function.
+        if failure.check(CancelledError):
+            self.timeouts += 1
+        else:
+            self.failures += 1
+        return True, self.on_failure == CANCEL, data
+
+
+def hook_name(hook):
+    if isinstance(hook, AsyncHook):
+        return hook.__name__
+    name = getattr(hook, '__name__', None) or type(hook).__name__
+    return '{0}.{1}'.format(getattr(hook, '__module__', None), name)
+
+
+class HookTimings(object):
+
+    """ Counts the calls to each hook, and the time spent in them.
+    """
+
+    def __init__(self):
+        self.calls = {}  # hook name : calls
+        self.seconds = {}  # hook name : seconds
+
+    def wrap(self, hook):
+        """ Return a hook which calls hook, timing it.
         """
-        piped_data = data
-        proceed = True
-        cancel = False
-
-        for hook in functions:
-
-            if can_cancel and can_stop:
-                proceed, cancel, piped_data = hook(piped_data)
-            elif can_cancel:
-                cancel, piped_data = hook(piped_data)
-            elif can_stop:
-                proceed, piped_data = hook(piped_data)
-
-            if cancel:
-                return None
-            if not proceed:
-                break
-        return piped_data
+        name = hook_name(hook)
+        self.calls.setdefault(name, 0)
+        self.seconds.setdefault(name, 0.0)
+
+        def finished(result, start):
+            self.calls[name] += 1
+            self.seconds[name] += default_timer() - start
+            return result
+
+        def timed(data):
+            start = default_timer()
+            try:
+                result = hook(data)
+            except Exception:
+                finished(None, start)
+                raise
+            # Asynchronous hooks are timed until they finish.
+            if isinstance(result, Deferred):
+                return result.addBoth(finished, start)
+            return finished(result, start)
+        timed.__name__ = getattr(hook, '__name__', name)
+        return timed
+
+    def stats(self):
+        return dict((name, {'calls': self.calls[name],
+                            'seconds': self.seconds[name]})
+                    for name in self.calls)
 
 null = str(object())
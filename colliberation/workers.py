@@ -0,0 +1,153 @@
+"""
+Executors and job queues used to run diffing and patching work away from
+the reactor thread.
+"""
+from multiprocessing import Pool, cpu_count
+from traceback import format_exc
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredLock, maybeDeferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+INLINE = 'inline'
+THREAD = 'thread'
+PROCESS = 'process'
+
+
+class WorkerError(Exception):
+
+    """ Raised when a job fails inside a worker process.
+    """
+
+
+class InlineExecutor(object):
+
+    """ Runs jobs immediately, on the calling thread.
+    """
+
+    def run(self, func, *args):
+        return maybeDeferred(func, *args)
+
+    def stop(self):
+        pass
+
+
+class ThreadExecutor(object):
+
+    """ Runs jobs in a pool of threads.
+
+    Threads keep the reactor responsive while a large document is being
+    diffed, however pure python jobs still contend for the GIL.
+    """
+
+    def __init__(self, size=None):
+        size = size or cpu_count()
+        self.pool = ThreadPool(minthreads=1, maxthreads=size,
+                               name='colliberation-workers')
+        self.pool.start()
+
+    def run(self, func, *args):
+        return deferToThreadPool(reactor, self.pool, func, *args)
+
+    def stop(self):
+        self.pool.stop()
+
+
+def _call_safely(func, args):
+    """ Call a function in a worker process, trapping any exception.
+
+    Exceptions are formatted in the worker, since tracebacks cannot be sent
+    between processes.
+    """
+    try:
+        return True, func(*args)
+    except Exception:
+        return False, format_exc()
+
+
+class ProcessExecutor(object):
+
+    """ Runs jobs in a pool of worker processes.
+
+    Jobs and their arguments must be picklable. Results are delivered back to
+    the reactor thread.
+    """
+
+    def __init__(self, size=None):
+        self.pool = Pool(size or cpu_count())
+
+    def run(self, func, *args):
+        deferred = Deferred()
+
+        def deliver(result):
+            success, value = result
+            if success:
+                reactor.callFromThread(deferred.callback, value)
+            else:
+                reactor.callFromThread(
+                    deferred.errback, Failure(WorkerError(value)))
+
+        self.pool.apply_async(_call_safely, (func, args), callback=deliver)
+        return deferred
+
+    def stop(self):
+        self.pool.terminate()
+
+executors = {
+    INLINE: InlineExecutor,
+    THREAD: ThreadExecutor,
+    PROCESS: ProcessExecutor,
+}
+
+
+def make_executor(mode=INLINE, size=None):
+    """ Create an executor for the given execution mode.
+
+    :param str mode: One of 'inline', 'thread' or 'process'.
+    :param int size: Number of workers, defaults to the number of cores.
+    """
+    if mode == INLINE:
+        return InlineExecutor()
+    return executors[mode](size)
+
+
+class JobQueues(object):
+
+    """ A set of serial job queues, keyed by document id.
+
+    Jobs submitted under the same key run one after another, in the order
+    they were submitted, while jobs under different keys may run at the same
+    time.
+    """
+
+    def __init__(self):
+        self.locks = {}
+
+    def __len__(self):
+        return len(self.locks)
+
+    def busy(self, key):
+        """ Return whether a job is running or waiting under the given key.
+        """
+        return key in self.locks
+
+    def run(self, key, func, *args, **kwargs):
+        """ Run a job once every job before it under the same key has finished.
+
+        The job may return a Deferred, in which case the queue waits for it to
+        fire. Returns a Deferred firing with the job's result.
+        """
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = DeferredLock()
+
+        deferred = lock.run(func, *args, **kwargs)
+        deferred.addBoth(self._job_finished, key, lock)
+        return deferred
+
+    def _job_finished(self, result, key, lock):
+        if not lock.locked and self.locks.get(key) is lock:
+            del self.locks[key]
+        return result
@@ -63,7 +63,7 @@ def views_from_buffer(buffer_id):
     Return views that match the given buffer id.
     """
     def buffer_compare(view, window):
-        return view.buffer_id == buffer_id
+        return view.buffer_id() == buffer_id
     return retrieve_views(buffer_compare)
 
 
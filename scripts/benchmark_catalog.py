@@ -0,0 +1,90 @@
+#!/user/bin/python27
+"""
+Measures how long a server takes to start against the number of documents
+it has stored.
+
+For each document count, a journal directory is filled with documents, then
+the time taken to list them is printed for three cases: loading every
+document, as servers did before the catalog existed; reading the catalog;
+and rebuilding a lost catalog from the documents' headers.
+
+Usage: benchmark_catalog.py [largest count] [document size]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from colliberation.catalog import CATALOG_NAME, CatalogIndex
+from colliberation.document import Document
+from colliberation.journal import JournalSerializer, SNAPSHOT_EXTENSION
+from colliberation.server.factory import CollabServerFactory
+
+
+def fill(directory, first_id, count, size):
+    catalog = CatalogIndex(os.path.join(directory, CATALOG_NAME))
+    journal = JournalSerializer(directory, catalog=catalog)
+    content = 'x' * size
+    for document_id in xrange(first_id, first_id + count):
+        document = Document(id=document_id, content=content,
+                            name='document{0}.txt'.format(document_id))
+        document.url = journal.url_for(document_id)
+        journal.snapshot(document)
+    journal.close()
+
+
+def timed(func, *args):
+    start = default_timer()
+    func(*args)
+    return default_timer() - start
+
+
+def start_server(directory):
+    CollabServerFactory(journal_directory=directory).stopFactory()
+
+
+def rebuild_catalog(directory):
+    os.remove(os.path.join(directory, CATALOG_NAME))
+    catalog = CatalogIndex(os.path.join(directory, CATALOG_NAME))
+    catalog.reconcile(directory, SNAPSHOT_EXTENSION)
+    catalog.close()
+
+
+def main(largest=10000, size=2048):
+    counts = [count for count in (100, 1000, 10000, 100000)
+              if count <= largest]
+    print('{0:>8} {1:>12} {2:>12} {3:>12}'.format(
+        'count', 'load all s', 'catalog s', 'rebuild s'))
+
+    directory = mkdtemp()
+    stored = 0
+    # Only server output about the documents found is printed.
+    stdout = sys.stdout
+    try:
+        for count in counts:
+            fill(directory, stored, count - stored, size)
+            stored = count
+
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                load_all = timed(JournalSerializer(directory).recover)
+                catalog = timed(start_server, directory)
+                rebuild = timed(rebuild_catalog, directory)
+            finally:
+                sys.stdout = stdout
+            print('{0:>8} {1:>12.3f} {2:>12.3f} {3:>12.3f}'.format(
+                count, load_all, catalog, rebuild))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,96 @@
+#!/user/bin/python27
+"""
+Measures text_modified throughput when a burst of packets for one document
+arrives in a single read, with and without coalescing the burst into one
+composed patch.
+
+Usage: benchmark_compose.py [document size] [burst length] [repetitions]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from random import Random
+from string import ascii_letters
+from timeit import default_timer
+
+from colliberation import protocol
+from colliberation.document import Document
+from colliberation.packets import make_packet
+from colliberation.protocol import CollaborationProtocol, fragile_dmp
+
+DOCUMENT_ID = 1
+
+
+class NullTransport(object):
+
+    def write(self, data):
+        pass
+
+
+class NullOutput(object):
+
+    def write(self, data):
+        pass
+
+
+def make_burst(random, text, length):
+    data = []
+    for _ in xrange(length):
+        position = random.randint(0, len(text))
+        new_text = (text[:position] +
+                    ''.join(random.choice(ascii_letters) for _ in xrange(5)) +
+                    text[position + 3:])
+        patches = fragile_dmp.patch_make(text, new_text)
+        modifications = fragile_dmp.patch_toText(patches)
+        data.append(make_packet('text_modified',
+                                document_id=DOCUMENT_ID,
+                                version=0,
+                                modifications=modifications,
+                                hash=str(hash(new_text))))
+        text = new_text
+    return ''.join(data)
+
+
+def make_protocol(text, coalesce):
+    collab_protocol = CollaborationProtocol()
+    collab_protocol.transport = NullTransport()
+    collab_protocol.setTimeout(None)
+    if not coalesce:
+        collab_protocol.coalesce_packets = lambda packets: packets
+
+    document = Document(id=DOCUMENT_ID, content=text)
+    shadow = Document(id=DOCUMENT_ID, content=text)
+    collab_protocol.open_docs[DOCUMENT_ID] = document
+    collab_protocol.shadow_docs[DOCUMENT_ID] = shadow
+    return collab_protocol
+
+
+def main(size=10000, burst=20, repetitions=10):
+    protocol.DEBUG = False
+    random = Random(0)
+    text = ''.join(random.choice(ascii_letters + '\n ') for _ in xrange(size))
+    bursts = [make_burst(random, text, burst) for _ in xrange(repetitions)]
+
+    for name, coalesce in (('sequential', False), ('coalesced', True)):
+        elapsed = 0.0
+        for data in bursts:
+            collab_protocol = make_protocol(text, coalesce)
+            stdout, sys.stdout = sys.stdout, NullOutput()
+            try:
+                start = default_timer()
+                collab_protocol.dataReceived(data)
+                elapsed += default_timer() - start
+            finally:
+                sys.stdout = stdout
+        print('{0:>10}: {1:.4f}s, {2:.1f} packets/s'.format(
+            name, elapsed, burst * repetitions / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,88 @@
+#!/user/bin/python27
+"""
+Compares DiskSerializer's pickles with BinarySerializer's binary format, for
+documents from 1KB to 100MB.
+
+For each size, the time to save and load a document and the size on disk
+are printed for pickles, the binary format, and the compressed binary
+format, along with the time taken to read only a binary document's header.
+
+Usage: benchmark_docformat.py [repeats]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from urllib import pathname2url
+
+from colliberation.docformat import COMPRESS_THRESHOLD
+from colliberation.document import Document
+from colliberation.serializer import BinarySerializer, DiskSerializer
+
+SIZES = (1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 100 * 1024 * 1024)
+WORDS = ('def', 'return', 'self', 'document', 'import', 'class', '\n    ',
+         '(', ')', ':', 'content', 'for', 'in', 'if', 'else', '\n')
+
+
+def make_content(size):
+    random = Random(size)
+    line = ' '.join(random.choice(WORDS) for _ in xrange(2000))
+    return (line * (size // len(line) + 1))[:size]
+
+
+def timed(func, *args):
+    start = default_timer()
+    result = func(*args)
+    return default_timer() - start, result
+
+
+def measure(serializer, document, repeats):
+    save = min(timed(serializer.save_document, document)[0]
+               for _ in xrange(repeats))
+    load = min(timed(serializer.load_document, document.url)[0]
+               for _ in xrange(repeats))
+    path = document.url[len('file:'):]
+    return save, load, os.path.getsize(path)
+
+
+def main(repeats=3):
+    serializers = (
+        ('pickle', DiskSerializer()),
+        ('binary', BinarySerializer()),
+        ('compressed', BinarySerializer(COMPRESS_THRESHOLD)),
+    )
+    print('{0:>10} {1:>11} {2:>10} {3:>10} {4:>12} {5:>10}'.format(
+        'size', 'format', 'save ms', 'load ms', 'file bytes', 'header ms'))
+
+    directory = mkdtemp()
+    try:
+        for size in SIZES:
+            content = make_content(size)
+            for name, serializer in serializers:
+                url = 'file:' + pathname2url(os.path.join(directory, name))
+                document = Document(id=1, name=name, content=content, url=url)
+                save, load, file_size = measure(serializer, document, repeats)
+
+                header = ''
+                if isinstance(serializer, BinarySerializer):
+                    header = '{0:.3f}'.format(1000 * min(
+                        timed(serializer.load_header, url)[0]
+                        for _ in xrange(repeats)))
+                print('{0:>10} {1:>11} {2:>10.2f} {3:>10.2f} {4:>12} '
+                      '{5:>10}'.format(size, name, save * 1000, load * 1000,
+                                       file_size, header))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,75 @@
+#!/user/bin/python27
+"""
+Measures the storage and retrieval cost of VersionHistory.
+
+For each document size and keyframe interval, 1,000 versions of a document
+are committed, each a few small edits away from the last, and the bytes
+stored for the whole history are printed next to the bytes full copies of
+every version would take. The average time to commit a version and the
+slowest time to retrieve one are printed as well.
+
+Usage: benchmark_history.py [revisions]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from random import Random
+from string import ascii_letters
+from timeit import default_timer
+
+from colliberation.history import VersionHistory
+
+SIZES = (10 * 1024, 100 * 1024)
+KEYFRAME_INTERVALS = (1, 10, 50)
+EDITS_PER_REVISION = 5
+
+
+def run(size, keyframe_interval, revisions):
+    random = Random(size)
+    content = ''.join(random.choice(ascii_letters) for _ in xrange(size))
+    history = VersionHistory(limit=revisions,
+                             keyframe_interval=keyframe_interval)
+
+    commit_time = 0
+    for version in xrange(revisions):
+        for _ in xrange(EDITS_PER_REVISION):
+            start = random.randint(0, len(content) - 1)
+            content = (content[:start] + random.choice(ascii_letters) +
+                       content[start + 1:])
+        start = default_timer()
+        history.commit(version, content)
+        commit_time += default_timer() - start
+
+    retrieve_time = 0
+    for version in history.versions():
+        start = default_timer()
+        history.retrieve(version)
+        retrieve_time = max(retrieve_time, default_timer() - start)
+
+    return (history.stored_bytes(), size * revisions,
+            commit_time / revisions, retrieve_time)
+
+
+def main(revisions=1000):
+    print('{0:>8} {1:>9} {2:>12} {3:>12} {4:>10} {5:>12}'.format(
+        'size', 'keyframes', 'stored KB', 'full KB', 'commit ms',
+        'retrieve ms'))
+    for size in SIZES:
+        for keyframe_interval in KEYFRAME_INTERVALS:
+            stored, full, commit_time, retrieve_time = run(
+                size, keyframe_interval, revisions)
+            print('{0:>8} {1:>9} {2:>12.1f} {3:>12.1f} {4:>10.3f} '
+                  '{5:>12.3f}'.format(size, keyframe_interval,
+                                      stored / 1024.0, full / 1024.0,
+                                      commit_time * 1000,
+                                      retrieve_time * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,105 @@
+#!/user/bin/python27
+"""
+Compares saving documents with DiskSerializer, which pickles the whole
+document, against JournalSerializer, which logs edits and takes snapshots.
+
+For each document size and number of edits per save, a document is edited
+and saved repeatedly with both serializers, and the average time per save is
+printed, along with the time taken to recover the journaled document.
+Journal saves are synced to disk, while DiskSerializer saves are not.
+
+Usage: benchmark_journal.py [saves]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from random import Random
+from shutil import rmtree
+from string import ascii_letters
+from tempfile import mkdtemp
+from timeit import default_timer
+from urllib import pathname2url
+
+from colliberation.document import Document
+from colliberation.journal import JournalSerializer
+from colliberation.serializer import DiskSerializer
+
+SIZES = (10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+EDITS_PER_SAVE = (1, 10, 100)
+
+
+def make_edits(random, document, count):
+    edits = []
+    for _ in xrange(count):
+        start = random.randint(0, len(document.content) - 1)
+        edits.append((start, random.choice(ascii_letters), start + 1))
+    return edits
+
+
+def apply_edits(document, edits):
+    # Document.apply_edits logs every edit, which would swamp the timings.
+    for start, text, end in edits:
+        document.content = (document.content[:start] + text +
+                            document.content[end:])
+
+
+def run(size, edits_per_save, saves, directory):
+    random = Random(size)
+    content = ''.join(random.choice(ascii_letters) for _ in xrange(1024))
+    content = content * (size // len(content))
+    edits = [None] * saves
+
+    # Whole document pickles
+    document = Document(id=1, name='pickled', content=content)
+    document.url = 'file:' + pathname2url(os.path.join(directory, 'pickled'))
+    serializer = DiskSerializer()
+    start = default_timer()
+    for save in xrange(saves):
+        edits[save] = make_edits(random, document, edits_per_save)
+        apply_edits(document, edits[save])
+        serializer.save_document(document)
+    pickle_time = (default_timer() - start) / saves
+
+    # Journal
+    journal = JournalSerializer(directory)
+    document = Document(id=2, name='journaled', content=content)
+    document.url = journal.url_for(2)
+    journal.save_document(document)
+    start = default_timer()
+    for save in xrange(saves):
+        apply_edits(document, edits[save])
+        journal.log_edits(document, edits[save])
+        journal.save_document(document)
+    journal_time = (default_timer() - start) / saves
+    journal.close()
+
+    start = default_timer()
+    recovered = JournalSerializer(directory).recover()[2]
+    recovery_time = default_timer() - start
+    assert recovered.content == document.content
+
+    return pickle_time, journal_time, recovery_time
+
+
+def main(saves=50):
+    print('{0:>10} {1:>6} {2:>12} {3:>12} {4:>12}'.format(
+        'size', 'edits', 'pickle ms', 'journal ms', 'recover ms'))
+    for size in SIZES:
+        for edits_per_save in EDITS_PER_SAVE:
+            directory = mkdtemp()
+            try:
+                times = run(size, edits_per_save, saves, directory)
+            finally:
+                rmtree(directory)
+            print('{0:>10} {1:>6} {2:>12.3f} {3:>12.3f} {4:>12.3f}'.format(
+                size, edits_per_save, *[time * 1000 for time in times]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
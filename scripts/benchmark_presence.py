@@ -0,0 +1,143 @@
+#!/user/bin/python27
+"""
+Measures presence traffic with 100 users moving their cursors in one
+document.
+
+Every user moves their cursor at the given rate, for the given number of
+simulated seconds. The packets, bytes and writes sent to the users are
+printed for the presence channel, and for broadcasting every move to every
+other viewer as it arrives, along with the CPU time each took.
+
+Usage: benchmark_presence.py [users] [moves per second] [seconds]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from random import Random
+from timeit import default_timer
+
+from construct import Container
+from twisted.internet.task import Clock
+
+import colliberation.protocol
+from colliberation.packets import make_packet
+from colliberation.server.factory import CollabServerFactory
+
+DOCUMENT_ID = 1
+DOCUMENT_SIZE = 100000
+
+
+class CountingTransport(object):
+
+    def __init__(self):
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.writes += 1
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+
+def connect(factory, users):
+    protocols = []
+    for user in xrange(users):
+        protocol = factory.buildProtocol(('127.0.0.1', 1000 + user))
+        protocol.makeConnection(CountingTransport())
+        protocol.handshake_recieved(Container(username='user{0}'.format(user),
+                                              session=''))
+        if user == 0:
+            protocol.document_added(Container(document_id=DOCUMENT_ID,
+                                              version=0, document_name='doc'))
+        protocol.document_opened(Container(document_id=DOCUMENT_ID,
+                                           version=0))
+        protocols.append(protocol)
+    for protocol in protocols:
+        protocol.transport.bytes = protocol.transport.writes = 0
+    return protocols
+
+
+def moves(users, rate, seconds):
+    """ Yield (time, user, position) for every cursor move, in time order.
+    """
+    random = Random(users)
+    for step in xrange(int(rate * seconds)):
+        for user in xrange(users):
+            yield (float(step) / rate + random.random() / rate / users * user,
+                   user, random.randint(0, DOCUMENT_SIZE))
+
+
+def totals(protocols):
+    return (sum(p.transport.bytes for p in protocols),
+            sum(p.transport.writes for p in protocols))
+
+
+def run_channel(users, rate, seconds):
+    factory = CollabServerFactory()
+    clock = Clock()
+    factory.presence.clock = clock
+    protocols = connect(factory, users)
+
+    start = default_timer()
+    for time, user, position in moves(users, rate, seconds):
+        clock.advance(time - clock.seconds())
+        protocols[user].presence_changed(Container(
+            document_id=DOCUMENT_ID, connection=0, username='',
+            regions=[Container(start=position, end=position)]))
+    clock.advance(factory.presence.interval)
+    elapsed = default_timer() - start
+
+    sent_bytes, writes = totals(protocols)
+    return factory.presence.sent, sent_bytes, writes, elapsed
+
+
+def run_broadcast(users, rate, seconds):
+    factory = CollabServerFactory()
+    protocols = connect(factory, users)
+    viewers = factory.registry.viewers(DOCUMENT_ID)
+
+    packets = 0
+    start = default_timer()
+    for time, user, position in moves(users, rate, seconds):
+        sender = protocols[user]
+        packet = make_packet('presence', document_id=DOCUMENT_ID,
+                             connection=sender.connection_id,
+                             username=sender.other_name,
+                             regions=[Container(start=position,
+                                                end=position)])
+        for viewer in viewers:
+            if viewer is not sender:
+                viewer.send(packet)
+                packets += 1
+    elapsed = default_timer() - start
+
+    sent_bytes, writes = totals(protocols)
+    return packets, sent_bytes, writes, elapsed
+
+
+def main(users=100, rate=30, seconds=10):
+    colliberation.protocol.DEBUG = False
+    sys.stdout = open(os.devnull, 'w')
+    results = [('channel', run_channel(users, rate, seconds)),
+               ('broadcast', run_broadcast(users, rate, seconds))]
+    sys.stdout = sys.__stdout__
+
+    print('{0} users moving cursors {1} times a second for {2} seconds'
+          .format(users, rate, seconds))
+    print('{0:>10} {1:>10} {2:>12} {3:>10} {4:>8}'.format(
+        '', 'packets', 'KB', 'writes', 'cpu s'))
+    for name, (packets, sent_bytes, writes, elapsed) in results:
+        print('{0:>10} {1:>10} {2:>12.1f} {3:>10} {4:>8.2f}'.format(
+            name, packets, sent_bytes / 1024.0, writes, elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
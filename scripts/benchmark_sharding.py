@@ -0,0 +1,149 @@
+#!/user/bin/python27
+"""
+Measures text_modified throughput of a sharded server, from 1 to N worker
+processes on one machine.
+
+For each worker count, start_server.py is started with that many workers,
+and several load generating processes connect to it. Every load connection
+adds and opens its own document, then keeps editing it, counting the
+server's text_modified replies.
+
+Usage: benchmark_sharding.py [max workers] [connections] [seconds]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import signal
+import subprocess
+import time
+from multiprocessing import cpu_count
+from random import Random
+from string import ascii_letters
+
+PORT = 7687
+DOCUMENT_SIZE = 20000
+LOAD_PROCESSES = max(1, cpu_count() // 2)
+
+
+def run_load(port, first_id, connections, seconds):
+    """ Run load connections against a server, printing the reply count.
+    """
+    from twisted.internet import reactor
+    from twisted.internet.protocol import ClientFactory, Protocol
+    from colliberation.packets import make_packet, parse_packets
+    from colliberation.patching import apply_patches, fragile_dmp
+
+    random = Random(first_id)
+    replies = [0]
+
+    class LoadProtocol(Protocol):
+
+        def __init__(self, document_id):
+            self.document_id = document_id
+            self.buffer = ''
+            self.text = ''.join(random.choice(ascii_letters)
+                                for _ in xrange(DOCUMENT_SIZE))
+            self.shadow = ''
+
+        def connectionMade(self):
+            self.transport.write(
+                make_packet('handshake', username='load', session='') +
+                make_packet('document_added', document_id=self.document_id,
+                            version=0, document_name=str(self.document_id)) +
+                make_packet('document_opened', document_id=self.document_id,
+                            version=0))
+
+        def dataReceived(self, data):
+            self.buffer += data
+            packets, self.buffer = parse_packets(self.buffer)
+            for header, payload in packets:
+                if header == 20:
+                    self.text_modified(payload)
+
+        def text_modified(self, payload):
+            replies[0] += 1
+            patches = fragile_dmp.patch_fromText(payload.modifications)
+            self.shadow = apply_patches(patches, self.shadow, fragile_dmp)[0]
+            self.text = apply_patches(patches, self.text, fragile_dmp)[0]
+
+            position = random.randint(0, len(self.text))
+            self.text = (self.text[:position] + random.choice(ascii_letters) +
+                         self.text[position + 1:])
+            patches = fragile_dmp.patch_make(self.shadow, self.text)
+            self.shadow = self.text
+            self.transport.write(make_packet(
+                'text_modified', document_id=self.document_id, version=0,
+                modifications=fragile_dmp.patch_toText(patches),
+                hash=str(hash(self.shadow))))
+
+    class LoadFactory(ClientFactory):
+
+        def __init__(self, document_id):
+            self.document_id = document_id
+
+        def buildProtocol(self, addr):
+            return LoadProtocol(self.document_id)
+
+    for document_id in xrange(first_id, first_id + connections):
+        reactor.connectTCP('127.0.0.1', port, LoadFactory(document_id))
+
+    def measure():
+        replies[0] = 0
+        reactor.callLater(seconds, finish)
+
+    def finish():
+        print(replies[0])
+        sys.stdout.flush()
+        reactor.stop()
+
+    # Give connections time to open their documents before measuring.
+    reactor.callLater(2, measure)
+    reactor.run()
+
+
+def run_workers(workers, connections, seconds):
+    null = open(os.devnull, 'w')
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(root_path, 'start_server.py'),
+         '--port', str(PORT), '--workers', str(workers)],
+        stdout=null, stderr=null)
+    time.sleep(2 + workers * .5)
+
+    per_process = max(1, connections // LOAD_PROCESSES)
+    loads = [
+        subprocess.Popen(
+            [sys.executable, __file__, '--load', str(PORT),
+             str(1 + index * per_process), str(per_process), str(seconds)],
+            stdout=subprocess.PIPE)
+        for index in xrange(LOAD_PROCESSES)
+    ]
+    total = sum(int(load.communicate()[0].strip() or 0) for load in loads)
+
+    server.send_signal(signal.SIGTERM)
+    time.sleep(1)
+    server.kill()
+    server.wait()
+    return total / float(seconds)
+
+
+def main(max_workers=cpu_count(), connections=200, seconds=10):
+    print('{0:>8} {1:>12} {2:>8}'.format('workers', 'replies/s', 'speedup'))
+    baseline = None
+    for workers in xrange(1, max_workers + 1):
+        rate = run_workers(workers, connections, seconds)
+        baseline = baseline or rate
+        print('{0:>8} {1:>12.1f} {2:>8.2f}'.format(
+            workers, rate, rate / baseline if baseline else 0))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--load']:
+        run_load(*[int(arg) for arg in sys.argv[2:]])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
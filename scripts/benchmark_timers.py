@@ -0,0 +1,140 @@
+#!/user/bin/python27
+"""
+Measures the reactor's overhead for pinging and timing out idle
+connections.
+
+The given number of server connections are left idle but for the client's
+pings, for the given number of seconds, with the ping rate and timeout
+scaled down to a couple of seconds so that every timer runs many times.
+Each connection either has its own ping loop and timeout call, as clients
+do, or is driven by the factory's timer wheel. The timed calls the reactor
+holds and the CPU time the process used are printed for both.
+
+Usage: benchmark_timers.py [connections] [seconds]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import resource
+import subprocess
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.protocols.policies import TimeoutMixin
+
+import colliberation.protocol
+from colliberation.packets import make_packet
+from colliberation.protocol import CollaborationProtocol
+from colliberation.server.factory import CollabServerFactory
+from colliberation.server.protocol import CollabServerProtocol
+
+PING_RATE = 2
+TIMEOUT = 6
+# Client pings are fed to a slice of the connections this often.
+FEED_INTERVAL = 0.1
+
+
+class CountingTransport(object):
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def loseConnection(self):
+        pass
+
+
+class LoopProtocol(CollabServerProtocol):
+
+    """ A server connection with its own ping loop and timeout call.
+    """
+    setTimeout = TimeoutMixin.setTimeout
+    resetTimeout = TimeoutMixin.resetTimeout
+    start_heartbeat = CollaborationProtocol.start_heartbeat
+
+
+def connect(connections, protocol_class):
+    factory = CollabServerFactory()
+    protocols = []
+    for index in xrange(connections):
+        protocol = protocol_class(factory=factory, timeout=TIMEOUT)
+        protocol.timeout_rate = PING_RATE
+        protocol.makeConnection(CountingTransport())
+        protocols.append(protocol)
+    return factory, protocols
+
+
+def feeder(protocols):
+    """ Feed every connection a ping each PING_RATE seconds, a slice at a
+    time.
+    """
+    ping = make_packet('ping', sent=0, echo=0)
+    slices = int(PING_RATE / FEED_INTERVAL)
+    state = {'slice': 0}
+
+    def feed():
+        for protocol in protocols[state['slice']::slices]:
+            protocol.dataReceived(ping)
+        state['slice'] = (state['slice'] + 1) % slices
+    return LoopingCall(feed)
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(mode, connections, seconds):
+    colliberation.protocol.DEBUG = False
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    protocol_class = LoopProtocol if mode == 'loops' else CollabServerProtocol
+    factory, protocols = connect(connections, protocol_class)
+    feed = feeder(protocols)
+
+    samples = []
+    sample = LoopingCall(
+        lambda: samples.append(len(reactor.getDelayedCalls())))
+    start = cpu_seconds()
+    feed.start(FEED_INTERVAL)
+    sample.start(1, now=False)
+    reactor.callLater(seconds, reactor.stop)
+    reactor.run()
+    elapsed = cpu_seconds() - start
+
+    sys.stdout = stdout
+    pings = sum(protocol.transport.writes for protocol in protocols)
+    print('{0} {1} {2} {3}'.format(max(samples), pings, elapsed,
+                                   sum(not p.connected for p in protocols)))
+
+
+def main(connections=10000, seconds=20):
+    print('{0} idle connections for {1} seconds, pinged every {2}s, timing '
+          'out after {3}s'.format(connections, seconds, PING_RATE, TIMEOUT))
+    print('{0:>8} {1:>14} {2:>10} {3:>10} {4:>9}'.format(
+        '', 'timed calls', 'pings', 'cpu s', 'timeouts'))
+    for mode in ('loops', 'wheel'):
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), mode,
+            str(connections), str(seconds)])
+        calls, pings, elapsed, timeouts = output.split()
+        print('{0:>8} {1:>14} {2:>10} {3:>10.2f} {4:>9}'.format(
+            mode, calls, pings, float(elapsed), timeouts))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] in (['loops'], ['wheel']):
+        run(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+#!/user/bin/python27
+"""
+Rewrites documents saved as pickles by DiskSerializer in the binary document
+format, in place. Files already in the binary format are left alone.
+
+Usage: migrate_documents.py <file or directory> [...]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from urllib import pathname2url
+from urlparse import urljoin
+
+from colliberation.serializer import BinarySerializer
+
+
+def document_paths(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, _, names in os.walk(path):
+            for name in names:
+                yield os.path.join(directory, name)
+
+
+def main(paths):
+    serializer = BinarySerializer()
+    migrated = skipped = failed = 0
+    for path in document_paths(paths):
+        url = urljoin('file:', pathname2url(os.path.abspath(path)))
+        try:
+            if serializer.migrate_document(url):
+                migrated += 1
+            else:
+                skipped += 1
+        except Exception as error:
+            print('Could not migrate {0}: {1}'.format(path, error))
+            failed += 1
+    print('{0} migrated, {1} already binary, {2} failed.'.format(
+        migrated, skipped, failed))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,121 @@
+#!/user/bin/python27
+"""
+Exercises cluster mode with several local server processes.
+
+Three nodes are started and documents are written through one of them and
+read back through another. A fourth node then joins, and the first node
+leaves, with the documents read back after each membership change.
+
+Usage: test_cluster.py [document count]
+"""
+import os
+import sys
+# Hack to allow us to import external libraries
+__path__ = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(__path__)
+for path in (root_path, os.path.join(root_path, 'libs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import signal
+import subprocess
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList, inlineCallbacks
+from twisted.internet.task import deferLater
+
+from colliberation import protocol
+from colliberation.document import Document
+from colliberation.server.cluster import transfer_document
+
+FIRST_PORT = 7101
+PEER_OFFSET = 100
+SETTLE_TIME = 3
+
+nodes = {}
+
+
+def start_node(index, seed=None):
+    port = FIRST_PORT + index
+    args = [sys.executable, os.path.join(root_path, 'start_server.py'),
+            '--port', str(port), '--peer-port', str(port + PEER_OFFSET)]
+    if seed is not None:
+        args += ['--seed', '127.0.0.1:{0}'.format(
+            FIRST_PORT + seed + PEER_OFFSET)]
+    log = open(os.devnull, 'w')
+    nodes[index] = subprocess.Popen(args, stdout=log, stderr=log)
+
+
+def stop_node(index):
+    process = nodes.pop(index)
+    process.send_signal(signal.SIGTERM)
+    return process
+
+
+def make_document(document_id):
+    return Document(id=document_id, name='doc{0}.txt'.format(document_id))
+
+
+def expected_content(document_id):
+    return 'Contents of document {0}.\n'.format(document_id) * 3
+
+
+def write_documents(index, count):
+    address = ('127.0.0.1', FIRST_PORT + index)
+    return DeferredList([
+        transfer_document(address, make_document(document_id),
+                          expected_content(document_id))
+        for document_id in xrange(1, count + 1)
+    ], consumeErrors=True)
+
+
+@inlineCallbacks
+def check_documents(index, count, stage):
+    address = ('127.0.0.1', FIRST_PORT + index)
+    results = yield DeferredList([
+        transfer_document(address, make_document(document_id))
+        for document_id in xrange(1, count + 1)
+    ], consumeErrors=True)
+
+    failures = [document_id for document_id, (success, content)
+                in enumerate(results, 1)
+                if not success or content != expected_content(document_id)]
+    print('{0}: {1}/{2} documents intact through node {3}'.format(
+        stage, count - len(failures), count, index))
+
+
+@inlineCallbacks
+def scenario(count):
+    try:
+        yield write_documents(0, count)
+        yield check_documents(2, count, 'Three nodes')
+
+        start_node(3, seed=1)
+        yield deferLater(reactor, SETTLE_TIME, lambda: None)
+        yield check_documents(3, count, 'Node 3 joined')
+
+        leaving = stop_node(0)
+        yield deferLater(reactor, SETTLE_TIME, lambda: None)
+        leaving.kill()
+        yield check_documents(1, count, 'Node 0 left')
+    finally:
+        reactor.stop()
+
+
+def main(count=10):
+    protocol.DEBUG = False
+    start_node(0)
+    time.sleep(1)
+    start_node(1, seed=0)
+    start_node(2, seed=0)
+    try:
+        reactor.callLater(SETTLE_TIME, scenario, count)
+        reactor.run()
+    finally:
+        for process in nodes.values():
+            process.kill()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
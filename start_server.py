@@ -12,10 +12,20 @@ libs_path = os.path.join(__path__, 'libs')
 if libs_path not in sys.path:
     sys.path.insert(0, libs_path)
 
+from argparse import ArgumentParser
+
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.internet.protocol import ProcessProtocol
+from colliberation.history import REVISION_LIMIT
 from colliberation.server.factory import CollabServerFactory
+from colliberation.server.scheduler import OPERATION_LIMIT
+from colliberation.server.sessions import GRACE_PERIOD, SESSIONS_NAME
+from colliberation.server.router import (RouterFactory, ShardMap,
+                                         wait_for_backends)
+from colliberation.server.cluster import ClusterNode
 from colliberation.packets import make_packet
+from colliberation.workers import make_executor, executors
 from twisted.manhole.telnet import ShellFactory
 
 
@@ -25,9 +35,184 @@ packets = {
            }
 
 
+def parse_arguments():
+    parser = ArgumentParser(description='Start a colliberation server.')
+    parser.add_argument('--port', type=int, default=6687)
+    parser.add_argument('--executor', choices=sorted(executors),
+                        default='inline',
+                        help='Where diffing and patching work is run.')
+    parser.add_argument('--executor-size', type=int, default=None,
+                        help='Number of executor threads or processes.')
+    parser.add_argument('--cache-size', type=int, default=None,
+                        help='Megabytes of document content kept in memory '
+                             'before unused documents are spilled to disk.')
+    parser.add_argument('--idle-ttl', type=int, default=None,
+                        help='Seconds before an unused document is spilled '
+                             'to disk.')
+    parser.add_argument('--spill-directory', default=None,
+                        help='Where spilled documents are stored. Each '
+                             'worker uses a subdirectory of its own.')
+    parser.add_argument('--journal-directory', default=None,
+                        help='Persist documents as snapshots and edit logs '
+                             'in this directory, recovering them on start. '
+                             'Each worker uses a subdirectory of its own.')
+    parser.add_argument('--revision-limit', type=int, default=REVISION_LIMIT,
+                        help='Versions of each document kept in memory, '
+                             'as the "revision limit" setting.')
+    parser.add_argument('--grace-period', type=int, default=GRACE_PERIOD,
+                        help='Seconds a lost connection may be resumed for '
+                             'without reopening its documents.')
+    parser.add_argument('--operation-limit', type=int,
+                        default=OPERATION_LIMIT,
+                        help='Edits each connection may start per second, '
+                             'as the "operation limit" setting, or 0 for '
+                             'no limit.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Shard documents across this many worker '
+                             'processes, behind a front router.')
+    parser.add_argument('--worker-port', type=int, default=None,
+                        help='First port used by worker processes '
+                             '(defaults to the port after --port).')
+    parser.add_argument('--worker', action='store_true',
+                        help='Run as a worker process for a front router.')
+    parser.add_argument('--peer-port', type=int, default=None,
+                        help='Run as a cluster node, serving other nodes '
+                             'on this port.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Host other cluster nodes reach this node at.')
+    parser.add_argument('--seed', action='append', default=[],
+                        metavar='HOST:PORT',
+                        help='Peer port of an existing cluster node to join.')
+    return parser.parse_args()
+
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def make_server_factory(arguments):
+    executor = make_executor(arguments.executor, arguments.executor_size)
+    cache_size = arguments.cache_size
+    if cache_size is not None:
+        cache_size *= 1024 * 1024
+    operation_limit = arguments.operation_limit or None
+    sessions_name = SESSIONS_NAME
+    if arguments.worker:
+        sessions_name = '{0}-{1}'.format(worker_name(arguments.port),
+                                         SESSIONS_NAME)
+    return CollabServerFactory(executor=executor, cache_size=cache_size,
+                               idle_ttl=arguments.idle_ttl,
+                               spill_directory=arguments.spill_directory,
+                               journal_directory=arguments.journal_directory,
+                               revision_limit=arguments.revision_limit,
+                               grace_period=arguments.grace_period,
+                               operation_limit=operation_limit,
+                               sessions_name=sessions_name)
+
+
+def worker_name(port):
+    return 'worker-{0}'.format(port)
+
+
+def worker_directory(directory, port):
+    """ Return a worker's own subdirectory of a directory, creating it.
+
+    Workers hold different shards of the documents, so they can't share
+    journals or spilled documents.
+    """
+    path = os.path.join(directory, worker_name(port))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def start_workers(arguments):
+    """ Spawn worker server processes, returning their addresses.
+    """
+    first_port = arguments.worker_port or arguments.port + 1
+    addresses = []
+    processes = []
+    for port in range(first_port, first_port + arguments.workers):
+        args = [sys.executable, __file__, '--worker',
+                '--port', str(port),
+                '--executor', arguments.executor]
+        for option in ('executor_size', 'cache_size', 'idle_ttl',
+                       'spill_directory', 'journal_directory',
+                       'revision_limit', 'grace_period', 'operation_limit'):
+            value = getattr(arguments, option)
+            if value is not None and option in ('spill_directory',
+                                                'journal_directory'):
+                value = worker_directory(value, port)
+            if value is not None:
+                args += ['--' + option.replace('_', '-'), str(value)]
+        processes.append(reactor.spawnProcess(
+            ProcessProtocol(), sys.executable, args,
+            env=os.environ, childFDs={0: 'w', 1: 1, 2: 2}
+        ))
+        addresses.append(('127.0.0.1', port))
+
+    def stop_workers():
+        for process in processes:
+            if process.pid is not None:
+                process.signalProcess('TERM')
+    reactor.addSystemEventTrigger('before', 'shutdown', stop_workers)
+    return addresses
+
+
+def start_router(arguments):
+    """ Start worker processes, and route client connections to them.
+    """
+    addresses = start_workers(arguments)
+    router_factory = RouterFactory(ShardMap(addresses))
+
+    def listen(result):
+        print('Routing port {0} to {1} workers.'.format(
+            arguments.port, len(addresses)))
+        TCP4ServerEndpoint(reactor, arguments.port).listen(router_factory)
+
+    def failed(failure):
+        print('Workers failed to start: {0}'.format(failure.value))
+        reactor.stop()
+
+    wait_for_backends(addresses).addCallbacks(listen, failed)
+    reactor.run()
+
+
+def start_worker(arguments):
+    """ Serve documents for a front router, on the loopback interface.
+    """
+    server_factory = make_server_factory(arguments)
+    TCP4ServerEndpoint(reactor, arguments.port,
+                       interface='127.0.0.1').listen(server_factory)
+    reactor.run()
+
+
+def start_cluster_node(arguments):
+    """ Join a cluster of nodes, each serving a share of the documents.
+    """
+    server_factory = make_server_factory(arguments)
+    node = ClusterNode((arguments.host, arguments.peer_port), server_factory,
+                       [parse_address(seed) for seed in arguments.seed])
+
+    TCP4ServerEndpoint(reactor, arguments.peer_port).listen(server_factory)
+    TCP4ServerEndpoint(reactor, arguments.port).listen(node.router_factory)
+    reactor.addSystemEventTrigger('before', 'shutdown', node.leave)
+    reactor.callWhenRunning(node.start)
+    reactor.run()
+
+
 def main():
-    port = 6687
-    server_factory = CollabServerFactory()
+    arguments = parse_arguments()
+    if arguments.worker:
+        return start_worker(arguments)
+    if arguments.peer_port:
+        return start_cluster_node(arguments)
+    if arguments.workers:
+        return start_router(arguments)
+
+    port = arguments.port
+    server_factory = make_server_factory(arguments)
     shell_factory = ShellFactory()
 
     server_endpoint = TCP4ServerEndpoint(reactor, port)
@@ -61,5 +246,6 @@ if __name__ == '__main__':
         print(traceback.format_exc())
         raw_input()
     else:
-        import time
-        time.sleep(30)
+        if '--worker' not in sys.argv and '--peer-port' not in sys.argv:
+            import time
+            time.sleep(30)